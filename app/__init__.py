@@ -1,16 +1,21 @@
+import os
+
 from flask import Flask
-from flask_migrate import Migrate
 from flask_smorest import Api
 from flask_sqlalchemy import SQLAlchemy
 
 from app.common.auth import CognitoAuth
+from app.common.cache import response_cache
 from app.common.docs import build_spec_security
+from app.common.instrumentation import SQLInstrumentation
+from app.common.metrics import Metrics
 
 s_api = Api()
 
 db = SQLAlchemy()
-migrate = Migrate()
 auth = CognitoAuth()
+sql_instrumentation = SQLInstrumentation()
+metrics = Metrics()
 
 
 def create_app(test_config=None):
@@ -30,7 +35,20 @@ def create_app(test_config=None):
     from app import models  # pylint: disable=cyclic-import # noqa
 
     db.init_app(app)
-    migrate.init_app(app, db)
+    # snowflake key pair authentication
+    key_provider = app.config.get("SNOWFLAKE_PRIVATE_KEY_PROVIDER")
+    if key_provider is not None:
+        with app.app_context():
+            key_provider.register(db.engine)
+    # the db commands are only run through the flask CLI, alembic is a heavy
+    # import workers do not need
+    if app.config.get("MIGRATE_ENABLED", os.environ.get("FLASK_RUN_FROM_CLI")):
+        from flask_migrate import Migrate
+
+        Migrate(app, db)
+    sql_instrumentation.init_app(app)
+    metrics.init_app(app)
+    response_cache.init_app(app)
 
     # initiate the api
     s_api.init_app(app)
@@ -45,6 +63,11 @@ def create_app(test_config=None):
 
     s_api.register_blueprint(blp_v1, url_prefix="/v1")
 
+    # write-behind buffer of the pipeline task writes
+    from app.v1.metadata import task_buffer  # noqa
+
+    task_buffer.init_app(app)
+
     # register error blueprint
     from app.errors import errors as blp_errors  # noqa
 
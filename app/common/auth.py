@@ -1,11 +1,23 @@
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
 from collections import OrderedDict
 from functools import wraps
 
-from cognitojwt import CognitoJWTException, decode as cognito_jwt_decode
+import requests
+from cognitojwt import CognitoJWTException
+from cognitojwt.constants import PUBLIC_KEYS_URL_TEMPLATE
+from cognitojwt.token_utils import check_expired
 from flask import current_app, jsonify, request, g
-from jose.exceptions import JWTError
+from jose import jwk, jwt
+from jose.exceptions import JWKError, JWTError
+from jose.utils import base64url_decode
 from werkzeug.local import LocalProxy
 
+from app.common.instrumentation import add_server_timing
 from app.common.logging import get_logger
 
 LOGGER = get_logger(__name__)
@@ -14,6 +26,14 @@ CONFIG_DEFAULTS = {
     "COGNITO_CHECK_TOKEN_EXPIRATION": True,
     "COGNITO_JWT_HEADER_NAME": "Authorization",
     "COGNITO_JWT_HEADER_PREFIX": "Bearer",
+    # JWKS key cache
+    "COGNITO_JWKS_CACHE_TTL": 3600,  # seconds
+    "COGNITO_JWKS_BACKGROUND_REFRESH": True,
+    "COGNITO_JWKS_MIN_REFETCH_INTERVAL": 30,  # seconds, unknown kid refetch limit
+    "COGNITO_JWKS_REQUEST_TIMEOUT": 5,  # seconds
+    # verified token cache
+    "COGNITO_TOKEN_CACHE_ENABLED": True,
+    "COGNITO_TOKEN_CACHE_SIZE": 1024,
 }
 
 # user from pool
@@ -22,6 +42,8 @@ current_user = LocalProxy(lambda: getattr(g, "user", None))
 # access initialized cognito extension
 _cog = LocalProxy(lambda: current_app.extensions["cognito_auth"])
 
+_UNSET = object()
+
 
 # User models which holds the logged-in service user and scopes
 class ServiceUser:
@@ -50,6 +72,177 @@ class CognitoAuthError(Exception):
         return f"{self.error} - {self.description}"
 
 
+class JWKSCache:
+    """
+    Per-worker cache of the user pool public keys, keyed by ``kid``.
+
+    Keys are fetched once and kept for ``ttl`` seconds. When background refresh
+    is enabled a daemon thread re-fetches them before they expire, so requests
+    never wait on Cognito. An unknown ``kid`` (key rotation) triggers a single
+    re-fetch, rate limited by ``min_refetch_interval``. If a re-fetch fails the
+    previously fetched keys keep being served, failed fetches are retried after
+    ``min_refetch_interval``.
+    """
+
+    def __init__(
+        self,
+        keys_url,
+        ttl=3600,
+        background_refresh=True,
+        min_refetch_interval=30,
+        request_timeout=5,
+    ):
+        self.keys_url = keys_url
+        self.ttl = ttl
+        self.background_refresh = background_refresh
+        self.min_refetch_interval = min_refetch_interval
+        self.request_timeout = request_timeout
+        self._keys = {}
+        self._fetched_at = None
+        self._last_fetch_attempt = None
+        self._lock = threading.Lock()
+        # threads do not survive a fork, track the owner process of the thread
+        self._refresh_thread_pid = None
+        self._refresh_thread_lock = threading.Lock()
+
+    def _fetch_keys(self):
+        """Fetch jwks.json from the user pool (or a local file) and build keys."""
+        if self.keys_url.startswith("http"):
+            response = requests.get(self.keys_url, timeout=self.request_timeout)
+            response.raise_for_status()
+            keys_response = response.json()
+        else:
+            with open(self.keys_url, "r", encoding="utf-8") as file:
+                keys_response = json.load(file)
+        return {key["kid"]: jwk.construct(key) for key in keys_response["keys"]}
+
+    def refresh(self, seen_attempt=_UNSET):
+        """
+        Re-fetch the keys, keeping the current ones if the fetch fails.
+        :param seen_attempt: last fetch attempt observed by the caller, the fetch
+            is skipped if another thread fetched in the meantime
+        """
+        with self._lock:
+            if seen_attempt is not _UNSET and seen_attempt != self._last_fetch_attempt:
+                return True
+            self._last_fetch_attempt = time.monotonic()
+            try:
+                keys = self._fetch_keys()
+            except (requests.RequestException, OSError, ValueError, KeyError) as exc:
+                LOGGER.error("Unable to fetch Cognito JWKS", exc_info=exc)
+                return False
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+            return True
+
+    def is_expired(self):
+        return (
+            self._fetched_at is None or time.monotonic() - self._fetched_at >= self.ttl
+        )
+
+    def _can_refetch(self):
+        return (
+            self._last_fetch_attempt is None
+            or time.monotonic() - self._last_fetch_attempt >= self.min_refetch_interval
+        )
+
+    def _ensure_refresh_thread(self):
+        if not self.background_refresh or self._refresh_thread_pid == os.getpid():
+            return
+        # threaded workers, only the first request of the process starts it
+        with self._refresh_thread_lock:
+            if self._refresh_thread_pid == os.getpid():
+                return
+            self._refresh_thread_pid = os.getpid()
+            thread = threading.Thread(
+                target=self._refresh_loop, name="cognito-jwks-refresh", daemon=True
+            )
+            thread.start()
+
+    def _refresh_loop(self):
+        # refresh ahead of expiry so the request path never hits a stale cache
+        interval = max(self.ttl * 0.8, 1)
+        while True:
+            time.sleep(interval)
+            self.refresh()
+
+    def get_key(self, kid):
+        """Get public key by kid, returns None if the user pool does not know it."""
+        self._ensure_refresh_thread()
+        # failed fetches, the first one included, are retried after
+        # min_refetch_interval only
+        if self.is_expired() and self._can_refetch():
+            self.refresh(self._last_fetch_attempt)
+
+        key = self._keys.get(kid)
+        if key is None and self._can_refetch():
+            # keys might have been rotated, re-fetch once
+            self.refresh(self._last_fetch_attempt)
+            key = self._keys.get(kid)
+        return key
+
+
+class TokenCache:
+    """
+    Bounded LRU cache of verified tokens, keyed by the token hash.
+
+    Holds a copy of the decoded payload and the identity of the ``ServiceUser``
+    so that a repeated bearer token skips signature verification. Every hit gets
+    its own payload and user, requests mutating them do not change the entry.
+    An entry is never served after the token ``exp``, tokens without ``exp``
+    are not cached.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get(self, token):
+        """Get (payload, user) for the token, None if not cached or expired."""
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() >= entry[0]:
+                # expired, drop it
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        _, payload, client_id, scopes = entry
+        return copy.deepcopy(payload), ServiceUser(client_id, list(scopes))
+
+    def set(self, token, payload, user):
+        exp = payload.get("exp")
+        if not exp or self.maxsize <= 0:
+            return
+        key = self._key(token)
+        entry = (exp, copy.deepcopy(payload), user.client_id, tuple(user.scopes))
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
 class CognitoAuth:
     def __init__(self, app=None):
         self.app = app
@@ -68,6 +261,25 @@ class CognitoAuth:
         self.jwt_header_prefix = self._get_required_config(
             app, "COGNITO_JWT_HEADER_PREFIX"
         )
+        self.check_token_expiration = app.config["COGNITO_CHECK_TOKEN_EXPIRATION"]
+
+        # public key cache, env var is kept for parity with cognitojwt
+        keys_url = os.environ.get(
+            "AWS_COGNITO_JWKS_PATH"
+        ) or PUBLIC_KEYS_URL_TEMPLATE.format(self.region, self.userpool_id)
+        self.jwks = JWKSCache(
+            keys_url,
+            ttl=app.config["COGNITO_JWKS_CACHE_TTL"],
+            background_refresh=app.config["COGNITO_JWKS_BACKGROUND_REFRESH"],
+            min_refetch_interval=app.config["COGNITO_JWKS_MIN_REFETCH_INTERVAL"],
+            request_timeout=app.config["COGNITO_JWKS_REQUEST_TIMEOUT"],
+        )
+        # verified token cache, None when disabled
+        self.token_cache = (
+            TokenCache(app.config["COGNITO_TOKEN_CACHE_SIZE"])
+            if app.config["COGNITO_TOKEN_CACHE_ENABLED"]
+            else None
+        )
 
         # save for localproxy
         app.extensions["cognito_auth"] = self
@@ -151,12 +363,22 @@ class CognitoAuth:
         )
 
     def decode_token(self, token):
-        """Decode token."""
+        """Decode token, verifying its signature against the cached user pool keys."""
         try:
-            return cognito_jwt_decode(
-                token=token, region=self.region, userpool_id=self.userpool_id
-            )
-        except (ValueError, JWTError) as exc:
+            message, encoded_signature = str(token).rsplit(".", 1)
+            kid = jwt.get_unverified_headers(token)["kid"]
+            public_key = self.jwks.get_key(kid)
+            if public_key is None:
+                raise CognitoJWTException("Public key not found in jwks.json")
+
+            decoded_signature = base64url_decode(encoded_signature.encode("utf-8"))
+            if not public_key.verify(message.encode("utf-8"), decoded_signature):
+                raise CognitoJWTException("Signature verification failed")
+
+            claims = jwt.get_unverified_claims(token)
+            check_expired(claims["exp"], testmode=not self.check_token_expiration)
+            return claims
+        except (ValueError, KeyError, JWTError, JWKError) as exc:
             raise CognitoJWTException("Malformed Authentication Token") from exc
 
 
@@ -166,7 +388,11 @@ def auth_required(func):
 
     @wraps(func)
     def decorator(*args, **kwargs):
-        _auth_required()
+        start = time.perf_counter()
+        try:
+            _auth_required()
+        finally:
+            add_server_timing("auth", time.perf_counter() - start)
         return func(*args, **kwargs)
 
     return decorator
@@ -220,6 +446,13 @@ def _auth_required():
             f'Request does not contain a access token in the "{auth_header_name}" header.',  # noqa
         )
 
+    # token already verified by this worker
+    token_cache = _cog.token_cache
+    cached = token_cache.get(token) if token_cache is not None else None
+    if cached is not None:
+        g.cognito_jwt, g.user = cached
+        return
+
     try:
         # check if token is signed by user pool
         payload = _cog.decode_token(token=token)
@@ -231,3 +464,5 @@ def _auth_required():
 
     g.cognito_jwt = payload
     g.user = _cog.get_user(payload)
+    if token_cache is not None:
+        token_cache.set(token, payload, g.user)
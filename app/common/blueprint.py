@@ -2,21 +2,212 @@
 """
 Blueprint adapter
 """
+import http
+import time
+from copy import deepcopy
+from functools import wraps
 
+import marshmallow as ma
+from flask import g, request
 from flask_smorest import Blueprint
+from flask_smorest.pagination import (
+    PaginationParameters,
+    _pagination_parameters_schema_factory,
+)
+from flask_smorest.utils import unpack_tuple_response
+from marshmallow_enum import EnumField
+
+from app.common.instrumentation import add_server_timing
+from app.constants import CountMode
+
+
+class ListPaginationParameters(PaginationParameters):
+    """Holds list pagination arguments
+
+    :param CountMode count: How total number of items is counted
+    :param str cursor: Opaque cursor of the last item of the previous page,
+        empty for the first page, None when paginating by page number
+    """
+
+    def __init__(self, page=1, page_size=None, count=None, cursor=None):
+        super().__init__(page, page_size)
+        self.cursor = cursor
+        # cursor pages are not counted unless asked for
+        if count is None:
+            count = CountMode.NONE if cursor is not None else CountMode.EXACT
+        self.count = count
+        # mode that actually produced item_count
+        self.count_mode = None
+        # set by uncounted page number pagination
+        self.has_next = None
+        self.next_cursor = None
+
+    @property
+    def is_cursor(self):
+        return self.cursor is not None
+
+
+def _list_pagination_parameters_schema_factory(
+    def_page, def_page_size, def_max_page_size, cursor=False, keyset_only=False
+):
+    """Generate a schema deserializing list pagination params"""
+
+    class ListPaginationParametersSchema(
+        _pagination_parameters_schema_factory(
+            def_page, def_page_size, def_max_page_size
+        )
+    ):
+        count = EnumField(CountMode, by_value=True)
+
+        @ma.post_load
+        def make_paginator(self, data, **kwargs):
+            return ListPaginationParameters(**data)
+
+    if not cursor:
+        return ListPaginationParametersSchema
+
+    class CursorPaginationParametersSchema(ListPaginationParametersSchema):
+        cursor = ma.fields.String()
+
+    if not keyset_only:
+        return CursorPaginationParametersSchema
+
+    class KeysetPaginationParametersSchema(CursorPaginationParametersSchema):
+        cursor = ma.fields.String(load_default="")
+
+        class Meta:
+            exclude = ("page",)
+
+    return KeysetPaginationParametersSchema
 
 
 class EnhancedBlueprint(Blueprint):
+    def response(self, *args, **kwargs):
+        """Decorator serializing the response, timing the serialization
+
+        Time spent in the decorated view is subtracted from the time spent in
+        the response wrapper, the rest is dumping and encoding the result.
+        """
+        response_decorator = super().response(*args, **kwargs)
+
+        def decorator(func):
+            @wraps(func)
+            def view(*f_args, **f_kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*f_args, **f_kwargs)
+                finally:
+                    g.view_duration = time.perf_counter() - start
+
+            wrapper = response_decorator(view)
+
+            @wraps(wrapper)
+            def timed_wrapper(*f_args, **f_kwargs):
+                start = time.perf_counter()
+                g.view_duration = 0.0
+                resp = wrapper(*f_args, **f_kwargs)
+                add_server_timing(
+                    "serialization", time.perf_counter() - start - g.view_duration
+                )
+                return resp
+
+            return timed_wrapper
+
+        return decorator
+
+    def paginate(
+        self,
+        pager=None,
+        *,
+        cursor=False,
+        keyset_only=False,
+        page=None,
+        page_size=None,
+        max_page_size=None,
+    ):
+        """Decorator adding pagination to the endpoint
+
+        ``count`` (exact, cached or none) selects how the total number of items
+        is computed. With ``cursor=True`` the endpoint also accepts keyset
+        pagination, requested by passing ``cursor`` (empty for the first page).
+        ``keyset_only=True`` drops page numbers, pages are always keyset ones.
+        """
+        if pager is not None:
+            return super().paginate(
+                pager, page=page, page_size=page_size, max_page_size=max_page_size
+            )
+
+        defaults = self.DEFAULT_PAGINATION_PARAMETERS
+        page_params_schema = _list_pagination_parameters_schema_factory(
+            page if page is not None else defaults["page"],
+            page_size if page_size is not None else defaults["page_size"],
+            max_page_size if max_page_size is not None else defaults["max_page_size"],
+            cursor=cursor or keyset_only,
+            keyset_only=keyset_only,
+        )
+        error_status_code = self.PAGINATION_ARGUMENTS_PARSER.DEFAULT_VALIDATION_STATUS
+
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                page_params = self.PAGINATION_ARGUMENTS_PARSER.parse(
+                    page_params_schema, request, location="query"
+                )
+                kwargs["pagination_parameters"] = page_params
+
+                result, status, headers = unpack_tuple_response(func(*args, **kwargs))
+
+                result, headers = self._set_pagination_metadata(
+                    page_params, result, headers
+                )
+                return result, status, headers
+
+            wrapper._apidoc = deepcopy(getattr(wrapper, "_apidoc", {}))
+            wrapper._apidoc["pagination"] = {
+                "parameters": {"in": "query", "schema": page_params_schema},
+                "response": {
+                    error_status_code: http.HTTPStatus(error_status_code).name,
+                },
+            }
+            return wrapper
+
+        return decorator
+
     def _set_pagination_metadata(self, page_params, result, headers):
         """Add pagination metadata to response"""
-        result = {
-            "pagination": self._make_pagination_metadata(
+        if isinstance(page_params, ListPaginationParameters):
+            pagination = self._make_list_pagination_metadata(page_params)
+        else:
+            pagination = self._make_pagination_metadata(
                 page_params.page, page_params.page_size, page_params.item_count
-            ),
+            )
+        result = {
+            "pagination": pagination,
             "results": result,
         }
         return result, headers
 
+    def _make_list_pagination_metadata(self, page_params):
+        """Build pagination metadata, reporting which count mode was used"""
+        if page_params.is_cursor:
+            page_metadata = {"next_cursor": page_params.next_cursor}
+            if page_params.item_count is not None:
+                page_metadata["total"] = page_params.item_count
+        elif page_params.item_count is not None:
+            page_metadata = self._make_pagination_metadata(
+                page_params.page, page_params.page_size, page_params.item_count
+            )
+        else:
+            # not counted, only tell if there are more pages
+            page_metadata = {"page": page_params.page}
+            if page_params.page > 1:
+                page_metadata["previous_page"] = page_params.page - 1
+            if page_params.has_next:
+                page_metadata["next_page"] = page_params.page + 1
+        page_metadata["page_size"] = page_params.page_size
+        page_metadata["count_mode"] = (page_params.count_mode or CountMode.NONE).value
+        return page_metadata
+
     def _document_pagination_metadata(self, spec, resp_doc):
         """Document pagination metadata"""
         # This will already taken cared by paginated_schema_factory
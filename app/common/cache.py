@@ -0,0 +1,312 @@
+"""
+Conditional GET and response cache of the read endpoints
+
+Views declaring ``cache_models`` answer GET requests with an ETag made of the
+count and last ``updated_at`` of the rows the response is read from (a single
+cheap aggregate query), the generation of the cached models, which writes
+through ``app.service`` bump, and the current ``RESPONSE_CACHE_TTL`` window.
+A request whose ``If-None-Match`` holds that ETag gets a 304, any other is
+served from the response cache, keyed by ETag, before falling back to the view.
+Lists only use it for exact counts of page numbered pages (the aggregate
+replaces their count), cursor and uncounted pages are not worth a query over
+all the rows they could be read from: their ETag is the hash of the body.
+
+``RESPONSE_CACHE`` picks where responses and model generations are kept:
+
+- ``local``: in the worker process
+- ``shared``: in the SQLite file ``RESPONSE_CACHE_PATH``, shared by the
+  workers of a host, so that a write through one worker invalidates all of them
+- ``none``: responses are not cached and the freshness of their rows is not
+  queried, ETags are the hash of the response body
+
+ETags rotate every ``RESPONSE_CACHE_TTL`` seconds, changes not going through the
+service (or made through another worker with the local cache) to rows nested in
+a response are seen within that time.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, request
+from sqlalchemy import func
+
+from app.common.logging import get_logger
+
+LOGGER = get_logger(__name__, level="INFO")
+
+CONFIG_DEFAULTS = {
+    "RESPONSE_CACHE": "local",
+    "RESPONSE_CACHE_TTL": 60,
+    "RESPONSE_CACHE_SIZE": 1024,
+    "RESPONSE_CACHE_PATH": os.path.join(
+        tempfile.gettempdir(), "galactic_core_response_cache.sqlite"
+    ),
+}
+
+# generation bumped when models are invalidated without naming them
+ALL_MODELS = "*"
+
+# headers recomputed for every response
+_SKIPPED_HEADERS = {"content-length", "etag", "server-timing"}
+
+
+class LocalCacheBackend:
+    """Bounded LRU cache of the responses of a worker, with model generations"""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.maxsize > 0
+
+    def get(self, key):
+        """(headers, body) cached for the key, None if not cached or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() >= entry[0]:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1], entry[2]
+
+    def set(self, key, headers, body, ttl):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, headers, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def generations(self, names):
+        with self._lock:
+            return [self._generations.get(name, 0) for name in names]
+
+    def invalidate(self, names):
+        with self._lock:
+            for name in names:
+                self._generations[name] = self._generations.get(name, 0) + 1
+
+
+class SQLiteCacheBackend:
+    """
+    Responses and model generations kept in a SQLite file shared by the
+    workers of a host. Errors are logged and handled as cache misses.
+    """
+
+    enabled = True
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self):
+        # sqlite connections are not shared between threads, nor processes:
+        # opened lazily, in the forked worker, never in the preloaded master
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5)
+            with connection:
+                self._create_tables(connection)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    @staticmethod
+    def _create_tables(connection):
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, headers TEXT, body BLOB, expires REAL)"
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_expires ON responses (expires)"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS generations "
+            "(name TEXT PRIMARY KEY, generation INTEGER)"
+        )
+
+    def get(self, key):
+        try:
+            row = (
+                self._connect()
+                .execute(
+                    "SELECT headers, body FROM responses WHERE key = ? AND expires > ?",
+                    (key, time.time()),
+                )
+                .fetchone()
+            )
+        except sqlite3.Error:
+            LOGGER.warning("Response cache read failed", exc_info=True)
+            return None
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, headers, body, ttl):
+        now = time.time()
+        try:
+            with self._connect() as connection:
+                connection.execute("DELETE FROM responses WHERE expires <= ?", (now,))
+                connection.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(headers), body, now + ttl),
+                )
+        except sqlite3.Error:
+            LOGGER.warning("Response cache write failed", exc_info=True)
+
+    def generations(self, names):
+        try:
+            rows = (
+                self._connect()
+                .execute(
+                    "SELECT name, generation FROM generations WHERE name IN "
+                    f"({', '.join('?' * len(names))})",
+                    names,
+                )
+                .fetchall()
+            )
+        except sqlite3.Error:
+            LOGGER.warning("Response cache read failed", exc_info=True)
+            # unknown generations, make sure nothing stale is matched
+            return [time.time()] * len(names)
+        generations = dict(rows)
+        return [generations.get(name, 0) for name in names]
+
+    def invalidate(self, names):
+        try:
+            with self._connect() as connection:
+                connection.executemany(
+                    "INSERT INTO generations VALUES (?, 1) ON CONFLICT (name) "
+                    "DO UPDATE SET generation = generation + 1",
+                    [(name,) for name in names],
+                )
+        except sqlite3.Error:
+            LOGGER.warning("Response cache invalidation failed", exc_info=True)
+
+
+def create_backend(config):
+    kind = config["RESPONSE_CACHE"]
+    if kind == "shared":
+        return SQLiteCacheBackend(config["RESPONSE_CACHE_PATH"])
+    if kind == "local":
+        return LocalCacheBackend(config["RESPONSE_CACHE_SIZE"])
+    if kind == "none":
+        return LocalCacheBackend(0)
+    raise ValueError(f"Unknown RESPONSE_CACHE {kind!r}")
+
+
+class ResponseCache:
+    def __init__(self, app=None):
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        for key, value in CONFIG_DEFAULTS.items():
+            app.config.setdefault(key, value)
+
+        app.extensions["response_cache"] = create_backend(app.config)
+
+    @property
+    def backend(self):
+        return current_app.extensions["response_cache"]
+
+    @property
+    def enabled(self):
+        """Whether responses are cached, the freshness of their rows is only
+        queried then"""
+        return self.backend.enabled
+
+    def invalidate(self, *models):
+        """
+        Change the ETags of the responses read from models, all of them if no
+        model is given
+        """
+        names = [model.__name__ for model in models] or [ALL_MODELS]
+        self.backend.invalidate(names)
+
+    @staticmethod
+    def freshness(query):
+        """(count, last updated_at) of the query rows"""
+        model = query.column_descriptions[0]["entity"]
+        return tuple(
+            query.with_entities(func.count(model.id), func.max(model.updated_at))
+            .order_by(None)
+            .one()
+        )
+
+    def etag(self, freshness, models):
+        """ETag of the response read from rows of freshness and the models"""
+        count, updated_at = freshness
+        names = [ALL_MODELS] + sorted(model.__name__ for model in models)
+        ttl = current_app.config["RESPONSE_CACHE_TTL"]
+        version = [
+            request.full_path,
+            count,
+            updated_at.isoformat() if updated_at else None,
+            self.backend.generations(names),
+            int(time.time() // ttl) if ttl > 0 else 0,
+        ]
+        return hashlib.sha1(json.dumps(version).encode("utf-8")).hexdigest()
+
+    def dispatch(self, freshness, models, view):
+        """
+        Response of the view, 304 when the client has it already, from the
+        cache when another client asked for it already
+        """
+        etag = self.etag(freshness, models)
+        if request.if_none_match.contains(etag):
+            response = current_app.response_class(status=304)
+            response.set_etag(etag)
+            return response
+
+        backend = self.backend
+        cached = backend.get(etag)
+        if cached is not None:
+            headers, body = cached
+            response = current_app.response_class(body, headers=headers)
+        else:
+            response = current_app.make_response(view())
+            if response.status_code != 200:
+                return response
+            headers = [
+                (key, value)
+                for key, value in response.headers.items()
+                if key.lower() not in _SKIPPED_HEADERS
+            ]
+            backend.set(
+                etag,
+                headers,
+                response.get_data(),
+                current_app.config["RESPONSE_CACHE_TTL"],
+            )
+        response.set_etag(etag)
+        return response
+
+    @staticmethod
+    def dispatch_conditional(view):
+        """
+        Response of the view with the hash of its body as ETag, 304 when the
+        client has it already. Nothing is queried besides the view.
+        """
+        response = current_app.make_response(view())
+        if response.status_code == 200:
+            response.add_etag()
+            response.make_conditional(request)
+        return response
+
+
+response_cache = ResponseCache()
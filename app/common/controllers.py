@@ -1,35 +1,285 @@
-from typing import List, Union, Iterable, Any
+import base64
+import binascii
+import json
+import re
+import threading
+import time
+from datetime import datetime
+from typing import List, Union, Iterable, Any, Optional
 
+from flask import abort, current_app, request
 from flask.views import MethodView
 from flask_smorest.pagination import PaginationParameters
+from marshmallow import Schema
 from six import string_types
+from sqlalchemy import and_, inspect, or_
+from sqlalchemy.orm import raiseload
 
 from app.common.auth import auth_required
+from app.common.cache import response_cache
+from app.common.db_utils import load_generic_relationship, projection_options
+from app.constants import CountMode, DEFAULT_COUNT_CACHE_TTL
+
+
+def encode_cursor(value: datetime, _id: int) -> str:
+    """Opaque cursor pointing to an item of (value, id) keyset, e.g. created_at"""
+    payload = json.dumps([value.isoformat() if value else None, _id])
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str):
+    """
+    Decode a cursor generated by encode_cursor, aborts with 400 if invalid.
+    The value is None for items without one.
+    """
+    try:
+        value, _id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if value is not None:
+            value = datetime.fromisoformat(value)
+        return value, int(_id)
+    except (binascii.Error, ValueError, TypeError, UnicodeError):
+        return abort(400, "Invalid pagination cursor")
+
+
+def _query_model(query):
+    return query.column_descriptions[0]["entity"]
+
+
+def _id_kwarg(model):
+    """<model_name>_id url argument of a model, e.g. data_asset_instance_id"""
+    return re.sub(r"(?<!^)(?=[A-Z])", "_", model.__name__).lower() + "_id"
+
+
+def _count(query):
+    """Count rows of the query, its subquery only selects the primary key"""
+    primary_key = inspect(_query_model(query)).primary_key
+    return query.with_entities(*primary_key).order_by(None).count()
+
+
+class CountCache:
+    """
+    Per worker cache of list counts, keyed by model and the query filters.
+
+    Entries live for COUNT_CACHE_TTL seconds, writes going through the service
+    and metadata endpoints invalidate the counts of the models they touch in
+    this worker, other workers catch up when their entries expire.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(query):
+        compiled = query.statement.compile()
+        params = sorted(compiled.params.items())
+        return str(compiled), repr(params)
+
+    def get(self, query):
+        model_entries = self._entries.get(_query_model(query).__name__, {})
+        entry = model_entries.get(self._key(query))
+        if entry is None or time.monotonic() >= entry[1]:
+            return None
+        return entry[0]
+
+    def set(self, query, count):
+        ttl = current_app.config.get("COUNT_CACHE_TTL", DEFAULT_COUNT_CACHE_TTL)
+        with self._lock:
+            model_entries = self._entries.setdefault(_query_model(query).__name__, {})
+            model_entries[self._key(query)] = (count, time.monotonic() + ttl)
+
+    def invalidate(self, *models):
+        """Drop cached counts of models, all of them if no model is given"""
+        with self._lock:
+            if not models:
+                self._entries.clear()
+            for model in models:
+                self._entries.pop(model.__name__, None)
+
+
+count_cache = CountCache()
 
 
 class BaseMethodView(MethodView):
     """Reusable components added to BaseMethodView"""
 
     decorators = [auth_required]
+    # loader options (e.g. selectinload) of the relationships the endpoint
+    # serializes, any other relationship raises instead of lazy loading.
+    # None leaves the model default loading untouched.
+    load_options: Optional[List] = None
+    # generic relationships (e.g. DataAssetInstance.source) the endpoint
+    # serializes, loaded with one query per target type by load_generic
+    generic_loads: List[str] = []
+    # models GET responses are read from, enables their ETag (If-None-Match)
+    # handling and caching, writes to these models through the service change
+    # the ETag. The first one is the model of the view object.
+    # None disables them.
+    cache_models: Optional[List] = None
+    # (count, last updated_at) of the rows of the response, set on GET
+    # requests of views with cache_models
+    freshness: Optional[tuple] = None
+    # url argument of the id of the view object, <model_name>_id by default,
+    # e.g. data_asset_instance_id
+    object_id_kwarg: Optional[str] = None
+
+    def apply_load_options(self, query):
+        if self.load_options is None:
+            return query
+        return query.options(*self.load_options, raiseload("*"))
+
+    def load_generic(self, items):
+        """Load the generic relationships of the items, returns the items"""
+        for key in self.generic_loads:
+            load_generic_relationship(items, key)
+        return items
+
+    def get_freshness_query(self, **kwargs):
+        """Query of the rows the response is read from, they make its ETag"""
+        model = self.cache_models[0]
+        object_id = kwargs[self.object_id_kwarg or _id_kwarg(model)]
+        return model.query.filter(model.id == object_id)
+
+    def use_freshness(self):
+        """Whether the ETag is made of the freshness of the response rows"""
+        return True
+
+    def dispatch_request(self, *args, **kwargs):
+        if self.cache_models is None or request.method not in ("GET", "HEAD"):
+            return super().dispatch_request(*args, **kwargs)
+
+        def view():
+            return super(BaseMethodView, self).dispatch_request(*args, **kwargs)
+
+        if not (response_cache.enabled and self.use_freshness()):
+            return response_cache.dispatch_conditional(view)
+        self.freshness = response_cache.freshness(self.get_freshness_query(**kwargs))
+        return response_cache.dispatch(self.freshness, self.cache_models, view)
 
 
 class ListMethodView(BaseMethodView):
     """Reusable List Method View"""
 
     ordering: Union[List, Any] = None
+    # schema of the listed items, only the columns it dumps are loaded.
+    # None loads all the columns.
+    schema: Optional[Schema] = None
+    # datetime column of the keyset cursor pages, along with id
+    cursor_column = "created_at"
 
     def get_query(self):
         raise NotImplementedError
 
+    def get_freshness_query(self, **kwargs):
+        return self.get_query()
+
+    def use_freshness(self):
+        # the aggregate over all the listed rows replaces the exact count of
+        # page numbered lists, other pages do not count them (or do from the
+        # count cache)
+        return (
+            "cursor" not in request.args
+            and request.args.get("count", CountMode.EXACT.value)
+            == CountMode.EXACT.value
+        )
+
+    def apply_load_options(self, query):
+        query = super().apply_load_options(query)
+        if self.schema is None:
+            return query
+        cls = type(self)
+        if "_projection_options" not in cls.__dict__:
+            # the cursor column & id are read to build the next page cursor
+            cls._projection_options = projection_options(
+                _query_model(query), self.schema, include=(self.cursor_column, "id")
+            )
+        return query.options(*cls._projection_options)
+
     def list(self, pagination_parameters: PaginationParameters):
         """List View"""
-        query = self.apply_order_by(self.get_query())
-        pagination_parameters.item_count = query.count()
+        if getattr(pagination_parameters, "is_cursor", False):
+            return self.list_by_cursor(pagination_parameters)
+
+        query = self.apply_order_by(self.apply_load_options(self.get_query()))
+        page_size = pagination_parameters.page_size
+        if getattr(pagination_parameters, "count", CountMode.EXACT) == CountMode.NONE:
+            # fetch one more item to know if there is a next page
+            items = (
+                query.limit(page_size + 1)
+                .offset(pagination_parameters.first_item)
+                .all()
+            )
+            pagination_parameters.has_next = len(items) > page_size
+            return self.load_generic(items[:page_size])
+
+        pagination_parameters.item_count = self.count(query, pagination_parameters)
         res = query.paginate(
             page=pagination_parameters.page,
-            per_page=pagination_parameters.page_size,
+            per_page=page_size,
+            count=False,
+        )
+        return self.load_generic(res.items)
+
+    def count(self, query, pagination_parameters: PaginationParameters):
+        """Count items of the query as requested by count pagination parameter"""
+        mode = getattr(pagination_parameters, "count", CountMode.EXACT)
+        if self.freshness is not None and mode == CountMode.EXACT:
+            # counted along with the freshness of the response
+            pagination_parameters.count_mode = CountMode.EXACT
+            return self.freshness[0]
+        if mode == CountMode.CACHED:
+            count = count_cache.get(query)
+            if count is not None:
+                pagination_parameters.count_mode = CountMode.CACHED
+                return count
+            count = _count(query)
+            count_cache.set(query, count)
+        else:
+            count = _count(query)
+        pagination_parameters.count_mode = CountMode.EXACT
+        return count
+
+    def list_by_cursor(self, pagination_parameters):
+        """
+        Keyset paginated List View, newest first by (cursor_column, id), items
+        without a cursor_column value last. Each page is a single range query,
+        total is only counted when asked for.
+        """
+        query = self.apply_load_options(self.get_query())
+        model = _query_model(query)
+        column = getattr(model, self.cursor_column)
+
+        if pagination_parameters.count != CountMode.NONE:
+            pagination_parameters.item_count = self.count(query, pagination_parameters)
+
+        if pagination_parameters.cursor:
+            value, _id = decode_cursor(pagination_parameters.cursor)
+            if value is None:
+                query = query.filter(column.is_(None), model.id < _id)
+            else:
+                query = query.filter(
+                    or_(
+                        column < value,
+                        and_(column == value, model.id < _id),
+                        column.is_(None),
+                    )
+                )
+
+        page_size = pagination_parameters.page_size
+        # fetch one more item to know if there is a next page, NULLs sort
+        # first in descending order on Snowflake, last on other dialects
+        items = (
+            query.order_by(column.desc().nullslast(), model.id.desc())
+            .limit(page_size + 1)
+            .all()
         )
-        return res.items
+        if len(items) > page_size:
+            items = items[:page_size]
+            last = items[-1]
+            pagination_parameters.next_cursor = encode_cursor(
+                getattr(last, self.cursor_column), last.id
+            )
+        return self.load_generic(items)
 
     def apply_order_by(self, query):
         if self.ordering is not None:
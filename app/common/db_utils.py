@@ -1,7 +1,21 @@
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+
+import marshmallow as ma
+from sqlalchemy import func, inspect, text, values, column as sa_column
 from sqlalchemy.exc import NoResultFound
+from sqlalchemy.orm import defaultload, load_only
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy_utils.generic import GenericRelationshipProperty
 
 from app import db
 
+SNOWFLAKE_DIALECT = "snowflake"
+
+# ids per IN clause, far below the Snowflake limit of 16384 expressions
+IN_CLAUSE_CHUNK_SIZE = 1000
+
 
 def _extract_model_params(defaults, **kwargs):
     defaults = defaults or {}
@@ -45,6 +59,9 @@ def upsert_by_id(model, data: dict, session=None):
     """
     _id = data.pop("id", None)
     session = session if session is not None else db.session
+    if _id is None:
+        # nothing to look up, it's a new record
+        return _create_object_from_params(session, model, data)
     instance, _ = update_or_create(model, session=session, defaults=data, id=_id)
     return instance
 
@@ -56,3 +73,282 @@ def get_or_create(model, session=None, defaults=None, **kwargs):
     except NoResultFound:
         params = _extract_model_params(defaults, **kwargs)
         return _create_object_from_params(session, model, params), True
+
+
+def _to_column_params(model, data: dict):
+    """
+    Convert model params to table column params,
+    many-to-one relationship objects are replaced by their foreign key.
+    """
+    mapper = inspect(model)
+    params = {}
+    for key, value in data.items():
+        if key in mapper.relationships:
+            (local_column,) = mapper.relationships[key].local_columns
+            params[local_column.key] = value.id if value is not None else None
+        elif key in mapper.columns:
+            params[key] = value
+        else:
+            raise TypeError(f"{key!r} is an invalid keyword argument for {model}")
+    return params
+
+
+def _apply_insert_defaults(model, params: dict):
+    """Fill in python side column defaults, as done by the ORM on insert"""
+    for col in model.__table__.columns:
+        if col.key in params or col.default is None or col.default.is_sequence:
+            continue
+        if col.default.is_callable:
+            params[col.key] = col.default.arg(None)
+        elif col.default.is_scalar:
+            params[col.key] = col.default.arg
+    return params
+
+
+def _next_ids(session, model, count):
+    """Allocate ids for new records from the model sequence in one query"""
+    sequence = model.__table__.c.id.default
+    preparer = session.get_bind(mapper=model).dialect.identifier_preparer
+    result = session.execute(
+        text(
+            f"SELECT {preparer.format_sequence(sequence)}.nextval "
+            "FROM TABLE(GENERATOR(ROWCOUNT => :count))"
+        ),
+        {"count": count},
+    )
+    return [row[0] for row in result]
+
+
+def _merge_rows(session, model, rows):
+    """Write rows with a single MERGE statement per column set (Snowflake)"""
+    # pylint: disable=import-outside-toplevel
+    from snowflake.sqlalchemy import MergeInto
+
+    table = model.__table__
+
+    def column_set(row):
+        return tuple(sorted(row))
+
+    for columns, group in groupby(sorted(rows, key=column_set), key=column_set):
+        source = values(
+            *[sa_column(name, table.c[name].type) for name in columns],
+            name="source",
+        ).data([tuple(row[name] for name in columns) for row in group])
+        merge = MergeInto(target=table, source=source, on=table.c.id == source.c.id)
+        update_values = {name: source.c[name] for name in columns if name != "id"}
+        update_values["updated_at"] = func.current_timestamp()
+        merge.when_matched_then_update().values(**update_values)
+        merge.when_not_matched_then_insert().values(
+            **{name: source.c[name] for name in columns}
+        )
+        session.execute(merge)
+
+
+def bulk_upsert_by_id(model, rows, session=None, chunk_size=IN_CLAUSE_CHUNK_SIZE):
+    """
+    Insert/update many records of a model in a fixed number of round trips.
+
+    Existing ids are resolved with one IN query (per chunk of ids), on
+    Snowflake the batch is then written with a set based MERGE, other dialects
+    (e.g. sqlite in tests) fall back to ORM bulk insert/update mappings.
+    Rows repeating an id are written once, the last one wins.
+
+    :param model: db model
+    :param rows: list of model data, rows with id are updated if found
+    :param session: db session
+    :return: ids of the inserted/updated records in the same order as rows
+    """
+    session = session if session is not None else db.session
+    rows = [_to_column_params(model, row) for row in rows]
+    if not rows:
+        return []
+    for row in rows:
+        if row.get("id") is None:
+            row.pop("id", None)
+
+    # a MERGE source row may not match the same target row twice
+    last_rows = {row["id"]: row for row in rows if "id" in row}
+    writes = [row for row in rows if "id" not in row or last_rows[row["id"]] is row]
+
+    ids = sorted(last_rows)
+    existing_ids = set()
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start : start + chunk_size]
+        existing_ids.update(
+            _id for (_id,) in session.query(model.id).filter(model.id.in_(chunk))
+        )
+
+    inserts = [
+        _apply_insert_defaults(model, row)
+        for row in writes
+        if row.get("id") not in existing_ids
+    ]
+    updates = [row for row in writes if row.get("id") in existing_ids]
+
+    if session.get_bind(mapper=model).dialect.name == SNOWFLAKE_DIALECT:
+        new_rows = [row for row in inserts if row.get("id") is None]
+        for row, _id in zip(new_rows, _next_ids(session, model, len(new_rows))):
+            row["id"] = _id
+        _merge_rows(session, model, writes)
+    else:
+        session.bulk_insert_mappings(model, inserts, return_defaults=True)
+        session.bulk_update_mappings(model, updates)
+
+    return [row["id"] for row in rows]
+
+
+def bulk_insert(model, rows, session=None, chunk_size=IN_CLAUSE_CHUNK_SIZE):
+    """
+    Insert many records of a model in a fixed number of round trips.
+
+    On Snowflake ids are allocated with a single sequence query and rows are
+    written with one multi-row INSERT per column set (and chunk of rows), other
+    dialects (e.g. sqlite in tests) fall back to ORM bulk insert mappings.
+
+    :param model: db model
+    :param rows: list of model data
+    :param session: db session
+    :return: ids of the inserted records in the same order as rows
+    """
+    session = session if session is not None else db.session
+    rows = [
+        _apply_insert_defaults(model, _to_column_params(model, row)) for row in rows
+    ]
+    if not rows:
+        return []
+
+    if session.get_bind(mapper=model).dialect.name != SNOWFLAKE_DIALECT:
+        session.bulk_insert_mappings(model, rows, return_defaults=True)
+        return [row["id"] for row in rows]
+
+    for row, _id in zip(rows, _next_ids(session, model, len(rows))):
+        row["id"] = _id
+
+    def column_set(row):
+        return tuple(sorted(row))
+
+    # rows of a multi-row INSERT share their columns, others get server defaults
+    for _, group in groupby(sorted(rows, key=column_set), key=column_set):
+        group = list(group)
+        for start in range(0, len(group), chunk_size):
+            session.execute(
+                model.__table__.insert().values(group[start : start + chunk_size])
+            )
+    return [row["id"] for row in rows]
+
+
+def prewarm_pool(engine, size):
+    """
+    Open ``size`` pooled connections up front, in parallel, so that requests do
+    not pay the connection handshake. Connections beyond the pool size are
+    closed when returned.
+    """
+    if size <= 0:
+        return
+
+    with ThreadPoolExecutor(max_workers=size) as executor:
+        connections = list(executor.map(lambda _: engine.connect(), range(size)))
+    for connection in connections:
+        connection.close()
+
+
+def projection_options(model, schema: ma.Schema, include=(), _loader=None):
+    """
+    ``load_only`` loader options selecting only the columns of model, and of
+    the related models it nests, that the schema dumps (after its Meta.fields,
+    only and exclude are applied), plus the ``include`` columns of model.
+
+    Foreign keys of the nested relationships are kept so that their eager
+    loads still work. A level dumping anything else than columns and nested
+    relationships (e.g. a property) loads all of its columns.
+    """
+    mapper = inspect(model)
+    columns = set(include)
+    nested = []
+    for name, field in schema.dump_fields.items():
+        attribute = field.attribute or name
+        if attribute in mapper.column_attrs:
+            columns.add(attribute)
+        elif isinstance(mapper.attrs.get(attribute), GenericRelationshipProperty):
+            # loaded by load_generic_relationship from its discriminator and id
+            generic = mapper.attrs[attribute]
+            columns.add(generic.discriminator.key)
+            columns.update(column.key for column in generic.id)
+        elif attribute in mapper.relationships and isinstance(field, ma.fields.Nested):
+            relationship = mapper.relationships[attribute]
+            columns.update(
+                mapper.get_property_by_column(column).key
+                for column in relationship.local_columns
+            )
+            nested.append((relationship, field.schema))
+        else:
+            columns = None
+            break
+
+    options = []
+    if columns is not None:
+        attributes = [getattr(model, key) for key in sorted(columns)]
+        options.append(
+            load_only(*attributes)
+            if _loader is None
+            else _loader.load_only(*attributes)
+        )
+    for relationship, nested_schema in nested:
+        attribute = relationship.class_attribute
+        loader = (
+            defaultload(attribute)
+            if _loader is None
+            else _loader.defaultload(attribute)
+        )
+        # keep the columns the relationship is loaded by on the related side
+        remote = [
+            relationship.mapper.get_property_by_column(column).key
+            for column in relationship.remote_side
+        ]
+        options.extend(
+            projection_options(
+                relationship.mapper.class_, nested_schema, remote, loader
+            )
+        )
+    return options
+
+
+def load_generic_relationship(objects, key, chunk_size=IN_CLAUSE_CHUNK_SIZE):
+    """
+    Load the targets of the ``generic_relationship`` key of objects, grouped by
+    target type, with one IN query per type (and chunk of ids) instead of one
+    query per object. Objects pointing to a missing target get None.
+    """
+    objects = list(objects)
+    if not objects:
+        return objects
+
+    generic = inspect(type(objects[0])).attrs[key]
+    (id_property,) = generic.id
+    models = {
+        mapper.class_.__name__: mapper.class_ for mapper in db.Model.registry.mappers
+    }
+
+    ids_by_type = defaultdict(set)
+    for obj in objects:
+        target_type = getattr(obj, generic.discriminator.key)
+        target_id = getattr(obj, id_property.key)
+        if target_type in models and target_id is not None:
+            ids_by_type[target_type].add(target_id)
+
+    targets = {}
+    for target_type, ids in ids_by_type.items():
+        model = models[target_type]
+        ids = sorted(ids)
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start : start + chunk_size]
+            for target in model.query.filter(model.id.in_(chunk)):
+                targets[target_type, target.id] = target
+
+    for obj in objects:
+        target_key = (
+            getattr(obj, generic.discriminator.key),
+            getattr(obj, id_property.key),
+        )
+        set_committed_value(obj, key, targets.get(target_key))
+    return objects
@@ -0,0 +1,148 @@
+"""
+Per request SQL instrumentation
+
+Counts SQL statements and accumulates DB wall time of each request, both are
+returned as ``Server-Timing`` response header and added to request log lines.
+Requests slower than ``SLOW_REQUEST_THRESHOLD_MS`` are logged along with the
+fingerprints of the statements they issued. Engines using ``TimedQueuePool``
+also report the time spent waiting for a pooled connection.
+"""
+import re
+import time
+from collections import Counter
+
+from flask import g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+from app.common.logging import get_logger
+
+LOGGER = get_logger(__name__, level="INFO")
+
+CONFIG_DEFAULTS = {
+    "SQL_INSTRUMENTATION_ENABLED": True,
+    # None disables slow request logging
+    "SLOW_REQUEST_THRESHOLD_MS": None,
+}
+
+# number of distinct statement fingerprints kept per request
+MAX_FINGERPRINTS = 50
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def fingerprint(statement):
+    """Normalized statement, parameters are already bound as placeholders"""
+    return _WHITESPACE.sub(" ", statement).strip()[:500]
+
+
+def _before_cursor_execute(conn, cursor, statement, *args):
+    if has_request_context():
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, *args):
+    if not has_request_context() or not conn.info.get("query_start_time"):
+        return
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+    g.sql_count = g.get("sql_count", 0) + 1
+    g.sql_time = g.get("sql_time", 0.0) + elapsed
+    fingerprints = g.setdefault("sql_fingerprints", Counter())
+    key = fingerprint(statement)
+    if key in fingerprints or len(fingerprints) < MAX_FINGERPRINTS:
+        fingerprints[key] += 1
+
+
+def _handle_error(context):
+    # failed statements are timed too, their start time is not left behind
+    if context.connection is not None and context.statement is not None:
+        _after_cursor_execute(context.connection, context.cursor, context.statement)
+
+
+def add_server_timing(name, duration, description=None):
+    """Add a timing (in seconds) to the Server-Timing header of the request"""
+    timings = g.setdefault("server_timings", {})
+    previous = timings.get(name, (0.0, description))[0]
+    timings[name] = (previous + duration, description)
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool adding the connection checkout wait to the request timings
+
+    The wait includes opening a new connection when the pool has none idle.
+    """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            if has_request_context():
+                add_server_timing("pool", time.perf_counter() - start)
+
+
+class SQLInstrumentation:
+    def __init__(self, app=None):
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        for key, value in CONFIG_DEFAULTS.items():
+            app.config.setdefault(key, value)
+
+        if not app.config["SQL_INSTRUMENTATION_ENABLED"]:
+            return
+
+        # listen on all engines, registered once per process
+        if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+            event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+            event.listen(Engine, "handle_error", _handle_error)
+
+        self.slow_request_threshold_ms = app.config["SLOW_REQUEST_THRESHOLD_MS"]
+        app.before_request(self._start_request)
+        app.after_request(self._end_request)
+
+    @staticmethod
+    def _start_request():
+        g.request_start_time = time.perf_counter()
+        g.sql_count = 0
+        g.sql_time = 0.0
+        g.sql_fingerprints = Counter()
+        g.server_timings = {}
+
+    def _end_request(self, response):
+        start = g.get("request_start_time")
+        if start is None:
+            return response
+        total = time.perf_counter() - start
+
+        add_server_timing(
+            "db", g.get("sql_time", 0.0), f"{g.get('sql_count', 0)} queries"
+        )
+        add_server_timing("total", total)
+        response.headers["Server-Timing"] = ", ".join(
+            f'{name};desc="{desc}";dur={duration * 1000:.1f}'
+            if desc
+            else f"{name};dur={duration * 1000:.1f}"
+            for name, (duration, desc) in g.server_timings.items()
+        )
+
+        if (
+            self.slow_request_threshold_ms is not None
+            and total * 1000 >= self.slow_request_threshold_ms
+        ):
+            fingerprints = g.get("sql_fingerprints", Counter())
+            LOGGER.warning(
+                "Slow request: %.1fms, %s queries in %.1fms\n%s",
+                total * 1000,
+                g.get("sql_count", 0),
+                g.get("sql_time", 0.0) * 1000,
+                "\n".join(
+                    f"{count}x {statement}"
+                    for statement, count in fingerprints.most_common()
+                ),
+            )
+        return response
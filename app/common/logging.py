@@ -1,6 +1,6 @@
 import logging
 
-from flask import has_request_context, request
+from flask import g, has_request_context, request
 
 
 class RequestFormatter(logging.Formatter):
@@ -8,15 +8,21 @@ class RequestFormatter(logging.Formatter):
         if has_request_context():
             record.url = request.url
             record.remote_addr = request.remote_addr
+            # collected by app.common.instrumentation
+            record.sql_count = g.get("sql_count", 0)
+            record.sql_time_ms = round(g.get("sql_time", 0.0) * 1000, 1)
         else:
             record.url = None
             record.remote_addr = None
+            record.sql_count = None
+            record.sql_time_ms = None
 
         return super().format(record)
 
 
 custom_formatter = RequestFormatter(
-    "[%(asctime)s] %(remote_addr)s requested %(url)s\n"
+    "[%(asctime)s] %(remote_addr)s requested %(url)s "
+    "(%(sql_count)s queries in %(sql_time_ms)sms)\n"
     "%(levelname)s in %(module)s: %(message)s"
 )
 
@@ -0,0 +1,156 @@
+"""
+Prometheus metrics
+
+Request latency per route and method, along with the auth, DB, serialization
+and pool checkout wait parts of it, are exposed as histograms on ``/metrics``,
+to callers with a valid token unless ``METRICS_PUBLIC`` is set.
+
+Under gunicorn every worker keeps its own samples, set
+``PROMETHEUS_MULTIPROC_DIR`` (done by ``gunicorn_cfg.py``) so that they are
+written to a directory shared by the workers and aggregated on scrape.
+"""
+import os
+import time
+
+from flask import Response, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from app.common.auth import auth_required
+
+CONFIG_DEFAULTS = {
+    "METRICS_ENABLED": True,
+    "METRICS_PATH": "/metrics",
+    # serve METRICS_PATH without a token, only behind a path or port that is
+    # not reachable from outside
+    "METRICS_PUBLIC": False,
+}
+
+# seconds, tuned for Snowflake round trips rather than the client default
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+LABELS = ("method", "route")
+
+REQUEST_COUNT = Counter("http_requests_total", "Requests handled", LABELS + ("status",))
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Request latency",
+    LABELS,
+    buckets=LATENCY_BUCKETS,
+)
+AUTH_LATENCY = Histogram(
+    "auth_decode_duration_seconds",
+    "Time spent verifying the access token",
+    LABELS,
+    buckets=LATENCY_BUCKETS,
+)
+DB_LATENCY = Histogram(
+    "db_duration_seconds",
+    "Time spent executing SQL statements",
+    LABELS,
+    buckets=LATENCY_BUCKETS,
+)
+SERIALIZATION_LATENCY = Histogram(
+    "serialization_duration_seconds",
+    "Time spent dumping and encoding the response",
+    LABELS,
+    buckets=LATENCY_BUCKETS,
+)
+POOL_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a pooled connection",
+    LABELS,
+    buckets=LATENCY_BUCKETS,
+)
+
+# server timing name -> histogram, timings are added by the code measuring them
+TIMING_HISTOGRAMS = {
+    "auth": AUTH_LATENCY,
+    "serialization": SERIALIZATION_LATENCY,
+    "pool": POOL_WAIT,
+}
+
+
+def route_label():
+    """URL rule of the request, unmatched URLs are grouped together"""
+    if request.url_rule is None:
+        return "unmatched"
+    return request.url_rule.rule
+
+
+def collect():
+    """Metrics of this process, or of all workers in multiprocess mode"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def metrics_view():
+    return Response(collect(), mimetype=CONTENT_TYPE_LATEST)
+
+
+class Metrics:
+    def __init__(self, app=None):
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        for key, value in CONFIG_DEFAULTS.items():
+            app.config.setdefault(key, value)
+
+        if not app.config["METRICS_ENABLED"]:
+            return
+
+        self.metrics_path = app.config["METRICS_PATH"]
+        view = (
+            metrics_view
+            if app.config["METRICS_PUBLIC"]
+            else auth_required(metrics_view)
+        )
+        app.add_url_rule(self.metrics_path, "metrics", view)
+        app.before_request(self._start_request)
+        app.after_request(self._end_request)
+
+    @staticmethod
+    def _start_request():
+        g.metrics_start_time = time.perf_counter()
+
+    def _end_request(self, response):
+        start = g.get("metrics_start_time")
+        if start is None or request.path == self.metrics_path:
+            return response
+
+        labels = (request.method, route_label())
+        REQUEST_COUNT.labels(*labels, response.status_code).inc()
+        REQUEST_LATENCY.labels(*labels).observe(time.perf_counter() - start)
+        # collected by app.common.instrumentation
+        if "sql_time" in g:
+            DB_LATENCY.labels(*labels).observe(g.sql_time)
+        for name, (duration, _) in g.get("server_timings", {}).items():
+            if name in TIMING_HISTOGRAMS:
+                TIMING_HISTOGRAMS[name].labels(*labels).observe(duration)
+        return response
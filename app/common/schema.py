@@ -1,12 +1,197 @@
+import datetime as dt
+from collections.abc import Mapping
+from functools import partial
+
 import marshmallow as ma
 from flask_smorest.pagination import PaginationMetadataSchema
+from marshmallow import missing
+from marshmallow_enum import EnumField
+
+
+class ListPaginationMetadataSchema(PaginationMetadataSchema):
+    """Pagination metadata of list endpoints (page number or cursor)"""
+
+    page_size = ma.fields.Int()
+    next_cursor = ma.fields.String(allow_none=True)
+    count_mode = ma.fields.String()
+
+
+class PolymorphicNested(ma.fields.Field):
+    """
+    Nested object of a generic relationship, dumped by the schema of its type
+    (the discriminator value, i.e. the model class name). Objects of types
+    without a schema are dumped as None.
+    """
+
+    def __init__(self, schemas: dict, **kwargs):
+        super().__init__(dump_only=True, **kwargs)
+        self.schemas = schemas
+
+    def _serialize(self, value, attr, obj, **kwargs):
+        if value is None:
+            return None
+        schema = self.schemas.get(type(value).__name__)
+        if schema is None:
+            return None
+        return schema.dump(value)
+
+
+def _identity(value):
+    return value
+
+
+# serialization of the value types inferred fields dump as is or as ISO 8601,
+# same as the fields Schema.TYPE_MAPPING resolves them to
+_INFERRED_SERIALIZERS = {
+    type(None): _identity,
+    str: _identity,
+    int: _identity,
+    bool: _identity,
+    float: _identity,
+    list: _identity,
+    tuple: _identity,
+    dt.datetime: dt.datetime.isoformat,
+    dt.date: dt.date.isoformat,
+}
+
+
+def _compile_value_serializer(field):
+    """
+    Function serializing an attribute value the way the field does, None for
+    fields not dumping an attribute (e.g. ``Method``)
+    """
+    if not field._CHECK_ATTRIBUTE:
+        return None
+
+    field_cls = type(field)
+    if (
+        field_cls is ma.fields.Inferred
+        and field.root.TYPE_MAPPING == ma.Schema.TYPE_MAPPING
+    ):
+        fallback = field._serialize
+
+        def serialize_inferred(value):
+            serializer = _INFERRED_SERIALIZERS.get(type(value))
+            if serializer is None:
+                return fallback(value, None, None)
+            return serializer(value)
+
+        return serialize_inferred
+
+    if isinstance(field, EnumField) and field_cls._serialize is EnumField._serialize:
+        # enum member -> dumped name or value
+        dumped = {member: field._serialize(member, None, None) for member in field.enum}
+        dumped[None] = None
+
+        def serialize_enum(value):
+            try:
+                return dumped[value]
+            except (KeyError, TypeError):
+                return field._serialize(value, None, None)
+
+        return serialize_enum
+
+    if isinstance(field, ma.fields.Nested) and (
+        field_cls._serialize is ma.fields.Nested._serialize
+    ):
+        schema = field.schema
+        many = schema.many or field.many
+        dump = compile_dump(schema)
+
+        def serialize_nested(value):
+            if value is None:
+                return None
+            if dump is None:
+                return schema.dump(value, many=many)
+            if many:
+                return [dump(item) for item in value]
+            return dump(value)
+
+        return serialize_nested
+
+    if field_cls is ma.fields.DateTime and field.format in (None, "iso"):
+        return lambda value: None if value is None else value.isoformat()
+
+    return lambda value: field._serialize(value, None, None)
+
+
+def compile_dump(schema: ma.Schema):
+    """
+    Dump function of a single object equivalent to ``schema.dump``.
+
+    Field accessors, nested schemas and enum dumps are resolved once, instead
+    of on every dumped object. Returns None when the schema has dump hooks or a
+    custom attribute getter, those are only supported by ``schema.dump``.
+    """
+    if (
+        schema._hooks[("pre_dump", False)]
+        or schema._hooks[("pre_dump", True)]
+        or schema._hooks[("post_dump", False)]
+        or schema._hooks[("post_dump", True)]
+        or type(schema).get_attribute is not ma.Schema.get_attribute
+    ):
+        return None
+
+    compiled_fields = tuple(
+        (
+            field.data_key if field.data_key is not None else name,
+            field.attribute or name,
+            name,
+            field,
+            _compile_value_serializer(field),
+        )
+        for name, field in schema.dump_fields.items()
+    )
+    get_attribute = schema.get_attribute
+
+    def dump(obj):
+        # keys of dicts, like marshmallow's get_value, not their methods
+        get = obj.get if isinstance(obj, Mapping) else partial(getattr, obj)
+        result = {}
+        for key, attribute, name, field, serialize in compiled_fields:
+            value = missing if serialize is None else get(attribute, missing)
+            if value is missing:
+                # dicts, dotted attributes, dump defaults, attribute-less fields
+                value = field.serialize(name, obj, accessor=get_attribute)
+                if value is missing:
+                    continue
+            else:
+                value = serialize(value)
+            result[key] = value
+        return result
+
+    return dump
+
+
+class PaginatedSchema(ma.Schema):
+    """Page of results, dumped with the compiled dump of the results schema"""
+
+    _dump_result = None
+
+    class Meta:
+        ordered = True
+
+    def dump(self, obj, *, many=None):
+        if self._dump_result is None:
+            results_schema = self.fields["results"].schema
+            self._dump_result = (
+                results_schema.many and compile_dump(results_schema)
+            ) or False
+        if not self._dump_result or many or not isinstance(obj, dict):
+            return super().dump(obj, many=many)
+
+        data = super().dump({k: v for k, v in obj.items() if k != "results"})
+        if "results" in obj:
+            data["results"] = [self._dump_result(item) for item in obj["results"]]
+        # keep the field order of the schema
+        return {key: data[key] for key in self.dump_fields if key in data}
 
 
 def paginated_schema_factory(schema: ma.Schema):
     """Generate a schema with pagination"""
-    return ma.Schema.from_dict(
+    return PaginatedSchema.from_dict(
         {
-            "pagination": ma.fields.Nested(PaginationMetadataSchema()),
+            "pagination": ma.fields.Nested(ListPaginationMetadataSchema()),
             "results": ma.fields.Nested(schema),
         },
         name=f"{schema.Meta.model.__name__}List"
@@ -1,8 +1,15 @@
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import serialization
+import codecs
+import json
+import threading
+
+from sqlalchemy import event
 
 
 def load_private_key(private_key_bytes, private_key_passphrase):
+    # only needed when connecting to snowflake
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+
     p_key = serialization.load_pem_private_key(
         private_key_bytes,
         password=private_key_passphrase.encode("utf-8"),
@@ -14,3 +21,141 @@ def load_private_key(private_key_bytes, private_key_passphrase):
         encryption_algorithm=serialization.NoEncryption(),
     )
     return pkb
+
+
+class PrivateKeyProvider:
+    """
+    Snowflake private key, read and decrypted on first use then cached.
+
+    Decrypting the key is CPU heavy, config imports only create the provider
+    and the key is decrypted when the first connection is opened. With gunicorn
+    ``preload_app`` the master decrypts it once and the forked workers inherit
+    the cached key.
+
+    :param bytes key: PEM encoded key, read from ``path`` if None
+    :param str path: path of the PEM encoded key file
+    :param str passphrase: passphrase the key is encrypted with
+    """
+
+    def __init__(self, key=None, path=None, passphrase=None):
+        self.key = key
+        self.path = path
+        self.passphrase = passphrase
+        self._private_key = None
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        """DER encoded private key"""
+        if self._private_key is None:
+            with self._lock:
+                if self._private_key is None:
+                    self._private_key = load_private_key(
+                        self._read_key(), self.passphrase
+                    )
+        return self._private_key
+
+    def _read_key(self):
+        if self.key is not None:
+            return self.key
+        with open(self.path, "rb") as file:
+            return file.read()
+
+    def _set_connect_param(self, dialect, conn_rec, cargs, cparams):
+        cparams["private_key"] = self()
+
+    def register(self, engine):
+        """Pass the key to every new connection of the engine"""
+        event.listen(engine, "do_connect", self._set_connect_param)
+
+
+# characters ending a JSON literal or number
+_DELIMITERS = frozenset(' \t\n\r,:[]{}"')
+
+
+def _may_continue(buffer, error):
+    """
+    Whether the JSON value that failed to decode is only cut by the end of the
+    buffer, as opposed to invalid before it
+    """
+    if error.msg.startswith("Unterminated string"):
+        return True
+    # a truncated literal, number or escape runs up to the end of the buffer
+    return not any(char in _DELIMITERS for char in buffer[error.pos :])
+
+
+def iter_json_records(file, read_size=64 * 1024):
+    """
+    Lazily load records from a JSON array or a newline delimited JSON (NDJSON)
+    file, only one record is held in memory at a time.
+
+    Raises ValueError on malformed JSON, positioned in the file (line, column
+    and character offset) as soon as the invalid record is read.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    json_decoder = json.JSONDecoder()
+    buffer = ""
+    eof = False
+    # position of the buffer start in the file
+    offset, line, column = 0, 1, 1
+
+    def read_more():
+        nonlocal buffer, eof
+        data = file.read(read_size)
+        eof = not data
+        buffer += decoder.decode(data, final=eof) if isinstance(data, bytes) else data
+
+    def consume(count):
+        nonlocal buffer, offset, line, column
+        consumed, buffer = buffer[:count], buffer[count:]
+        offset += count
+        newlines = consumed.count("\n")
+        if newlines:
+            line += newlines
+            column = count - consumed.rfind("\n")
+        else:
+            column += count
+
+    def skip(chars):
+        # skip chars, reading more of the file if the buffer runs out
+        while True:
+            consume(len(buffer) - len(buffer.lstrip(chars)))
+            if buffer or eof:
+                return
+            read_more()
+
+    whitespace = " \t\n\r"
+    skip(whitespace)
+    is_array = buffer.startswith("[")
+    if is_array:
+        consume(1)
+
+    while True:
+        skip(whitespace + "," if is_array else whitespace)
+        if not buffer:
+            if is_array:
+                raise ValueError("Unterminated JSON array")
+            return
+        if is_array and buffer[0] == "]":
+            return
+        try:
+            record, end = json_decoder.raw_decode(buffer)
+        except json.JSONDecodeError as exc:
+            if not eof and _may_continue(buffer, exc):
+                read_more()
+                continue
+            lineno = line + exc.lineno - 1
+            colno = exc.colno + column - 1 if exc.lineno == 1 else exc.colno
+            raise ValueError(
+                f"{exc.msg}: line {lineno} column {colno} (char {offset + exc.pos})"
+            ) from exc
+        if end == len(buffer) and not eof:
+            # value may continue in the next read, e.g. a number
+            read_more()
+            continue
+        consume(end)
+        yield record
+
+
+def load_json_records(file):
+    """Load records from a JSON array or a newline delimited JSON (NDJSON) file"""
+    return list(iter_json_records(file))
@@ -0,0 +1,481 @@
+"""
+Write-behind buffer of a model
+
+Creates and updates are appended to a SQLite journal shared by the workers of
+a host and acknowledged as soon as the journal is synced, the journal is then
+written to the database in batches (``bulk_upsert_by_id``, a MERGE per column
+set on Snowflake) once it holds ``flush_size`` writes or every
+``flush_interval`` seconds. Reads replay the pending writes of an object over
+its database row, so that the workers of a host always see the latest state.
+
+Ids are allocated up front, in blocks from the model sequence on Snowflake,
+reserved before the journal is locked.
+A single worker flushes at a time (a lease kept in the journal), writes are
+coalesced per object and flushed in order, replaying a batch after a crash
+writes the same rows again. Rows the database rejects are kept in the
+``failed`` table of the journal, instead of blocking the writes after them.
+"""
+import enum
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+
+from sqlalchemy import DateTime, Enum, func
+from sqlalchemy.exc import DataError, IntegrityError
+
+from app import db
+from app.common.controllers import count_cache
+from app.common.db_utils import (
+    SNOWFLAKE_DIALECT,
+    _apply_insert_defaults,
+    _next_ids,
+    _to_column_params,
+    bulk_upsert_by_id,
+)
+from app.common.logging import get_logger
+
+LOGGER = get_logger(__name__, level="INFO")
+
+# ids allocated from the sequence per round trip
+ID_BLOCK_SIZE = 100
+# seconds a flushing worker holds the journal
+FLUSH_LEASE = 60
+# writes flushed per batch, at most
+MAX_FLUSH_BATCH = 10000
+# seconds requests wait for their writes to be flushed
+DRAIN_TIMEOUT = 10
+
+
+class FlushLeaseLost(Exception):
+    """Another worker took the flush lease over"""
+
+
+def _encode_value(value):
+    if isinstance(value, enum.Enum):
+        return value.name
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+class WriteBehindBuffer:
+    """
+    Write-behind buffer of model writes, configured by the ``<name>_*`` keys:
+
+    - ``<name>_WRITE_BEHIND``: enables it, writes are synchronous otherwise
+    - ``<name>_BUFFER_PATH``: SQLite journal, shared by the workers of a host,
+      required when enabled
+    - ``<name>_FLUSH_SIZE``: number of pending writes triggering a flush
+    - ``<name>_FLUSH_INTERVAL``: seconds between background flushes, 0 flushes
+      only on size, in the request that reaches it
+    """
+
+    def __init__(self, model, name, app=None):
+        self.model = model
+        self.name = name
+        self.enabled = False
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._ids = deque()
+        self._flusher_pid = None
+        self._flush_event = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        defaults = {
+            f"{self.name}_WRITE_BEHIND": False,
+            f"{self.name}_BUFFER_PATH": None,
+            f"{self.name}_FLUSH_SIZE": 500,
+            f"{self.name}_FLUSH_INTERVAL": 2.0,
+        }
+        for key, value in defaults.items():
+            app.config.setdefault(key, value)
+
+        self.enabled = app.config[f"{self.name}_WRITE_BEHIND"]
+        self.path = app.config[f"{self.name}_BUFFER_PATH"]
+        self.flush_size = app.config[f"{self.name}_FLUSH_SIZE"]
+        self.flush_interval = app.config[f"{self.name}_FLUSH_INTERVAL"]
+        self.app = app
+        if self.enabled and not self.path:
+            # acknowledged writes are only as durable as the journal volume
+            raise ValueError(
+                f"{self.name}_WRITE_BEHIND requires {self.name}_BUFFER_PATH, "
+                "on a volume that outlives the container"
+            )
+
+    # journal
+
+    def _connect(self):
+        # sqlite connections are not shared between threads, nor processes:
+        # opened lazily, in the forked worker, never in the preloaded master.
+        # Transactions are handled explicitly.
+        connection = getattr(self._local, "connection", None)
+        if (
+            connection is None
+            or self._local.pid != os.getpid()
+            or self._local.path != self.path
+        ):
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # acknowledged writes survive a crash of the host
+            connection.execute("PRAGMA synchronous=FULL")
+            self._create_journal(connection)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+            self._local.path = self.path
+        return connection
+
+    @staticmethod
+    def _create_journal(connection):
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS writes (seq INTEGER PRIMARY KEY "
+            "AUTOINCREMENT, object_id INTEGER, op TEXT, payload TEXT)"
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS writes_object_id ON writes (object_id)"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS locks "
+            "(name TEXT PRIMARY KEY, owner TEXT, expires REAL)"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS failed "
+            "(object_id INTEGER, payload TEXT, error TEXT)"
+        )
+        connection.execute("INSERT OR IGNORE INTO locks VALUES ('flush', NULL, 0)")
+
+    def _decode(self, payload):
+        """Column values of a journal payload"""
+        values = json.loads(payload)
+        columns = self.model.__table__.columns
+        for key, value in values.items():
+            if value is None:
+                continue
+            column_type = columns[key].type
+            if isinstance(column_type, Enum) and column_type.enum_class:
+                values[key] = column_type.enum_class[value]
+            elif isinstance(column_type, DateTime):
+                values[key] = datetime.fromisoformat(value)
+        return values
+
+    @staticmethod
+    def _encode(values):
+        return json.dumps({key: _encode_value(value) for key, value in values.items()})
+
+    def _append(self, entries):
+        new = [
+            entry
+            for entry in entries
+            if entry[1] == "insert" and entry[2].get("id") is None
+        ]
+        if self._has_sequence():
+            # reserved before the journal is locked, the appends of the other
+            # workers do not wait for the sequence round trip
+            self._assign_ids(new, self._reserve_ids(len(new)))
+            new = []
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            if new:
+                self._assign_ids(new, self._next_local_ids(connection, len(new)))
+            for entry in entries:
+                connection.execute(
+                    "INSERT INTO writes (object_id, op, payload) VALUES (?, ?, ?)",
+                    (entry[0], entry[1], self._encode(entry[2])),
+                )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        self._after_append(self.pending())
+
+    def _pending_writes(self, object_id):
+        rows = self._connect().execute(
+            "SELECT op, payload FROM writes WHERE object_id = ? ORDER BY seq",
+            (object_id,),
+        )
+        return [(op, self._decode(payload)) for op, payload in rows]
+
+    # ids
+
+    def _has_sequence(self):
+        bind = db.session.get_bind(mapper=self.model)
+        return bind.dialect.name == SNOWFLAKE_DIALECT
+
+    @staticmethod
+    def _assign_ids(entries, ids):
+        for entry, _id in zip(entries, ids):
+            entry[2]["id"] = entry[0] = _id
+
+    def _reserve_ids(self, count):
+        """Ids of count new objects, from blocks of the model sequence"""
+        ids = []
+        while True:
+            with self._lock:
+                while self._ids and len(ids) < count:
+                    ids.append(self._ids.popleft())
+            if len(ids) == count:
+                return ids
+            # fetched without holding the lock, threads may fetch a block each
+            block = _next_ids(
+                db.session, self.model, max(ID_BLOCK_SIZE, count - len(ids))
+            )
+            with self._lock:
+                self._ids.extend(block)
+
+    def _next_local_ids(self, connection, count):
+        """
+        Ids of count new objects without a sequence, next to the largest stored
+        or buffered id, called with the journal locked
+        """
+        buffered = connection.execute(
+            "SELECT max(object_id) FROM writes WHERE op = 'insert'"
+        ).fetchone()[0]
+        stored = db.session.query(func.max(self.model.id)).scalar()
+        start = max(buffered or 0, stored or 0) + 1
+        return list(range(start, start + count))
+
+    # writes
+
+    def _insert_params(self, data, now):
+        params = _apply_insert_defaults(self.model, _to_column_params(self.model, data))
+        # server side defaults are set when the write is acknowledged
+        for column in self.model.__table__.columns:
+            if column.server_default is not None and params.get(column.key) is None:
+                if isinstance(column.type, DateTime):
+                    params[column.key] = now
+        return params
+
+    def insert(self, data):
+        """Buffer a new object, returns it (transient) with its id"""
+        return self.insert_many([data])[0]
+
+    def insert_many(self, rows):
+        """Buffer new objects in one journal transaction, returns them"""
+        now = datetime.now(timezone.utc)
+        entries = [[None, "insert", self._insert_params(data, now)] for data in rows]
+        self._append(entries)
+        return [self.model(**params) for _, _, params in entries]
+
+    def update(self, object_id, data):
+        """Buffer an update, returns the updated object, None if not found"""
+        state = self._state(object_id)
+        if state is None:
+            return None
+        params = _to_column_params(self.model, data)
+        if "updated_at" in self.model.__table__.columns:
+            params["updated_at"] = datetime.now(timezone.utc)
+        self._append([[object_id, "update", params]])
+        state.update(params)
+        return self.model(**state)
+
+    def get(self, object_id):
+        """Latest state of the object, buffered writes included, None if not found"""
+        pending = self._pending_writes(object_id)
+        stored = db.session.get(self.model, object_id)
+        if not pending:
+            return stored
+        state = self._apply(self._row(stored), pending)
+        return self.model(**state) if state is not None else None
+
+    def _state(self, object_id):
+        # pending writes are read first, a flush in between writes them to the
+        # row they are then applied to again
+        pending = self._pending_writes(object_id)
+        return self._apply(self._row(db.session.get(self.model, object_id)), pending)
+
+    def _row(self, obj):
+        if obj is None:
+            return None
+        return {
+            column.key: getattr(obj, column.key)
+            for column in self.model.__table__.columns
+        }
+
+    @staticmethod
+    def _apply(state, pending):
+        for op, values in pending:
+            if op == "insert":
+                state = dict(values)
+            elif state is not None:
+                state.update(values)
+        return state
+
+    # flush
+
+    def _after_append(self, pending):
+        if self.flush_interval > 0:
+            self._ensure_flusher()
+            if pending >= self.flush_size:
+                self._flush_event.set()
+        elif pending >= self.flush_size:
+            self.flush()
+
+    def _ensure_flusher(self):
+        # started per process, threads do not survive the gunicorn fork
+        if self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flush_event = threading.Event()
+            thread = threading.Thread(
+                target=self._flush_loop, name=f"{self.name.lower()}-flush", daemon=True
+            )
+            thread.start()
+            self._flusher_pid = os.getpid()
+
+    def _flush_loop(self):
+        while True:
+            self._flush_event.wait(self.flush_interval)
+            self._flush_event.clear()
+            try:
+                with self.app.app_context():
+                    while self.flush() >= self.flush_size:
+                        pass
+            except Exception:  # pylint: disable=broad-except
+                LOGGER.exception("%s write-behind flush failed", self.name)
+
+    def _acquire_flush_lease(self, owner):
+        now = time.time()
+        cursor = self._connect().execute(
+            "UPDATE locks SET owner = ?, expires = ? WHERE name = 'flush' "
+            "AND (owner IS NULL OR owner = ? OR expires < ?)",
+            (owner, now + FLUSH_LEASE, owner, now),
+        )
+        return cursor.rowcount == 1
+
+    def _renew_flush_lease(self, owner):
+        """Extend the flush lease, raises FlushLeaseLost if another worker took it"""
+        now = time.time()
+        cursor = self._connect().execute(
+            "UPDATE locks SET expires = ? WHERE name = 'flush' "
+            "AND owner = ? AND expires >= ?",
+            (now + FLUSH_LEASE, owner, now),
+        )
+        if cursor.rowcount != 1:
+            raise FlushLeaseLost(f"{self.name} flush lease of {owner} lost")
+
+    def _release_flush_lease(self, owner):
+        self._connect().execute(
+            "UPDATE locks SET owner = NULL WHERE name = 'flush' AND owner = ?",
+            (owner,),
+        )
+
+    @staticmethod
+    def _object_filter(object_ids):
+        if object_ids is None:
+            return "", ()
+        object_ids = tuple(object_ids)
+        return (
+            f" AND object_id IN ({', '.join('?' * len(object_ids))})",
+            object_ids,
+        )
+
+    def flush(self, object_ids=None):
+        """
+        Write the pending writes (of object_ids, all if None) to the database,
+        oldest first, returns the number of writes flushed (0 when another
+        worker is flushing).
+
+        The flush lease is renewed before every database commit and before the
+        flushed writes are deleted from the journal, the flush is aborted if
+        another worker took it over meanwhile: an older batch never commits
+        after a newer one.
+        """
+        owner = f"{os.getpid()}-{threading.get_ident()}"
+        if not self._acquire_flush_lease(owner):
+            return 0
+        try:
+            where, params = self._object_filter(object_ids)
+            entries = (
+                self._connect()
+                .execute(
+                    "SELECT seq, object_id, op, payload FROM writes "
+                    f"WHERE 1 = 1{where} ORDER BY seq LIMIT ?",
+                    params + (MAX_FLUSH_BATCH,),
+                )
+                .fetchall()
+            )
+            if not entries:
+                return 0
+
+            # one row per object, latest values win
+            rows = OrderedDict()
+            for _, object_id, op, payload in entries:
+                values = self._decode(payload)
+                if op == "insert":
+                    rows[object_id] = values
+                else:
+                    rows.setdefault(object_id, {"id": object_id}).update(values)
+            try:
+                bulk_upsert_by_id(self.model, list(rows.values()))
+                self._renew_flush_lease(owner)
+                db.session.commit()
+            except (IntegrityError, DataError):
+                db.session.rollback()
+                self._flush_each(rows, owner)
+            except Exception:
+                db.session.rollback()
+                raise
+            self._renew_flush_lease(owner)
+            self._connect().execute(
+                f"DELETE FROM writes WHERE seq <= ?{where}",
+                (entries[-1][0],) + params,
+            )
+            count_cache.invalidate(self.model)
+            return len(entries)
+        except FlushLeaseLost:
+            LOGGER.warning("%s flush aborted, lease lost", self.name, exc_info=True)
+            return 0
+        finally:
+            self._release_flush_lease(owner)
+
+    def _flush_each(self, rows, owner):
+        """
+        Write the rows of a rejected batch one by one, rows the database
+        rejects are moved to the ``failed`` table of the journal
+        """
+        for object_id, row in rows.items():
+            try:
+                bulk_upsert_by_id(self.model, [row])
+                self._renew_flush_lease(owner)
+                db.session.commit()
+            except (IntegrityError, DataError) as exc:
+                db.session.rollback()
+                LOGGER.error(
+                    "%s %s rejected by the database: %s", self.name, object_id, exc.orig
+                )
+                self._connect().execute(
+                    "INSERT INTO failed (object_id, payload, error) VALUES (?, ?, ?)",
+                    (object_id, self._encode(row), str(exc.orig)),
+                )
+            except FlushLeaseLost:
+                db.session.rollback()
+                raise
+
+    def drain(self, object_ids=None, timeout=DRAIN_TIMEOUT):
+        """
+        Flush until no write (of object_ids, all if None) is pending, waiting
+        for other flushing workers. Raises TimeoutError after timeout seconds.
+        """
+        deadline = time.monotonic() + timeout
+        while self.pending(object_ids):
+            if self.flush(object_ids) == 0:
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"{self.name} write-behind buffer not drained")
+                time.sleep(0.05)
+
+    def pending(self, object_ids=None):
+        """Number of writes (of object_ids, all if None) not flushed yet"""
+        where, params = self._object_filter(object_ids)
+        return (
+            self._connect()
+            .execute(f"SELECT count(*) FROM writes WHERE 1 = 1{where}", params)
+            .fetchone()[0]
+        )
@@ -4,7 +4,13 @@ from os import environ
 from dotenv import load_dotenv
 from snowflake.sqlalchemy import URL  # noqa
 
-from app.common.utils import load_private_key
+from app.common.instrumentation import TimedQueuePool
+from app.common.utils import PrivateKeyProvider
+from app.constants import (
+    DEFAULT_COUNT_CACHE_TTL,
+    DEFAULT_LEASE_SWEEP_INTERVAL,
+    DEFAULT_UPSERT_CHUNK_SIZE,
+)
 
 # useful in local, for others env will come from ECS
 load_dotenv(".env")  # take environment variables from .env.
@@ -47,20 +53,39 @@ if environ.get("SNOWFLAKE_ROLE"):
     db_params["role"] = environ.get("SNOWFLAKE_ROLE")
 
 SQLALCHEMY_DATABASE_URI = URL(**db_params)
-SQLALCHEMY_ECHO = True  # https://flask-sqlalchemy.palletsprojects.com/en/2.x/config/
-# private key
-if environ.get("SNOWFLAKE_PRIVATE_KEY"):
-    SNOWFLAKE_PRIVATE_KEY = environ["SNOWFLAKE_PRIVATE_KEY"].encode("utf-8")
-else:
-    SNOWFLAKE_PRIVATE_KEY = open("rsa_key.p8", "rb").read()  # noqa
+# https://flask-sqlalchemy.palletsprojects.com/en/2.x/config/
+# echo is a throughput hit, use SLOW_REQUEST_THRESHOLD_MS to find slow queries
+SQLALCHEMY_ECHO = environ.get("SQLALCHEMY_ECHO", "false") == "true"
+# private key, decrypted when the first connection is opened
+SNOWFLAKE_PRIVATE_KEY_PROVIDER = PrivateKeyProvider(
+    key=(
+        environ["SNOWFLAKE_PRIVATE_KEY"].encode("utf-8")
+        if environ.get("SNOWFLAKE_PRIVATE_KEY")
+        else None
+    ),
+    path="rsa_key.p8",
+    passphrase=environ["SNOWFLAKE_PRIVATE_KEY_PASSWORD"],
+)
+# every new Snowflake connection costs a login handshake, keep enough of them
+# for the concurrent requests of a worker (GUNICORN_THREADS)
 SQLALCHEMY_ENGINE_OPTIONS = {
+    "poolclass": TimedQueuePool,
+    "pool_size": int(
+        environ.get("SQLALCHEMY_POOL_SIZE", environ.get("GUNICORN_THREADS", 5))
+    ),
+    "max_overflow": int(environ.get("SQLALCHEMY_MAX_OVERFLOW", 10)),
+    # seconds a request waits for a connection before failing
+    "pool_timeout": int(environ.get("SQLALCHEMY_POOL_TIMEOUT", 30)),
+    # seconds after which connections are replaced
+    "pool_recycle": int(environ.get("SQLALCHEMY_POOL_RECYCLE", 3600)),
+    "pool_pre_ping": environ.get("SQLALCHEMY_POOL_PRE_PING", "true") == "true",
     "connect_args": {
         "client_session_keep_alive": True,
-        "private_key": load_private_key(
-            SNOWFLAKE_PRIVATE_KEY, environ["SNOWFLAKE_PRIVATE_KEY_PASSWORD"]
-        ),
-    }
+        # private_key is set on connect by SNOWFLAKE_PRIVATE_KEY_PROVIDER
+    },
 }
+# connections opened by each gunicorn worker at boot, 0 disables
+SQLALCHEMY_POOL_PREWARM = int(environ.get("SQLALCHEMY_POOL_PREWARM", 1))
 JSON_SORT_KEYS = False
 
 # Cognito
@@ -70,3 +95,55 @@ COGNITO_ISSUER = environ["COGNITO_ISSUER"]
 COGNITO_TOKEN_URL = (
     os.path.join(COGNITO_ISSUER, "oauth2/token") if COGNITO_ISSUER else None
 )
+# public keys are cached per worker and refreshed in background
+COGNITO_JWKS_CACHE_TTL = int(environ.get("COGNITO_JWKS_CACHE_TTL", 3600))
+# verified tokens are cached per worker until they expire
+COGNITO_TOKEN_CACHE_ENABLED = (
+    environ.get("COGNITO_TOKEN_CACHE_ENABLED", "true") == "true"
+)
+COGNITO_TOKEN_CACHE_SIZE = int(environ.get("COGNITO_TOKEN_CACHE_SIZE", 1024))
+
+# number of data asset instances written per transaction by stream upsert
+UPSERT_CHUNK_SIZE = int(environ.get("UPSERT_CHUNK_SIZE", DEFAULT_UPSERT_CHUNK_SIZE))
+
+# seconds list counts requested with count=cached are served for
+COUNT_CACHE_TTL = int(environ.get("COUNT_CACHE_TTL", DEFAULT_COUNT_CACHE_TTL))
+
+# configuration GET responses cached by ETag: local (per worker), shared (by
+# the workers of a host, in RESPONSE_CACHE_PATH) or none, ETags rotate every
+# RESPONSE_CACHE_TTL seconds
+RESPONSE_CACHE = environ.get("RESPONSE_CACHE", "local")
+RESPONSE_CACHE_TTL = int(environ.get("RESPONSE_CACHE_TTL", 60))
+RESPONSE_CACHE_SIZE = int(environ.get("RESPONSE_CACHE_SIZE", 1024))
+if environ.get("RESPONSE_CACHE_PATH"):
+    RESPONSE_CACHE_PATH = environ["RESPONSE_CACHE_PATH"]
+
+# pipeline task writes acknowledged once journaled in PIPELINE_TASK_BUFFER_PATH
+# (shared by the workers of a host, required) and written to the METADATA schema in
+# batches of PIPELINE_TASK_FLUSH_SIZE or every PIPELINE_TASK_FLUSH_INTERVAL s
+PIPELINE_TASK_WRITE_BEHIND = (
+    environ.get("PIPELINE_TASK_WRITE_BEHIND", "false") == "true"
+)
+PIPELINE_TASK_FLUSH_SIZE = int(environ.get("PIPELINE_TASK_FLUSH_SIZE", 500))
+PIPELINE_TASK_FLUSH_INTERVAL = float(environ.get("PIPELINE_TASK_FLUSH_INTERVAL", 2))
+if environ.get("PIPELINE_TASK_BUFFER_PATH"):
+    PIPELINE_TASK_BUFFER_PATH = environ["PIPELINE_TASK_BUFFER_PATH"]
+
+# seconds between the requeues of expired pipeline task leases, run by the
+# claims of each worker
+PIPELINE_TASK_LEASE_SWEEP_INTERVAL = float(
+    environ.get("PIPELINE_TASK_LEASE_SWEEP_INTERVAL", DEFAULT_LEASE_SWEEP_INTERVAL)
+)
+
+# log requests slower than this along with their SQL statements
+SLOW_REQUEST_THRESHOLD_MS = (
+    float(environ["SLOW_REQUEST_THRESHOLD_MS"])
+    if environ.get("SLOW_REQUEST_THRESHOLD_MS")
+    else None
+)
+
+# prometheus metrics of all workers, scraped from METRICS_PATH
+METRICS_ENABLED = environ.get("METRICS_ENABLED", "true") == "true"
+METRICS_PATH = environ.get("METRICS_PATH", "/metrics")
+# METRICS_PATH requires a token unless public, for internal only paths or ports
+METRICS_PUBLIC = environ.get("METRICS_PUBLIC", "false") == "true"
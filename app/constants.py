@@ -5,6 +5,29 @@ CONFIGURATION_SCHEMA = "CONFIGURATION"
 METADATA_SCHEMA = "METADATA"
 # Data asset constants
 INSTANCE_PATH_PREFIX = "{data_provider}/{data_asset}/{client_name}/"
+# number of data asset instances written per transaction by stream upsert
+DEFAULT_UPSERT_CHUNK_SIZE = 500
+# parents a stream upsert remembers across chunks, least recently used forgotten
+MAX_SHARED_PARENTS = 10000
+
+# seconds a cached list count is served for
+DEFAULT_COUNT_CACHE_TTL = 60
+
+# seconds a claimed pipeline task is leased to its worker, unless renewed
+DEFAULT_LEASE_SECONDS = 300
+MAX_LEASE_SECONDS = 24 * 3600
+# pipeline tasks claimed per request, at most
+MAX_CLAIM_LIMIT = 100
+# seconds between the requeues of expired pipeline task leases, per worker
+DEFAULT_LEASE_SWEEP_INTERVAL = 30
+
+
+# How total number of items of a list endpoint is counted
+class CountMode(enum.Enum):
+    EXACT = "exact"
+    CACHED = "cached"
+    NONE = "none"
+
 
 # file format defaults
 # Add enums in future for config UI to showcase common options
@@ -81,6 +104,28 @@ class PipelineTaskState(enum.Enum):
     CANCELLED = "CANCELLED"
     COMPLETED = "COMPLETED"
 
+    def can_transition_to(self, state) -> bool:
+        return state in PIPELINE_TASK_TRANSITIONS[self]
+
+    @property
+    def is_terminal(self) -> bool:
+        return not PIPELINE_TASK_TRANSITIONS[self]
+
+
+# states a pipeline task can move to from each state, queued tasks can be
+# cancelled before they run
+PIPELINE_TASK_TRANSITIONS = {
+    PipelineTaskState.QUEUED: {PipelineTaskState.RUNNING, PipelineTaskState.CANCELLED},
+    PipelineTaskState.RUNNING: {
+        PipelineTaskState.COMPLETED,
+        PipelineTaskState.FAILED,
+        PipelineTaskState.CANCELLED,
+    },
+    PipelineTaskState.COMPLETED: set(),
+    PipelineTaskState.FAILED: set(),
+    PipelineTaskState.CANCELLED: set(),
+}
+
 
 class PipelineTaskStatus(enum.Enum):
     SUCCESS = "SUCCESS"
@@ -27,4 +27,4 @@ def api_validation_error_handler(exc: HTTPException):
             exc.code,
         )
 
-    return make_response(jsonify(code=exc.code, error=exc.description))
+    return make_response(jsonify(code=exc.code, error=exc.description), exc.code)
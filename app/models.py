@@ -1,5 +1,5 @@
-from sqlalchemy import func, Sequence, String
-from sqlalchemy.orm import declared_attr
+from sqlalchemy import DDL, event, func, Sequence, String
+from sqlalchemy.orm import configure_mappers, declared_attr
 from sqlalchemy_utils import generic_relationship, ScalarListType, JSONType
 
 from app import db
@@ -24,6 +24,29 @@ from app.constants import (
 )
 
 
+def cluster_by(table, index_name, *columns):
+    """
+    Keep the rows of table sorted by columns for range lookups: a clustering
+    key on Snowflake (standard tables have no indexes), an index on SQLite
+    """
+    column_list = ", ".join(columns)
+    event.listen(
+        table,
+        "after_create",
+        DDL(f"ALTER TABLE %(fullname)s CLUSTER BY ({column_list})").execute_if(
+            dialect="snowflake"
+        ),
+    )
+    event.listen(
+        table,
+        "after_create",
+        DDL(
+            f"CREATE INDEX IF NOT EXISTS %(schema)s.{index_name} "
+            f"ON %(table)s ({column_list})"
+        ).execute_if(dialect="sqlite"),
+    )
+
+
 # Base Model that defines primary key and audit field standards
 # TODO: enhancement to query to filter out soft delete records
 class BaseModel(db.Model):
@@ -107,7 +130,7 @@ class Schema(ConfigurationSchemaBaseModel):
 
 class SchemaColumn(ConfigurationSchemaBaseModel):
     schema_id = db.Column(db.Integer, db.ForeignKey(Schema.id), nullable=False)
-    schema = db.relationship("Schema", backref=db.backref("columns", lazy="joined"))
+    schema = db.relationship("Schema", backref=db.backref("columns", lazy="select"))
     column_number = db.Column(db.Integer, nullable=True)
     column_name = db.Column(db.String(length=256), nullable=False)
     # cannot use ARRAY -> https://github.com/snowflakedb/snowflake-sqlalchemy/issues/299
@@ -164,9 +187,9 @@ class DataIngest(ConfigurationSchemaBaseModel):
 # Data Asset Models
 class DataAsset(ConfigurationSchemaBaseModel):
     domain_id = db.Column(db.Integer, db.ForeignKey(Domain.id), nullable=False)
-    domain = db.relationship("Domain", backref=db.backref("data_assets", lazy="joined"))
+    domain = db.relationship("Domain", backref=db.backref("data_assets", lazy="select"))
     schema_id = db.Column(db.Integer, db.ForeignKey(Schema.id), nullable=False)
-    schema = db.relationship("Schema", backref=db.backref("data_assets", lazy="joined"))
+    schema = db.relationship("Schema", backref=db.backref("data_assets", lazy="select"))
     name = db.Column(db.String(length=256), nullable=False)
     description = db.Column(db.Text(), nullable=True)
     s3_bucket = db.Column(db.String(length=256), nullable=False)
@@ -181,25 +204,25 @@ class DataAsset(ConfigurationSchemaBaseModel):
 class DataAssetInstance(ConfigurationSchemaBaseModel):
     data_asset_id = db.Column(db.Integer, db.ForeignKey(DataAsset.id), nullable=False)
     data_asset = db.relationship(
-        "DataAsset", backref=db.backref("instances", lazy="joined")
+        "DataAsset", backref=db.backref("instances", lazy="select")
     )
     file_format_id = db.Column(db.Integer, db.ForeignKey(FileFormat.id), nullable=False)
     file_format = db.relationship(
-        "FileFormat", backref=db.backref("instances", lazy="joined")
+        "FileFormat", backref=db.backref("instances", lazy="select")
     )
     schema_id = db.Column(db.Integer, db.ForeignKey(Schema.id), nullable=False)
-    schema = db.relationship("Schema", backref=db.backref("instances", lazy="joined"))
+    schema = db.relationship("Schema", backref=db.backref("instances", lazy="select"))
     client_id = db.Column(db.Integer, db.ForeignKey(Client.id), nullable=False)
-    client = db.relationship("Client", backref=db.backref("instances", lazy="joined"))
+    client = db.relationship("Client", backref=db.backref("instances", lazy="select"))
     data_provider_id = db.Column(
         db.Integer, db.ForeignKey(DataProvider.id), nullable=False
     )
     data_provider = db.relationship(
-        "DataProvider", backref=db.backref("instances", lazy="joined")
+        "DataProvider", backref=db.backref("instances", lazy="select")
     )
     data_ingest_id = db.Column(db.Integer, db.ForeignKey(DataIngest.id), nullable=True)
     data_ingest = db.relationship(
-        "DataIngest", backref=db.backref("instances", lazy="joined")
+        "DataIngest", backref=db.backref("instances", lazy="select")
     )
     source_type = db.Column(db.Unicode(length=255), nullable=False)
     source_id = db.Column(db.Integer)
@@ -232,7 +255,7 @@ class Function(ConfigurationSchemaBaseModel):
 class FunctionArgument(ConfigurationSchemaBaseModel):
     function_id = db.Column(db.Integer, db.ForeignKey(Function.id), nullable=False)
     function = db.relationship(
-        "Function", backref=db.backref("arguments", lazy="joined")
+        "Function", backref=db.backref("arguments", lazy="select")
     )
     name = db.Column(db.String(length=256), nullable=False)
     description = db.Column(db.Text(), nullable=True)
@@ -245,17 +268,29 @@ class FunctionMapping(ConfigurationSchemaBaseModel):
         db.Integer, db.ForeignKey(DataAssetInstance.id), nullable=False
     )
     data_asset_instance = db.relationship(
-        "DataAssetInstance", backref=db.backref("function_mappings", lazy="select")
+        "DataAssetInstance",
+        backref=db.backref(
+            "function_mappings", lazy="select", order_by="FunctionMapping.seq_num"
+        ),
     )
     function_id = db.Column(db.Integer, db.ForeignKey(Function.id), nullable=False)
     function = db.relationship(
-        "Function", backref=db.backref("function_mappings", lazy="joined")
+        "Function", backref=db.backref("function_mappings", lazy="select")
     )
     argument_value = db.Column(JSONType, nullable=True)
     alias_name = db.Column(db.String(length=256), nullable=True)
     seq_num = db.Column(db.Integer, nullable=False)
 
 
+# mappings are read per instance in seq_num order
+cluster_by(
+    FunctionMapping.__table__,
+    "ix_functionmapping_instance_seq",
+    "data_asset_instance_id",
+    "seq_num",
+)
+
+
 # Metadata Tables
 class PipelineTask(MetadataSchemaBaseModel):
     data_asset_instance_id = db.Column(
@@ -266,7 +301,7 @@ class PipelineTask(MetadataSchemaBaseModel):
     )
     data_asset_id = db.Column(db.Integer, db.ForeignKey(DataAsset.id), nullable=True)
     data_asset = db.relationship(
-        "DataAsset", backref=db.backref("pipeline_tasks", lazy="joined")
+        "DataAsset", backref=db.backref("pipeline_tasks", lazy="select")
     )
     external_id = db.Column(db.String(length=256), nullable=True)
     service_name = db.Column(db.String(length=256), nullable=False)
@@ -286,3 +321,22 @@ class PipelineTask(MetadataSchemaBaseModel):
     )
     # if status is done, then ended_at needs to be populated
     ended_at = db.Column(db.DateTime(timezone=True), nullable=True)
+    # worker a claimed task is leased to, until lease_expires_at
+    lease_owner = db.Column(db.String(length=256), nullable=True)
+    lease_expires_at = db.Column(db.DateTime(timezone=True), nullable=True)
+    # unique to the claim that leased the task, to read the claimed tasks back
+    claim_token = db.Column(db.String(length=32), nullable=True)
+
+
+# tasks are listed per instance, newest first by started_at
+cluster_by(
+    PipelineTask.__table__,
+    "ix_pipelinetask_instance_started",
+    "data_asset_instance_id",
+    "started_at",
+)
+
+
+# set up backref attributes (e.g. Schema.columns) so that they can be used in
+# loader options at import time
+configure_mappers()
@@ -4,13 +4,20 @@
    Only if it's a Nested field or Enum field ,
    we will have to define it on schema.
 """
+import datetime as dt
+
 import marshmallow as ma
 from flask_smorest.fields import Upload
-from marshmallow import validates_schema, ValidationError
+from marshmallow import pre_load, validates_schema, ValidationError
 from marshmallow_enum import EnumField
 from marshmallow_sqlalchemy import SQLAlchemySchema, fields
 
+from app.common.db_utils import IN_CLAUSE_CHUNK_SIZE
+from app.common.schema import PolymorphicNested
 from app.constants import (
+    DEFAULT_LEASE_SECONDS,
+    MAX_CLAIM_LIMIT,
+    MAX_LEASE_SECONDS,
     SchemaType,
     FileFormatType,
     CompressionAlgorithm,
@@ -211,6 +218,10 @@ class DataAssetInstanceSchema(BaseModelSchema):
     schema = fields.Nested(DataAssetSchemaSchema())
     client = fields.Nested(ClientSchema(only=["id", "name"]))
     data_provider = fields.Nested(DataProviderSchema(only=["id", "name"]))
+    # source by source_type, without credentials
+    source = PolymorphicNested(
+        {SFTPSource.__name__: SFTPSourceSchema(exclude=["passphrase"])}
+    )
     schedule_type = EnumField(ScheduleType)
 
     class Meta:
@@ -226,6 +237,7 @@ class DataAssetInstanceSchema(BaseModelSchema):
             "data_provider",
             "source_type",
             "source_id",
+            "source",
             "name",
             "description",
             "db_schema",
@@ -295,10 +307,32 @@ class FunctionMappingSchema(BaseModelSchema):
         ]
 
 
+class DataAssetInstanceBundleSchema(DataAssetInstanceSchema):
+    # everything needed to run the instance, function mappings in seq_num order
+    function_mappings = fields.Nested(FunctionMappingSchema(many=True))
+
+    class Meta(DataAssetInstanceSchema.Meta):
+        fields = DataAssetInstanceSchema.Meta.fields + ["function_mappings"]
+
+
 class DataAssetInstanceUpsertRequestSchema(ma.Schema):
     file = Upload(allow_none=False, required=True)
 
 
+class StreamUpsertQuerySchema(ma.Schema):
+    chunk_size = ma.fields.Integer(validate=ma.validate.Range(min=1, max=10000))
+
+
+class BulkUpsertResultSchema(ma.Schema):
+    index = ma.fields.Integer()
+    id = ma.fields.Integer(allow_none=True)
+    status = ma.fields.String()
+    error = ma.fields.String()
+
+    class Meta:
+        ordered = True
+
+
 # Metadata Schema
 class PipelineTaskSchema(BaseModelSchema):
     state = EnumField(PipelineTaskState)
@@ -306,8 +340,15 @@ class PipelineTaskSchema(BaseModelSchema):
     task_type = EnumField(PipelineTaskType, required=True)
     service_name = ma.fields.String(required=True)
     extra_info = ma.fields.Dict(required=False)
-
-    @validates_schema
+    started_at = ma.fields.DateTime()
+    ended_at = ma.fields.DateTime(allow_none=True)
+    # set by claims, see /pipeline-tasks/claim
+    lease_owner = ma.fields.String(dump_only=True)
+    lease_expires_at = ma.fields.DateTime(dump_only=True)
+
+    # bulk creates report the errors of every item, including items with
+    # field errors
+    @validates_schema(skip_on_field_errors=False)
     def validate(self, data, *, session=None, **kwargs):
         # only enforce during create
         if not self.partial:
@@ -335,11 +376,170 @@ class PipelineTaskSchema(BaseModelSchema):
             "extra_info",
             "started_at",
             "ended_at",
+            "lease_owner",
+            "lease_expires_at",
             "created_at",
             "updated_at",
         ]
 
 
+class PipelineTaskBulkCreateSchema(PipelineTaskSchema):
+    """Pipeline tasks of a bulk create, IN_CLAUSE_CHUNK_SIZE of them at most"""
+
+    @pre_load(pass_many=True)
+    def validate_size(self, data, many, **kwargs):
+        # before the items are validated one by one
+        if many and isinstance(data, list) and len(data) > IN_CLAUSE_CHUNK_SIZE:
+            raise ValidationError(
+                f"At most {IN_CLAUSE_CHUNK_SIZE} pipeline tasks per request"
+            )
+        return data
+
+
+class PipelineTaskQuerySchema(ma.Schema):
+    """Filters of the Pipeline task list, all the given ones must match"""
+
+    data_asset_instance_id = ma.fields.Integer()
+    data_asset_id = ma.fields.Integer()
+    state = EnumField(PipelineTaskState)
+    status = EnumField(PipelineTaskStatus)
+    task_type = EnumField(PipelineTaskType)
+    service_name = ma.fields.String()
+    external_id = ma.fields.String()
+    # started_at range, from inclusive to exclusive
+    started_after = ma.fields.AwareDateTime(default_timezone=dt.timezone.utc)
+    started_before = ma.fields.AwareDateTime(default_timezone=dt.timezone.utc)
+
+    class Meta:
+        # pagination parameters are parsed by the paginate decorator
+        unknown = ma.EXCLUDE
+
+
+class PipelineTaskBulkFilterSchema(ma.Schema):
+    """Tasks of a set based update, all the given criteria must match"""
+
+    ids = ma.fields.List(
+        ma.fields.Integer(),
+        validate=ma.validate.Length(min=1, max=IN_CLAUSE_CHUNK_SIZE),
+    )
+    data_asset_instance_id = ma.fields.Integer()
+    data_asset_id = ma.fields.Integer()
+    service_name = ma.fields.String()
+    task_type = EnumField(PipelineTaskType)
+    state = EnumField(PipelineTaskState)
+
+    @validates_schema
+    def validate(self, data, **kwargs):
+        if not data:
+            raise ValidationError("At least one criterion is required")
+        return data
+
+
+class PipelineTaskBulkUpdateSchema(ma.Schema):
+    filter = ma.fields.Nested(PipelineTaskBulkFilterSchema(), required=True)
+    values = ma.fields.Nested(
+        PipelineTaskSchema(
+            partial=True,
+            only=["external_id", "state", "status", "extra_info", "ended_at"],
+        ),
+        required=True,
+        validate=ma.validate.Length(min=1),
+    )
+
+    @validates_schema
+    def validate(self, data, **kwargs):
+        # state changes are conditional on the expected state, as transitions
+        state = data["values"].get("state")
+        if state is None:
+            return data
+        expected = data["filter"].get("state")
+        if expected is None:
+            raise ValidationError(
+                "State changes require the expected state as filter state",
+                field_name="values",
+            )
+        if not expected.can_transition_to(state):
+            raise ValidationError(
+                f"{state.name} can not follow {expected.name}", field_name="values"
+            )
+        return data
+
+    class Meta:
+        ordered = True
+
+
+class BulkUpdateResultSchema(ma.Schema):
+    updated = ma.fields.Integer()
+
+
+class PipelineTaskTransitionSchema(ma.Schema):
+    """Move a task from the expected state to state, if it still is in it"""
+
+    expected = EnumField(PipelineTaskState, required=True)
+    state = EnumField(PipelineTaskState, required=True)
+    # worker the task is leased to, required when leased: a worker that lost
+    # its lease can not complete the task another worker claimed since
+    worker_id = ma.fields.String()
+    status = EnumField(PipelineTaskStatus)
+    extra_info = ma.fields.Dict()
+    # defaults to now when state is terminal
+    ended_at = ma.fields.DateTime()
+
+    @validates_schema
+    def validate(self, data, **kwargs):
+        if not data["expected"].can_transition_to(data["state"]):
+            raise ValidationError(
+                f"{data['state'].name} can not follow {data['expected'].name}",
+                field_name="state",
+            )
+        return data
+
+    class Meta:
+        ordered = True
+
+
+class PipelineTaskLeaseSchema(ma.Schema):
+    worker_id = ma.fields.String(required=True, validate=ma.validate.Length(min=1))
+    lease_seconds = ma.fields.Integer(
+        load_default=DEFAULT_LEASE_SECONDS,
+        validate=ma.validate.Range(min=1, max=MAX_LEASE_SECONDS),
+    )
+
+    class Meta:
+        ordered = True
+
+
+class PipelineTaskClaimSchema(PipelineTaskLeaseSchema):
+    """Claim QUEUED tasks of a type and service, oldest first"""
+
+    task_type = EnumField(PipelineTaskType)
+    service_name = ma.fields.String()
+    limit = ma.fields.Integer(
+        load_default=1, validate=ma.validate.Range(min=1, max=MAX_CLAIM_LIMIT)
+    )
+
+
+class PipelineTaskLeaseResultSchema(ma.Schema):
+    id = ma.fields.Integer()
+    # whether the task still was leased to the worker and the lease extended
+    applied = ma.fields.Boolean()
+    lease_expires_at = ma.fields.DateTime(allow_none=True)
+
+    class Meta:
+        ordered = True
+
+
+class PipelineTaskTransitionResultSchema(ma.Schema):
+    id = ma.fields.Integer()
+    # whether the task was in the expected state and moved to the new one
+    applied = ma.fields.Boolean()
+    # state of the task after the request
+    state = EnumField(PipelineTaskState)
+
+    class Meta:
+        ordered = True
+
+
 # List Schemas (used to load/dump many records, List APIs)
 domains_schema = DomainSchema(many=True)
 data_providers_schema = DataProviderSchema(many=True)
@@ -349,6 +549,7 @@ data_asset_instances_schema = DataAssetInstanceSchema(
     many=True, exclude=["file_format", "schema", "data_ingest"]
 )
 function_mappings_schema = FunctionMappingSchema(many=True)
+bulk_upsert_results_schema = BulkUpsertResultSchema(many=True)
 
 # Get Schemas ( used to load/dump single record)
 domain_schema = DomainSchema()
@@ -356,5 +557,17 @@ data_provider_schema = DataProviderSchema()
 client_schema = ClientSchema()
 data_asset_schema = DataAssetSchema()
 data_asset_instance_schema = DataAssetInstanceSchema()
+data_asset_instance_bundle_schema = DataAssetInstanceBundleSchema()
 sftp_source_schema = SFTPSourceSchema()
 pipeline_task_schema = PipelineTaskSchema()
+pipeline_tasks_schema = PipelineTaskSchema(many=True)
+pipeline_task_bulk_create_schema = PipelineTaskBulkCreateSchema(many=True)
+pipeline_task_update_schema = PipelineTaskSchema(partial=True)
+pipeline_task_query_schema = PipelineTaskQuerySchema()
+pipeline_task_bulk_update_schema = PipelineTaskBulkUpdateSchema()
+bulk_update_result_schema = BulkUpdateResultSchema()
+pipeline_task_transition_schema = PipelineTaskTransitionSchema()
+pipeline_task_transition_result_schema = PipelineTaskTransitionResultSchema()
+pipeline_task_claim_schema = PipelineTaskClaimSchema()
+pipeline_task_lease_schema = PipelineTaskLeaseSchema()
+pipeline_task_lease_result_schema = PipelineTaskLeaseResultSchema()
@@ -1,5 +1,26 @@
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, inspect, or_, select
+from sqlalchemy.exc import DataError, IntegrityError
+
 from app import db
-from app.common.db_utils import upsert_by_id
+from app.common.cache import response_cache
+from app.common.controllers import count_cache
+from app.common.db_utils import _to_column_params, bulk_upsert_by_id
+from app.common.logging import get_logger
+from app.constants import (
+    DEFAULT_LEASE_SECONDS,
+    DEFAULT_LEASE_SWEEP_INTERVAL,
+    DEFAULT_UPSERT_CHUNK_SIZE,
+    MAX_SHARED_PARENTS,
+    PipelineTaskState,
+)
 from app.models import (
     Domain,
     DataAsset,
@@ -11,49 +32,482 @@ from app.models import (
     Client,
     SchemaColumn,
     Schema,
+    PipelineTask,
+)
+
+LOGGER = get_logger(__name__, level="INFO")
+
+# models written by a data asset instance upsert
+UPSERTED_MODELS = (
+    DataAssetInstance,
+    DataAsset,
+    Domain,
+    Client,
+    DataProvider,
+    FileFormat,
+    DataIngest,
+    Schema,
+    SchemaColumn,
+    SFTPSource,
+)
+
+
+def _dedupe_key(model, data):
+    dump = json.dumps(data, sort_keys=True, default=str)
+    return model, hashlib.sha1(dump.encode("utf-8")).digest()
+
+
+class SharedParents:
+    """
+    Ids of the parents upserted by a stream of batches, by payload: the ones
+    of the current batch, and the ones committed by previous batches,
+    ``maxsize`` of them at most, least recently used first forgotten.
+    """
+
+    def __init__(self, maxsize=MAX_SHARED_PARENTS):
+        self.maxsize = maxsize
+        self._pending = {}
+        self._ids = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._pending or key in self._ids
+
+    def __getitem__(self, key):
+        if key in self._pending:
+            return self._pending[key]
+        self._ids.move_to_end(key)
+        return self._ids[key]
+
+    def __setitem__(self, key, _id):
+        self._pending[key] = _id
+
+    def clear(self):
+        """Forget the ids of the current batch, rolled back"""
+        self._pending.clear()
+
+    def commit(self):
+        """Keep the ids of the committed batch"""
+        for key, _id in self._pending.items():
+            self._ids[key] = _id
+            self._ids.move_to_end(key)
+        self._pending.clear()
+        while len(self._ids) > self.maxsize:
+            self._ids.popitem(last=False)
+
+
+# many-to-one parents of the upserted models: (key, model, required)
+UPSERT_PARENTS = {
+    DataAsset: (("domain", Domain, True), ("schema", Schema, False)),
+    DataAssetInstance: (
+        ("data_asset", DataAsset, True),
+        ("client", Client, True),
+        ("data_provider", DataProvider, True),
+        ("file_format", FileFormat, False),
+        ("data_ingest", DataIngest, False),
+        ("schema", Schema, False),
+    ),
+}
+
+# order the models of a data asset instance upsert are written in, parents first
+UPSERT_ORDER = (
+    Domain,
+    Schema,
+    Client,
+    DataProvider,
+    FileFormat,
+    DataIngest,
+    DataAsset,
+    SFTPSource,
+    DataAssetInstance,
 )
 
 
-def upsert_schema(data):
-    schema_cols = data.pop("columns", [])
-    schema = upsert_by_id(Schema, data)
-    for col_data in schema_cols:
-        col_data["schema"] = schema
-        upsert_by_id(SchemaColumn, col_data)
+class UpsertPlan:
+    """
+    Rows of a batch of data asset instances and of their parents, written
+    model by model with bulk_upsert_by_id, i.e. a fixed number of round trips
+    no matter how many instances are upserted.
+
+    Identical parent data shared by many instances maps to the same record,
+    upserted once per payload, ``seen`` holds the ids of the ones upserted by
+    previous batches.
+    """
 
-    return schema
+    def __init__(self, seen=None):
+        self.seen = seen if seen is not None else {}
+        # model -> key -> (column params, foreign key -> parent key)
+        self.rows = defaultdict(dict)
+        # schema key -> column params of its columns
+        self.columns = {}
+        self.instances = []
 
+    def add_instance(self, data):
+        """
+        Add a data asset instance along with its parents, raises if its data
+        is invalid, nothing is written until upsert.
+        """
+        data = dict(data)
+        refs = self._add_parents(DataAssetInstance, data)
+        source = data.pop("source", None)
+        if source:
+            key = (SFTPSource, len(self.rows[SFTPSource]))
+            self.rows[SFTPSource][key] = (_to_column_params(SFTPSource, source), {})
+            # set by the generic relationship when given the record
+            data["source_type"] = SFTPSource.__name__
+            refs["source_id"] = key
+        key = (DataAssetInstance, len(self.instances))
+        self.rows[DataAssetInstance][key] = (
+            _to_column_params(DataAssetInstance, data),
+            refs,
+        )
+        self.instances.append(key)
 
-def upsert_data_asset(data):
-    data["domain"] = upsert_by_id(Domain, data["domain"])
-    if data.get("schema"):
-        data["schema"] = upsert_schema(data["schema"])
-    return upsert_by_id(DataAsset, data)
+    def _add_shared(self, model, data):
+        key = _dedupe_key(model, data)
+        if key in self.seen or key in self.rows[model]:
+            return key
+        data = dict(data)
+        refs = self._add_parents(model, data)
+        if model is Schema:
+            self.columns[key] = [
+                _to_column_params(SchemaColumn, column)
+                for column in data.pop("columns", [])
+            ]
+        self.rows[model][key] = (_to_column_params(model, data), refs)
+        return key
+
+    def _add_parents(self, model, data):
+        mapper = inspect(model)
+        refs = {}
+        for name, parent, required in UPSERT_PARENTS.get(model, ()):
+            value = data.pop(name) if required else data.pop(name, None)
+            if value:
+                (local_column,) = mapper.relationships[name].local_columns
+                refs[local_column.key] = self._add_shared(parent, value)
+        return refs
+
+    def _id(self, ids, key):
+        return ids[key] if key in ids else self.seen[key]
+
+    def upsert(self):
+        """Write the rows, parents first, return the ids of the instances"""
+        ids = {}
+        for model in UPSERT_ORDER:
+            keys = list(self.rows[model])
+            rows = []
+            for key in keys:
+                row, refs = self.rows[model][key]
+                row.update({fk: self._id(ids, ref) for fk, ref in refs.items()})
+                rows.append(row)
+            ids.update(zip(keys, bulk_upsert_by_id(model, rows)))
+            if model is Schema:
+                columns = []
+                for key, schema_columns in self.columns.items():
+                    for column in schema_columns:
+                        column["schema_id"] = ids[key]
+                    columns.extend(schema_columns)
+                bulk_upsert_by_id(SchemaColumn, columns)
+
+        for model, rows in self.rows.items():
+            if model not in (SFTPSource, DataAssetInstance):
+                for key in rows:
+                    self.seen[key] = ids[key]
+        return [ids[key] for key in self.instances]
 
 
 def upsert_data_asset_instance(data):
-    # Insert Data Asset
-    data["data_asset"] = upsert_data_asset(data["data_asset"])
+    """
+    Upsert data asset instance along with its parents.
+    :param data: data asset instance data
+    """
+    plan = UpsertPlan()
+    plan.add_instance(data)
+    (instance_id,) = plan.upsert()
+    db.session.commit()
+    count_cache.invalidate()
+    response_cache.invalidate(*UPSERTED_MODELS)
+    return db.session.get(DataAssetInstance, instance_id)
+
+
+def bulk_upsert_data_asset_instances(items, seen=None):
+    """
+    Upsert many data asset instances in a single transaction.
+
+    Parents shared by instances are upserted once, every model is written with
+    a single bulk upsert. Snowflake has no savepoints, so the batch is all or
+    nothing: the first invalid item fails the batch before anything is
+    written and the remaining items are skipped, a failing write rolls back
+    the whole transaction and fails every item.
+
+    :param items: iterable of data asset instance data
+    :param seen: parents already upserted by previous batches
+    :return: tuple of per item results and whether the batch was committed
+    """
+    seen = SharedParents() if seen is None else seen
+    plan = UpsertPlan(seen)
+    results = []
+    failed = False
+    for index, data in enumerate(items):
+        if failed:
+            # the batch is not written, report the rest as skipped
+            results.append({"index": index, "id": None, "status": "skipped"})
+            continue
+        try:
+            plan.add_instance(data)
+            results.append({"index": index, "id": None, "status": "upserted"})
+        except (TypeError, ValueError, LookupError, AttributeError) as exc:
+            failed = True
+            results.append(
+                {"index": index, "id": None, "status": "failed", "error": str(exc)}
+            )
+
+    if failed:
+        for result in results:
+            if result["status"] == "upserted":
+                result["status"] = "rolled_back"
+        return results, False
+
+    try:
+        ids = plan.upsert()
+    except (IntegrityError, DataError) as exc:
+        db.session.rollback()
+        # parents upserted in this batch are rolled back too
+        seen.clear()
+        error = str(exc.orig)
+        for result in results:
+            result.update(status="failed", error=error)
+        return results, False
+
+    db.session.commit()
+    seen.commit()
+    for result, _id in zip(results, ids):
+        result["id"] = _id
+    # any configuration model might have been written
+    count_cache.invalidate()
+    response_cache.invalidate(*UPSERTED_MODELS)
+    return results, True
+
+
+def stream_upsert_data_asset_instances(items, chunk_size=DEFAULT_UPSERT_CHUNK_SIZE):
+    """
+    Upsert data asset instances from a (lazy) iterable in chunks.
+
+    Every chunk is written in its own transaction and only the current chunk
+    is held in memory, no matter how many items are upserted. Shared parents
+    are upserted once across chunks, the ids of MAX_SHARED_PARENTS of them are
+    kept. A failing chunk is rolled back and the next chunks are still
+    processed.
+
+    :param items: iterable of data asset instance data, e.g. iter_json_records
+    :param chunk_size: number of instances per transaction
+    :return: generator of progress dicts, one per chunk
+    """
+    processed = upserted = 0
+    seen = SharedParents()
+    iterator = iter(items)
+    chunk_number = 0
+    parse_error = None
+    while parse_error is None:
+        chunk = []
+        try:
+            for item in iterator:
+                chunk.append(item)
+                if len(chunk) >= chunk_size:
+                    break
+        except ValueError as exc:
+            # malformed record, nothing after it can be read
+            parse_error = exc
+        if not chunk:
+            break
+
+        chunk_number += 1
+        results, committed = bulk_upsert_data_asset_instances(chunk, seen=seen)
+
+        errors = [
+            dict(result, index=result["index"] + processed)
+            for result in results
+            if result["status"] == "failed"
+        ]
+        processed += len(results)
+        if committed:
+            upserted += len(results)
+        LOGGER.info(
+            "Stream upsert chunk %s: %s processed, %s upserted",
+            chunk_number,
+            processed,
+            upserted,
+        )
+        progress = {
+            "chunk": chunk_number,
+            "processed": processed,
+            "upserted": upserted,
+            "committed": committed,
+        }
+        if errors:
+            progress["errors"] = errors
+        yield progress
+
+    if parse_error is not None:
+        LOGGER.error(
+            "Stream upsert stopped at item %s", processed, exc_info=parse_error
+        )
+        yield {"processed": processed, "upserted": upserted, "error": str(parse_error)}
 
-    # Upsert Data Asset Instance
-    data["client"] = upsert_by_id(Client, data["client"])
 
-    data["data_provider"] = upsert_by_id(DataProvider, data["data_provider"])
+def pipeline_task_transition_values(state, values):
+    """Columns set by a pipeline task transition to state, along values"""
+    values = dict(values, state=state)
+    if state.is_terminal:
+        if values.get("ended_at") is None:
+            values["ended_at"] = func.current_timestamp()
+        # a finished task is not leased anymore
+        values.update(lease_owner=None, lease_expires_at=None)
+    return values
 
-    if data.get("file_format"):
-        data["file_format"] = upsert_by_id(FileFormat, data["file_format"])
 
-    if data.get("data_ingest"):
-        data["data_ingest"] = upsert_by_id(DataIngest, data["data_ingest"])
+def transition_pipeline_task(task_id, expected, state, worker_id=None, **values):
+    """
+    Move a pipeline task to state if it is still in the expected one, a single
+    conditional UPDATE (compare-and-set): concurrent updaters cannot overwrite
+    each other's transition, only one of them applies. ended_at is set and
+    the lease cleared when state is terminal, unless given.
 
-    if data.get("schema"):
-        data["schema"] = upsert_schema(data["schema"])
+    A leased task only transitions for the worker it is leased to: a worker
+    whose lease expired cannot finish the task another worker claimed since.
 
-    # upsert sftp source
-    if data.get("source"):
-        data["source"] = upsert_by_id(SFTPSource, data["source"])
-        data["source_id"] = data["source"].id
+    :param task_id: pipeline task id
+    :param expected: state the task must be in
+    :param state: new state, allowed from expected by PIPELINE_TASK_TRANSITIONS
+    :param worker_id: worker the task must be leased to, if leased
+    :param values: other columns to set along, e.g. status
+    :return: True if applied, False if the task is not in the expected state
+        (or leased to another worker, or does not exist)
+    """
+    if not expected.can_transition_to(state):
+        raise ValueError(
+            f"Invalid pipeline task transition {expected.name} -> {state.name}"
+        )
 
-    data_asset_instance = upsert_by_id(DataAssetInstance, data)
+    values = pipeline_task_transition_values(state, values)
+    query = PipelineTask.query.filter(
+        PipelineTask.id == task_id,
+        PipelineTask.state == expected,
+        or_(PipelineTask.lease_owner.is_(None), PipelineTask.lease_owner == worker_id),
+    )
+    updated = query.update(values, synchronize_session=False)
     db.session.commit()
-    return data_asset_instance
+    if updated:
+        count_cache.invalidate(PipelineTask)
+    return bool(updated)
+
+
+def claim_pipeline_tasks(
+    worker_id, limit=1, lease_seconds=DEFAULT_LEASE_SECONDS, **criteria
+):
+    """
+    Move up to limit QUEUED pipeline tasks matching criteria (e.g. task_type,
+    service_name), oldest first, to RUNNING, leased to worker_id.
+
+    A single conditional UPDATE picks and leases the tasks, the state of each
+    row is compared again so that a task is never claimed twice: tasks a
+    concurrent claim took first are skipped, fewer tasks are returned then.
+    The claimed tasks are read back by a token unique to the claim.
+
+    :param worker_id: id of the claiming worker
+    :param limit: number of tasks claimed, at most
+    :param lease_seconds: seconds the tasks are leased for, unless renewed
+    :return: claimed tasks
+    """
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=lease_seconds)
+    token = uuid.uuid4().hex
+    candidates = (
+        select(PipelineTask.id)
+        .filter_by(state=PipelineTaskState.QUEUED, **criteria)
+        .order_by(PipelineTask.started_at, PipelineTask.id)
+        .limit(limit)
+    )
+    claimed = PipelineTask.query.filter(
+        PipelineTask.id.in_(candidates),
+        PipelineTask.state == PipelineTaskState.QUEUED,
+    ).update(
+        {
+            "state": PipelineTaskState.RUNNING,
+            "lease_owner": worker_id,
+            "lease_expires_at": expires_at,
+            "claim_token": token,
+        },
+        synchronize_session=False,
+    )
+    db.session.commit()
+    if not claimed:
+        return []
+    count_cache.invalidate(PipelineTask)
+    return (
+        PipelineTask.query.filter_by(
+            state=PipelineTaskState.RUNNING, lease_owner=worker_id, claim_token=token
+        )
+        .order_by(PipelineTask.started_at, PipelineTask.id)
+        .all()
+    )
+
+
+def renew_pipeline_task_lease(task_id, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """
+    Extend the lease of a RUNNING pipeline task held by worker_id
+
+    :return: new lease expiry, None if the task is not leased to the worker
+        (anymore)
+    """
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=lease_seconds)
+    renewed = PipelineTask.query.filter(
+        PipelineTask.id == task_id,
+        PipelineTask.state == PipelineTaskState.RUNNING,
+        PipelineTask.lease_owner == worker_id,
+    ).update({"lease_expires_at": expires_at}, synchronize_session=False)
+    db.session.commit()
+    return expires_at if renewed else None
+
+
+def requeue_expired_leases():
+    """
+    Move the RUNNING pipeline tasks whose lease expired back to QUEUED, their
+    worker is gone, another one claims them
+
+    :return: number of tasks requeued
+    """
+    requeued = PipelineTask.query.filter(
+        PipelineTask.state == PipelineTaskState.RUNNING,
+        PipelineTask.lease_expires_at < datetime.now(timezone.utc),
+    ).update(
+        {
+            "state": PipelineTaskState.QUEUED,
+            "lease_owner": None,
+            "lease_expires_at": None,
+        },
+        synchronize_session=False,
+    )
+    db.session.commit()
+    if requeued:
+        LOGGER.info("Requeued %s pipeline tasks of expired leases", requeued)
+        count_cache.invalidate(PipelineTask)
+    return requeued
+
+
+class LeaseSweeper:
+    """Requeues expired pipeline task leases at most once per interval, per worker"""
+
+    def __init__(self):
+        self._next_sweep = 0.0
+        self._lock = threading.Lock()
+
+    def maybe_sweep(self, interval=DEFAULT_LEASE_SWEEP_INTERVAL):
+        """Requeue expired leases if interval elapsed, returns the tasks requeued"""
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_sweep:
+                return 0
+            self._next_sweep = now + interval
+        return requeue_expired_leases()
+
+
+lease_sweeper = LeaseSweeper()
@@ -1,18 +1,28 @@
 import json
 
-from flask import request, abort
+from flask import request, abort, current_app, Response
 from flask_smorest.pagination import PaginationParameters
+from sqlalchemy.orm import joinedload, selectinload
 
 from app.common.blueprint import EnhancedBlueprint
 from app.common.controllers import ListMethodView, BaseMethodView
 from app.common.schema import paginated_schema_factory
+from app.common.utils import load_json_records, iter_json_records
+from app.constants import DEFAULT_UPSERT_CHUNK_SIZE
 from app.models import (
     Domain,
     DataProvider,
     Client,
     DataAsset,
     DataAssetInstance,
+    DataIngest,
+    FileFormat,
+    Function,
+    FunctionArgument,
     FunctionMapping,
+    Schema,
+    SchemaColumn,
+    SFTPSource,
 )
 from app.schema import (
     domains_schema,
@@ -24,12 +34,19 @@ from app.schema import (
     data_assets_schema,
     data_asset_schema,
     data_asset_instance_schema,
+    data_asset_instance_bundle_schema,
     data_asset_instances_schema,
     function_mappings_schema,
     sftp_source_schema,
+    bulk_upsert_results_schema,
     DataAssetInstanceUpsertRequestSchema,
+    StreamUpsertQuerySchema,
+)
+from app.service import (
+    upsert_data_asset_instance,
+    bulk_upsert_data_asset_instances,
+    stream_upsert_data_asset_instances,
 )
-from app.service import upsert_data_asset_instance
 
 blp = EnhancedBlueprint("v1", __name__)
 
@@ -41,13 +58,16 @@ def default():
 
 @blp.route("/domains/", tags=["domain"])
 class DomainList(ListMethodView):
+    cache_models = [Domain]
     ordering = Domain.created_at.desc()
+    schema = domains_schema
+    load_options = []
 
     def get_query(self):
         return Domain.query
 
     @blp.response(200, schema=paginated_schema_factory(domains_schema))
-    @blp.paginate()
+    @blp.paginate(cursor=True)
     def get(self, pagination_parameters: PaginationParameters):
         """List Domains"""
         return self.list(pagination_parameters)
@@ -55,21 +75,27 @@ class DomainList(ListMethodView):
 
 @blp.route("/domains/<int:domain_id>", tags=["domain"])
 class DomainGet(BaseMethodView):
+    cache_models = [Domain]
+    load_options = []
+
     @blp.response(200, domain_schema)
     def get(self, domain_id):
         """Get Domain by Id"""
-        return Domain.query.get_or_404(domain_id)
+        return self.apply_load_options(Domain.query).get_or_404(domain_id)
 
 
 @blp.route("/data-providers/", tags=["data-provider"])
 class DataProviderList(ListMethodView):
+    cache_models = [DataProvider]
     ordering = DataProvider.created_at.desc()
+    schema = data_providers_schema
+    load_options = []
 
     def get_query(self):
         return DataProvider.query
 
     @blp.response(200, schema=paginated_schema_factory(data_providers_schema))
-    @blp.paginate()
+    @blp.paginate(cursor=True)
     def get(self, pagination_parameters: PaginationParameters):
         """List data providers"""
         return self.list(pagination_parameters)
@@ -77,21 +103,27 @@ class DataProviderList(ListMethodView):
 
 @blp.route("/data-providers/<int:data_provider_id>", tags=["data-provider"])
 class DataProviderGet(BaseMethodView):
+    cache_models = [DataProvider]
+    load_options = []
+
     @blp.response(200, data_provider_schema)
     def get(self, data_provider_id):
         """Get Data Provider by Id"""
-        return DataProvider.query.get_or_404(data_provider_id)
+        return self.apply_load_options(DataProvider.query).get_or_404(data_provider_id)
 
 
 @blp.route("/clients/", tags=["client"])
 class ClientList(ListMethodView):
+    cache_models = [Client]
     ordering = Client.created_at.desc()
+    schema = clients_schema
+    load_options = []
 
     def get_query(self):
         return Client.query
 
     @blp.response(200, schema=paginated_schema_factory(clients_schema))
-    @blp.paginate()
+    @blp.paginate(cursor=True)
     def get(self, pagination_parameters: PaginationParameters):
         """List clients"""
         return self.list(pagination_parameters)
@@ -99,21 +131,27 @@ class ClientList(ListMethodView):
 
 @blp.route("/clients/<int:client_id>", tags=["client"])
 class ClientGet(BaseMethodView):
+    cache_models = [Client]
+    load_options = []
+
     @blp.response(200, client_schema)
     def get(self, client_id):
         """Get Client by Id"""
-        return Client.query.get_or_404(client_id)
+        return self.apply_load_options(Client.query).get_or_404(client_id)
 
 
 @blp.route("/data-assets/", tags=["data-asset"])
 class DataAssetList(ListMethodView):
+    cache_models = [DataAsset, Domain]
     ordering = DataAsset.created_at.desc()
+    schema = data_assets_schema
+    load_options = [selectinload(DataAsset.domain)]
 
     def get_query(self):
         return DataAsset.query
 
     @blp.response(200, schema=paginated_schema_factory(data_assets_schema))
-    @blp.paginate()
+    @blp.paginate(cursor=True)
     def get(self, pagination_parameters: PaginationParameters):
         """List Data Assets"""
         return self.list(pagination_parameters)
@@ -121,21 +159,43 @@ class DataAssetList(ListMethodView):
 
 @blp.route("/data-assets/<int:data_asset_id>", tags=["data-asset"])
 class DataAssetGet(BaseMethodView):
+    cache_models = [DataAsset, Domain, Schema, SchemaColumn]
+    # parents are joined, schema columns selectin loaded: 2 statements
+    load_options = [
+        joinedload(DataAsset.domain),
+        joinedload(DataAsset.schema).selectinload(Schema.columns),
+    ]
+
     @blp.response(200, data_asset_schema)
     def get(self, data_asset_id):
         """Get Data Asset by Id"""
-        return DataAsset.query.get_or_404(data_asset_id)
+        return self.apply_load_options(DataAsset.query).get_or_404(data_asset_id)
 
 
 @blp.route("/data-assets/instances/", tags=["data-asset"])
 class DataAssetInstanceList(ListMethodView):
+    cache_models = [
+        DataAssetInstance,
+        DataAsset,
+        Domain,
+        Client,
+        DataProvider,
+        SFTPSource,
+    ]
     ordering = DataAssetInstance.created_at.desc()
+    schema = data_asset_instances_schema
+    load_options = [
+        selectinload(DataAssetInstance.data_asset).selectinload(DataAsset.domain),
+        selectinload(DataAssetInstance.client),
+        selectinload(DataAssetInstance.data_provider),
+    ]
+    generic_loads = ["source"]
 
     def get_query(self):
         return DataAssetInstance.query
 
     @blp.response(200, schema=paginated_schema_factory(data_asset_instances_schema))
-    @blp.paginate()
+    @blp.paginate(cursor=True)
     def get(self, pagination_parameters: PaginationParameters):
         """List Data Asset Instances"""
         return self.list(pagination_parameters)
@@ -143,22 +203,103 @@ class DataAssetInstanceList(ListMethodView):
 
 @blp.route("/data-assets/instances/<int:data_asset_instance_id>", tags=["data-asset"])
 class DataAssetInstanceGet(BaseMethodView):
+    cache_models = [
+        DataAssetInstance,
+        DataAsset,
+        Domain,
+        DataIngest,
+        FileFormat,
+        Schema,
+        SchemaColumn,
+        Client,
+        DataProvider,
+        SFTPSource,
+    ]
+    # parents are joined to the instance query: instance, schema columns and
+    # source make 3 statements
+    load_options = [
+        joinedload(DataAssetInstance.data_asset).joinedload(DataAsset.domain),
+        joinedload(DataAssetInstance.data_ingest),
+        joinedload(DataAssetInstance.file_format),
+        joinedload(DataAssetInstance.schema).selectinload(Schema.columns),
+        joinedload(DataAssetInstance.client),
+        joinedload(DataAssetInstance.data_provider),
+    ]
+    generic_loads = ["source"]
+
     @blp.response(200, data_asset_instance_schema)
     def get(self, data_asset_instance_id):
         """Get Data Asset Instance by id"""
-        return DataAssetInstance.query.get_or_404(data_asset_instance_id)
+        data_asset_instance = self.apply_load_options(
+            DataAssetInstance.query
+        ).get_or_404(data_asset_instance_id)
+        return self.load_generic([data_asset_instance])[0]
 
 
 @blp.route(
     "/data-assets/instances/<int:data_asset_instance_id>/source", tags=["data-asset"]
 )
 class DataAssetInstanceSourceGet(BaseMethodView):
+    load_options = []
+    generic_loads = ["source"]
+
     # TODO add enhancement to handle all source serialization
     @blp.response(200, sftp_source_schema)
     def get(self, data_asset_instance_id):
         """Get Data Asset Instance by id"""
-        data_asset_instance = DataAssetInstance.query.get_or_404(data_asset_instance_id)
-        return data_asset_instance.source
+        data_asset_instance = self.apply_load_options(
+            DataAssetInstance.query
+        ).get_or_404(data_asset_instance_id)
+        return self.load_generic([data_asset_instance])[0].source
+
+
+@blp.route(
+    "/data-assets/instances/<int:data_asset_instance_id>/bundle", tags=["data-asset"]
+)
+class DataAssetInstanceBundleGet(BaseMethodView):
+    cache_models = [
+        DataAssetInstance,
+        DataAsset,
+        Domain,
+        DataIngest,
+        FileFormat,
+        Schema,
+        SchemaColumn,
+        Client,
+        DataProvider,
+        SFTPSource,
+        FunctionMapping,
+        Function,
+        FunctionArgument,
+    ]
+    # parents are joined to the instance query, collections are selectin loaded:
+    # instance, schema columns, function mappings with their function, function
+    # arguments and the source make 5 statements whatever the number of rows
+    load_options = [
+        joinedload(DataAssetInstance.data_asset).joinedload(DataAsset.domain),
+        joinedload(DataAssetInstance.data_ingest),
+        joinedload(DataAssetInstance.file_format),
+        joinedload(DataAssetInstance.schema).selectinload(Schema.columns),
+        joinedload(DataAssetInstance.client),
+        joinedload(DataAssetInstance.data_provider),
+        selectinload(DataAssetInstance.function_mappings)
+        .joinedload(FunctionMapping.function)
+        .selectinload(Function.arguments),
+    ]
+    generic_loads = ["source"]
+
+    @blp.response(200, data_asset_instance_bundle_schema)
+    def get(self, data_asset_instance_id):
+        """Get Data Asset Instance with all its configuration
+
+        Data asset, schema, file format, source (without credentials) and
+        function mappings (ordered by seq num, with their function arguments)
+        of the instance.
+        """
+        data_asset_instance = self.apply_load_options(
+            DataAssetInstance.query
+        ).get_or_404(data_asset_instance_id)
+        return self.load_generic([data_asset_instance])[0]
 
 
 # Function mapping routes
@@ -166,13 +307,18 @@ class DataAssetInstanceSourceGet(BaseMethodView):
     "/data-assets/instances/<int:data_asset_instance_id>/functions", tags=["data-asset"]
 )
 class DataAssetInstanceFunctionMappingList(ListMethodView):
+    cache_models = [FunctionMapping, Function, FunctionArgument]
     ordering = FunctionMapping.seq_num.asc()
+    schema = function_mappings_schema
+    load_options = [
+        selectinload(FunctionMapping.function).selectinload(Function.arguments)
+    ]
 
     def get_query(self):
         # apply data asset instance id filter
         data_asset_instance_id = request.view_args.get("data_asset_instance_id")
         return FunctionMapping.query.filter(
-            DataAssetInstance.id == data_asset_instance_id  # noqa
+            FunctionMapping.data_asset_instance_id == data_asset_instance_id
         )
 
     @blp.response(200, schema=paginated_schema_factory(function_mappings_schema))
@@ -195,3 +341,53 @@ class DataAssetInstanceUpsert(BaseMethodView):
             return upsert_data_asset_instance(data)
         except UnicodeDecodeError:
             return abort(400, "Please provide valid json file")
+
+
+@blp.route("/data-assets/instances/bulk-upsert", tags=["data-asset"])
+class DataAssetInstanceBulkUpsert(BaseMethodView):
+    @blp.arguments(DataAssetInstanceUpsertRequestSchema, location="files")
+    @blp.response(200, bulk_upsert_results_schema)
+    @blp.alt_response(400, schema=bulk_upsert_results_schema)
+    def post(self, data):
+        """Upsert many Data Asset Instances from a JSON array or NDJSON file
+
+        All instances are written in a single transaction, if any of them fails
+        nothing is written and per item results are returned with 400.
+        """
+        try:
+            items = load_json_records(data["file"])
+        except (UnicodeDecodeError, ValueError):
+            return abort(400, "Please provide valid json or ndjson file")
+        results, committed = bulk_upsert_data_asset_instances(items)
+        return results, 200 if committed else 400
+
+
+@blp.route("/data-assets/instances/stream-upsert", tags=["data-asset"])
+class DataAssetInstanceStreamUpsert(BaseMethodView):
+    @blp.arguments(DataAssetInstanceUpsertRequestSchema, location="files")
+    @blp.arguments(StreamUpsertQuerySchema, location="query")
+    @blp.alt_response(200, description="NDJSON progress, one line per chunk")
+    @blp.alt_response(400, description="NDJSON progress, some chunks failed")
+    def post(self, data, query_args):
+        """Upsert Data Asset Instances from a large JSON array or NDJSON file
+
+        The file is parsed record by record and upserted in chunks, each chunk
+        in its own transaction, committed before the next one is read. The
+        whole file is processed before the response starts, a client going
+        away does not stop the upsert halfway. Progress is returned as NDJSON,
+        one line per chunk, with 400 if any chunk failed (or the file is
+        malformed), the committed chunks are kept.
+        """
+        chunk_size = query_args.get("chunk_size") or current_app.config.get(
+            "UPSERT_CHUNK_SIZE", DEFAULT_UPSERT_CHUNK_SIZE
+        )
+        items = iter_json_records(data["file"])
+        progress = list(
+            stream_upsert_data_asset_instances(items, chunk_size=chunk_size)
+        )
+        committed = all(p.get("committed") for p in progress)
+        return Response(
+            "".join(json.dumps(p) + "\n" for p in progress),
+            status=200 if committed else 400,
+            mimetype="application/x-ndjson",
+        )
@@ -1,37 +1,208 @@
+from flask import abort, current_app
+from flask_smorest.pagination import PaginationParameters
+from sqlalchemy.exc import DataError, IntegrityError
+
 from app import db
 from app.common.blueprint import EnhancedBlueprint
-from app.common.controllers import BaseMethodView
+from app.common.controllers import BaseMethodView, ListMethodView, count_cache
+from app.common.db_utils import bulk_insert
+from app.common.schema import paginated_schema_factory
+from app.common.write_behind import WriteBehindBuffer
+from app.constants import DEFAULT_LEASE_SWEEP_INTERVAL
 from app.models import PipelineTask
-from app.schema import pipeline_task_schema, PipelineTaskSchema
+from app.schema import (
+    bulk_update_result_schema,
+    bulk_upsert_results_schema,
+    pipeline_task_bulk_create_schema,
+    pipeline_task_bulk_update_schema,
+    pipeline_task_claim_schema,
+    pipeline_task_lease_result_schema,
+    pipeline_task_lease_schema,
+    pipeline_task_query_schema,
+    pipeline_task_schema,
+    pipeline_task_transition_result_schema,
+    pipeline_task_transition_schema,
+    pipeline_task_update_schema,
+    pipeline_tasks_schema,
+)
+from app.service import (
+    claim_pipeline_tasks,
+    lease_sweeper,
+    pipeline_task_transition_values,
+    renew_pipeline_task_lease,
+    transition_pipeline_task,
+)
 
 blp = EnhancedBlueprint("metadata", __name__)
 
+# PIPELINE_TASK_WRITE_BEHIND buffer of the task writes, see app.common.write_behind
+task_buffer = WriteBehindBuffer(PipelineTask, "PIPELINE_TASK")
+
+
+def _drain_tasks(ids=None):
+    """
+    Flush the buffered writes of the tasks (all if None) ahead of a database
+    write, 503 when the buffer is held by another worker for too long
+    """
+    try:
+        task_buffer.drain(ids)
+    except TimeoutError as exc:
+        abort(503, str(exc))
+
 
 @blp.route("/pipeline-tasks", tags=["pipeline-task"])
-class PipelineTaskCreate(BaseMethodView):
+class PipelineTaskListCreate(ListMethodView):
+    schema = pipeline_tasks_schema
+    # the table grows without bound, pages are keyset ones on started_at
+    cursor_column = "started_at"
+    load_options = []
+    filters: dict = {}
+
+    def get_query(self):
+        filters = dict(self.filters)
+        started_after = filters.pop("started_after", None)
+        started_before = filters.pop("started_before", None)
+        query = PipelineTask.query.filter_by(**filters)
+        if started_after is not None:
+            query = query.filter(PipelineTask.started_at >= started_after)
+        if started_before is not None:
+            query = query.filter(PipelineTask.started_at < started_before)
+        return query
+
+    @blp.arguments(pipeline_task_query_schema, location="query")
+    @blp.response(200, schema=paginated_schema_factory(pipeline_tasks_schema))
+    @blp.paginate(keyset_only=True)
+    def get(self, filters, pagination_parameters: PaginationParameters):
+        """List Pipeline tasks
+
+        Tasks matching all the given filters, newest first by started_at. Pages
+        are keyset ones, pass the next_cursor of a page to get the next one.
+        Writes still in the write-behind buffer are listed once flushed.
+        """
+        self.filters = filters
+        return self.list(pagination_parameters)
+
     @blp.arguments(pipeline_task_schema)
     @blp.response(200, pipeline_task_schema)
     def post(self, data):
+        if task_buffer.enabled:
+            return task_buffer.insert(data)
         item = PipelineTask(**data)
         db.session.add(item)
         db.session.commit()
+        count_cache.invalidate(PipelineTask)
         return item
 
 
+@blp.route("/pipeline-tasks/bulk", tags=["pipeline-task"])
+class PipelineTaskBulk(BaseMethodView):
+    @blp.arguments(pipeline_task_bulk_create_schema)
+    @blp.response(200, bulk_upsert_results_schema)
+    def post(self, data):
+        """Create many Pipeline tasks
+
+        Up to 1000 tasks are validated first, invalid items are reported by
+        index with 422, then all of them are inserted in a single transaction.
+        """
+        if task_buffer.enabled:
+            items = task_buffer.insert_many(data)
+            return [
+                {"index": index, "id": item.id, "status": "created"}
+                for index, item in enumerate(items)
+            ]
+        try:
+            ids = bulk_insert(PipelineTask, data)
+            db.session.commit()
+        except (IntegrityError, DataError) as exc:
+            db.session.rollback()
+            return abort(400, str(exc.orig))
+        count_cache.invalidate(PipelineTask)
+        return [
+            {"index": index, "id": _id, "status": "created"}
+            for index, _id in enumerate(ids)
+        ]
+
+    @blp.arguments(pipeline_task_bulk_update_schema)
+    @blp.response(200, bulk_update_result_schema)
+    @blp.alt_response(503, description="Write-behind buffer not drained")
+    def patch(self, data):
+        """Update the Pipeline tasks matching a filter
+
+        Set based update, e.g. cancel every QUEUED task of a data asset
+        instance, with a single UPDATE statement. A state change requires the
+        expected state as filter state, allowed transitions are the ones of
+        /pipeline-tasks/<id>/transition.
+        """
+        criteria, values = data["filter"], data["values"]
+        ids = criteria.pop("ids", None)
+        if task_buffer.enabled:
+            # buffered writes land first, the update is not overwritten by them
+            _drain_tasks(ids)
+        query = PipelineTask.query.filter_by(**criteria)
+        if ids is not None:
+            query = query.filter(PipelineTask.id.in_(ids))
+        if "state" in values:
+            values = pipeline_task_transition_values(values.pop("state"), values)
+        try:
+            updated = query.update(values, synchronize_session=False)
+            db.session.commit()
+        except (IntegrityError, DataError) as exc:
+            db.session.rollback()
+            return abort(400, str(exc.orig))
+        count_cache.invalidate(PipelineTask)
+        return {"updated": updated}
+
+
 @blp.route("/pipeline-tasks/<int:pipeline_task_id>", tags=["pipeline-task"])
 class PipelineTaskGetUpdate(BaseMethodView):
     @blp.response(200, pipeline_task_schema)
     def get(self, pipeline_task_id):
         """Get Pipeline task by id"""
+        if task_buffer.enabled:
+            return task_buffer.get(pipeline_task_id) or abort(404)
         return PipelineTask.query.get_or_404(pipeline_task_id)
 
-    @blp.arguments(PipelineTaskSchema(partial=True))
+    @blp.arguments(pipeline_task_update_schema)
     @blp.response(200, pipeline_task_schema)
+    @blp.alt_response(409, description="Pipeline task state changed")
     def patch(self, data, pipeline_task_id):
-        """Update Pipeline task"""
+        """Update Pipeline task
+
+        A state change is a compare-and-set transition from the state the task
+        is read in, 409 when the task is not in that state anymore (or the
+        transition is not allowed from it). /pipeline-tasks/<id>/transition
+        takes the expected state from the caller instead.
+        """
+        state = data.get("state")
+        if task_buffer.enabled:
+            if state is None:
+                return task_buffer.update(pipeline_task_id, data) or abort(404)
+            # transitions are applied to the database, buffered writes first
+            _drain_tasks([pipeline_task_id])
+
         # get task by id
         item = PipelineTask.query.get_or_404(pipeline_task_id)
 
+        if state is not None and state != item.state:
+            values = dict(data)
+            del values["state"]
+            try:
+                applied = transition_pipeline_task(
+                    pipeline_task_id,
+                    item.state,
+                    state,
+                    worker_id=item.lease_owner,
+                    **values,
+                )
+            except ValueError as exc:
+                return abort(409, str(exc))
+            except (IntegrityError, DataError) as exc:
+                db.session.rollback()
+                return abort(400, str(exc.orig))
+            if not applied:
+                return abort(409, "Pipeline task state changed concurrently")
+            return PipelineTask.query.get(pipeline_task_id)
+
         # update on task instance
         for attr, value in data.items():
             if hasattr(item, attr):
@@ -39,4 +210,91 @@ class PipelineTaskGetUpdate(BaseMethodView):
         # save updated instance to db
         db.session.add(item)
         db.session.commit()
+        count_cache.invalidate(PipelineTask)
         return item
+
+
+@blp.route("/pipeline-tasks/<int:pipeline_task_id>/transition", tags=["pipeline-task"])
+class PipelineTaskTransition(BaseMethodView):
+    @blp.arguments(pipeline_task_transition_schema)
+    @blp.response(200, pipeline_task_transition_result_schema)
+    @blp.alt_response(404, description="Pipeline task not found")
+    @blp.alt_response(503, description="Write-behind buffer not drained")
+    def post(self, data, pipeline_task_id):
+        """Move a Pipeline task to a new state, if it is in the expected one
+
+        Compare-and-set: a single conditional UPDATE, applied only when the
+        task still is in the expected state, concurrent transitions of a task
+        never overwrite each other. Allowed transitions are QUEUED -> RUNNING
+        or CANCELLED and RUNNING -> COMPLETED, FAILED or CANCELLED, ended_at
+        is set on the terminal ones. When not applied, the current state of
+        the task is returned.
+        """
+        if task_buffer.enabled:
+            # a buffered task is inserted first, its other writes are not
+            # flushed over the transition
+            _drain_tasks([pipeline_task_id])
+        expected, state = data.pop("expected"), data.pop("state")
+        try:
+            applied = transition_pipeline_task(
+                pipeline_task_id, expected, state, **data
+            )
+        except (IntegrityError, DataError) as exc:
+            db.session.rollback()
+            return abort(400, str(exc.orig))
+        if applied:
+            return {"id": pipeline_task_id, "applied": True, "state": state}
+
+        current = (
+            db.session.query(PipelineTask.state)
+            .filter(PipelineTask.id == pipeline_task_id)
+            .scalar()
+        )
+        if current is None:
+            return abort(404)
+        return {"id": pipeline_task_id, "applied": False, "state": current}
+
+
+@blp.route("/pipeline-tasks/claim", tags=["pipeline-task"])
+class PipelineTaskClaim(BaseMethodView):
+    @blp.arguments(pipeline_task_claim_schema)
+    @blp.response(200, pipeline_tasks_schema)
+    def post(self, data):
+        """Claim QUEUED Pipeline tasks
+
+        Moves up to limit QUEUED tasks of the task type and service, oldest
+        first, to RUNNING with a lease of lease_seconds to the worker, none of
+        them is claimed by another worker. Renew the lease of a task while
+        working on it, tasks of expired leases are requeued. Tasks in the
+        write-behind buffer are claimable once flushed.
+        """
+        lease_sweeper.maybe_sweep(
+            current_app.config.get(
+                "PIPELINE_TASK_LEASE_SWEEP_INTERVAL", DEFAULT_LEASE_SWEEP_INTERVAL
+            )
+        )
+        return claim_pipeline_tasks(**data)
+
+
+@blp.route("/pipeline-tasks/<int:pipeline_task_id>/lease", tags=["pipeline-task"])
+class PipelineTaskLease(BaseMethodView):
+    @blp.arguments(pipeline_task_lease_schema)
+    @blp.response(200, pipeline_task_lease_result_schema)
+    @blp.alt_response(404, description="Pipeline task not found")
+    def post(self, data, pipeline_task_id):
+        """Renew the lease of a claimed Pipeline task
+
+        Not applied when the task is not RUNNING and leased to the worker
+        anymore, e.g. its lease expired and it was requeued.
+        """
+        expires_at = renew_pipeline_task_lease(pipeline_task_id, **data)
+        if (
+            expires_at is None
+            and db.session.get(PipelineTask, pipeline_task_id) is None
+        ):
+            return abort(404)
+        return {
+            "id": pipeline_task_id,
+            "applied": expires_at is not None,
+            "lease_expires_at": expires_at,
+        }
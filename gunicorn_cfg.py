@@ -1,14 +1,47 @@
 import multiprocessing
+import os
+import shutil
+import tempfile
 
 bind = "0.0.0.0:5000"  # noqa
 
-workers = (  # noqa
-    multiprocessing.cpu_count() * 2 + 1 if multiprocessing.cpu_count() > 0 else 3
-)
+# sync: one request per worker, each worker blocks for the Snowflake round trip
+# gthread: GUNICORN_THREADS requests per worker
+# gevent: GUNICORN_WORKER_CONNECTIONS requests per worker, on greenlets the
+#   worker monkey patches before loading the app
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "sync")  # noqa
+print(f"Using {worker_class} worker_class")
+
+cpu_count = multiprocessing.cpu_count() if multiprocessing.cpu_count() > 0 else 1
+if worker_class == "sync":
+    default_workers = cpu_count * 2 + 1
+else:
+    # concurrency comes from threads/greenlets, fewer processes hold fewer
+    # Snowflake connections and copies of the caches
+    default_workers = cpu_count + 1
+workers = int(os.environ.get("GUNICORN_WORKERS", default_workers))  # noqa
 print(f"Using {workers} workers")
 
-worker_class = "sync"  # noqa
-print(f"Using {worker_class} worker_class")
+if worker_class == "gthread":
+    # keep below the SQLAlchemy pool size (pool_size + max_overflow) so that
+    # requests do not queue on connection checkout
+    threads = int(os.environ.get("GUNICORN_THREADS", 8))  # noqa
+    print(f"Using {threads} threads")
+
+if worker_class == "gevent":
+    worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 100))  # noqa
+    print(f"Using {worker_connections} worker_connections")
+
+# load the app once in the master, workers are forked with it and the
+# decrypted private key, see when_ready. gevent must patch before the app is
+# imported so it loads the app in each worker instead
+preload_app = (  # noqa
+    os.environ.get(
+        "GUNICORN_PRELOAD_APP", "false" if worker_class == "gevent" else "true"
+    )
+    == "true"
+)
+print(f"Using preload_app={preload_app}")
 
 timeout = 3600  # noqa
 print(f"Using {timeout} timeout")
@@ -19,3 +52,64 @@ print(f"Using {keepalive} keepalive")
 # https://docs.gunicorn.org/en/20.1.0/settings.html#capture-output
 capture_output = False
 accesslog = "-"
+
+# workers write their metrics here, aggregated when /metrics is scraped
+# must be set before prometheus_client is imported by the workers
+os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "prometheus")
+)
+print(f"Using {os.environ['PROMETHEUS_MULTIPROC_DIR']} for metrics")
+
+
+def on_starting(server):
+    # samples of a previous run would be aggregated otherwise
+    metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+    from wsgi import application
+
+    key_provider = application.config.get("SNOWFLAKE_PRIVATE_KEY_PROVIDER")
+    if key_provider is not None:
+        # decrypted once, inherited by the workers
+        key_provider()
+
+
+def _prewarm_pool(log):
+    # the app module is cached, gunicorn loads this same application
+    from app import db
+    from app.common.db_utils import prewarm_pool
+    from wsgi import application
+
+    size = application.config.get("SQLALCHEMY_POOL_PREWARM", 0)
+    with application.app_context():
+        # with preload_app connections of the master must not be shared
+        db.engine.dispose(close=False)
+        try:
+            prewarm_pool(db.engine, size)
+        except Exception:  # pylint: disable=broad-except
+            # the first requests open the connections instead
+            log.exception("Unable to pre-warm the connection pool")
+        else:
+            log.info("Opened %s pooled connections", size)
+
+
+def post_fork(server, worker):
+    # gevent patches the worker after post_fork, the app is loaded after that
+    if worker_class != "gevent":
+        _prewarm_pool(server.log)
+
+
+def post_worker_init(worker):
+    if worker_class == "gevent":
+        _prewarm_pool(worker.log)
@@ -0,0 +1,41 @@
+"""function mapping instance index
+
+Revision ID: 7c3e5a9d2b41
+Revises: e05e110ef52f
+Create Date: 2023-04-03 10:12:41.512384
+
+"""
+from alembic import op
+
+from app.constants import CONFIGURATION_SCHEMA
+
+# revision identifiers, used by Alembic.
+revision = "7c3e5a9d2b41"
+down_revision = "e05e110ef52f"
+branch_labels = None
+depends_on = None
+
+INDEX_NAME = "ix_functionmapping_instance_seq"
+COLUMNS = ["data_asset_instance_id", "seq_num"]
+
+
+def upgrade():
+    # snowflake standard tables have no indexes, cluster them instead
+    if op.get_bind().dialect.name == "snowflake":
+        op.execute(
+            f"ALTER TABLE {CONFIGURATION_SCHEMA}.functionmapping "
+            f"CLUSTER BY ({', '.join(COLUMNS)})"
+        )
+    else:
+        op.create_index(
+            INDEX_NAME, "functionmapping", COLUMNS, schema=CONFIGURATION_SCHEMA
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == "snowflake":
+        op.execute(
+            f"ALTER TABLE {CONFIGURATION_SCHEMA}.functionmapping DROP CLUSTERING KEY"
+        )
+    else:
+        op.drop_index(INDEX_NAME, "functionmapping", schema=CONFIGURATION_SCHEMA)
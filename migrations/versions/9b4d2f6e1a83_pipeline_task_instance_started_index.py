@@ -0,0 +1,37 @@
+"""pipeline task instance started index
+
+Revision ID: 9b4d2f6e1a83
+Revises: 7c3e5a9d2b41
+Create Date: 2023-04-11 09:27:03.104257
+
+"""
+from alembic import op
+
+from app.constants import METADATA_SCHEMA
+
+# revision identifiers, used by Alembic.
+revision = "9b4d2f6e1a83"
+down_revision = "7c3e5a9d2b41"
+branch_labels = None
+depends_on = None
+
+INDEX_NAME = "ix_pipelinetask_instance_started"
+COLUMNS = ["data_asset_instance_id", "started_at"]
+
+
+def upgrade():
+    # snowflake standard tables have no indexes, cluster them instead
+    if op.get_bind().dialect.name == "snowflake":
+        op.execute(
+            f"ALTER TABLE {METADATA_SCHEMA}.pipelinetask "
+            f"CLUSTER BY ({', '.join(COLUMNS)})"
+        )
+    else:
+        op.create_index(INDEX_NAME, "pipelinetask", COLUMNS, schema=METADATA_SCHEMA)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == "snowflake":
+        op.execute(f"ALTER TABLE {METADATA_SCHEMA}.pipelinetask DROP CLUSTERING KEY")
+    else:
+        op.drop_index(INDEX_NAME, "pipelinetask", schema=METADATA_SCHEMA)
@@ -0,0 +1,41 @@
+"""pipeline task lease
+
+Revision ID: d41f7b2c8e96
+Revises: 9b4d2f6e1a83
+Create Date: 2023-04-17 14:05:52.331907
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+from app.constants import METADATA_SCHEMA
+
+# revision identifiers, used by Alembic.
+revision = "d41f7b2c8e96"
+down_revision = "9b4d2f6e1a83"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "pipelinetask",
+        sa.Column("lease_owner", sa.String(length=256), nullable=True),
+        schema=METADATA_SCHEMA,
+    )
+    op.add_column(
+        "pipelinetask",
+        sa.Column("lease_expires_at", sa.DateTime(timezone=True), nullable=True),
+        schema=METADATA_SCHEMA,
+    )
+    op.add_column(
+        "pipelinetask",
+        sa.Column("claim_token", sa.String(length=32), nullable=True),
+        schema=METADATA_SCHEMA,
+    )
+
+
+def downgrade():
+    op.drop_column("pipelinetask", "claim_token", schema=METADATA_SCHEMA)
+    op.drop_column("pipelinetask", "lease_expires_at", schema=METADATA_SCHEMA)
+    op.drop_column("pipelinetask", "lease_owner", schema=METADATA_SCHEMA)
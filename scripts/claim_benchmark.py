@@ -0,0 +1,153 @@
+"""
+Benchmark of the pipeline task claims of concurrent workers
+
+Queues ``--tasks`` pipeline tasks in a SQLite database file (the stand-in of
+the METADATA schema, shared by all the connections) and drains the queue from
+``--workers`` threads, each claiming ``--batch`` tasks at a time as
+``/v1/pipeline-tasks/claim`` does, until none is left. Reports the claim
+throughput and latency, and checks every task was claimed exactly once.
+
+    python scripts/claim_benchmark.py --workers 50 --tasks 20000 --batch 10
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db  # noqa
+from app.constants import PipelineTaskType  # noqa
+from app.models import PipelineTask  # noqa
+from app.service import claim_pipeline_tasks  # noqa
+
+CONFIG = {
+    "APP_NAME": "claim-benchmark",
+    "API_TITLE": "Galactic Core API",
+    "API_VERSION": 1,
+    "OPENAPI_VERSION": "3.0.2",
+    "COGNITO_REGION": "us-east-1",
+    "COGNITO_USERPOOL_ID": "claim-benchmark",
+    "COGNITO_ISSUER": "claim-benchmark",
+    "COGNITO_JWKS_BACKGROUND_REFRESH": False,
+}
+
+SERVICE_NAME = "claim-benchmark"
+
+
+def attach_schemas(directory):
+    """Attach the schema databases to every new connection"""
+
+    def on_connect(connection, _):
+        connection.execute("PRAGMA journal_mode=WAL")
+        for schema in ("configuration", "metadata"):
+            path = os.path.join(directory, f"{schema}.sqlite")
+            connection.execute(f"ATTACH '{path}' AS {schema}")
+
+    event.listen(db.engine, "connect", on_connect)
+
+
+def fill(tasks):
+    db.session.execute(
+        PipelineTask.__table__.insert(),
+        [
+            {
+                "data_asset_id": 1,
+                "service_name": SERVICE_NAME,
+                "task_type": PipelineTaskType.TRANSFER.name,
+                "state": "QUEUED",
+            }
+            for _ in range(tasks)
+        ],
+    )
+    db.session.commit()
+
+
+def run(app, workers, batch):
+    """Drain the queue from worker threads, (claimed ids, claim latencies)"""
+    claimed = []
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(worker_id):
+        with app.app_context():
+            while True:
+                start = time.perf_counter()
+                tasks = claim_pipeline_tasks(
+                    worker_id,
+                    limit=batch,
+                    service_name=SERVICE_NAME,
+                    task_type=PipelineTaskType.TRANSFER,
+                )
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+                    claimed.extend(task.id for task in tasks)
+                if not tasks:
+                    return
+
+    threads = [
+        threading.Thread(target=worker, args=(f"worker-{i}",)) for i in range(workers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return claimed, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--workers", type=int, default=50)
+    parser.add_argument("--tasks", type=int, default=20_000)
+    parser.add_argument("--batch", type=int, default=10)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    config = dict(
+        CONFIG,
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(directory, 'main.sqlite')}",
+        SQLALCHEMY_ENGINE_OPTIONS={
+            "poolclass": QueuePool,
+            "pool_size": args.workers,
+            "connect_args": {"timeout": 60, "check_same_thread": False},
+        },
+    )
+    app = create_app(config)
+    with app.app_context():
+        attach_schemas(directory)
+        db.create_all()
+        fill(args.tasks)
+
+    start = time.perf_counter()
+    claimed, latencies = run(app, args.workers, args.batch)
+    elapsed = time.perf_counter() - start
+
+    duplicates = len(claimed) - len(set(claimed))
+    print(
+        f"{args.workers} workers claimed {len(claimed)}/{args.tasks} tasks "
+        f"in {elapsed:.2f}s, {duplicates} claimed twice"
+    )
+    print(
+        f"throughput: {len(latencies) / elapsed:.0f} claims/s, "
+        f"{len(claimed) / elapsed:.0f} tasks/s"
+    )
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(
+        "claim latency ms: "
+        f"p50 {quantiles[49] * 1000:.1f}, "
+        f"p95 {quantiles[94] * 1000:.1f}, "
+        f"p99 {quantiles[98] * 1000:.1f}"
+    )
+    if duplicates or len(set(claimed)) != args.tasks:
+        sys.exit("tasks were lost or claimed twice")
+
+
+if __name__ == "__main__":
+    main()
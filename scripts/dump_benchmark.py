@@ -0,0 +1,115 @@
+"""
+Benchmark of the list response serialization
+
+Dumps a page of data asset instances (with their nested data asset, domain,
+client, data provider and source) through the paginated list schema, once with
+the marshmallow dump and once with the compiled dump, checks both produce the
+same JSON bytes and reports the time taken by each
+
+    python scripts/dump_benchmark.py --rows 1000 --repeat 20
+"""
+import argparse
+import datetime as dt
+import json
+import os
+import sys
+import timeit
+
+import marshmallow as ma
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.common.schema import paginated_schema_factory  # noqa
+from app.constants import ScheduleType  # noqa
+from app.models import (  # noqa
+    Client,
+    DataAsset,
+    DataAssetInstance,
+    DataProvider,
+    Domain,
+    SFTPSource,
+)
+from app.schema import data_asset_instances_schema  # noqa
+
+
+def build_page(rows):
+    """Page of transient data asset instances, no database needed"""
+    created_at = dt.datetime(2023, 1, 2, 3, 4, 5, 678901, tzinfo=dt.timezone.utc)
+    domain = Domain(id=1, name="domain", database="DB", db_schema="SCHEMA")
+    data_assets = [
+        DataAsset(
+            id=asset_id,
+            domain=domain,
+            name=f"asset-{asset_id}",
+            description="description " * 20,
+            s3_bucket="bucket",
+            s3_path_prefix="prefix/",
+            s3_partition_path="year={year}/",
+            instance_default_database="DB",
+            instance_default_db_schema="SCHEMA",
+        )
+        for asset_id in range(10)
+    ]
+    client = Client(id=1, name="client", is_active=True)
+    data_provider = DataProvider(id=1, name="provider", type="sftp")
+    source = SFTPSource(
+        id=1, host="host", port=22, user="user", passphrase="secret", source_path="/"
+    )
+    results = [
+        DataAssetInstance(
+            id=instance_id,
+            data_asset=data_assets[instance_id % len(data_assets)],
+            client=client,
+            data_provider=data_provider,
+            source=source,
+            name=f"instance-{instance_id}",
+            description=None if instance_id % 2 else "description",
+            db_schema="SCHEMA",
+            materialization_type="table",
+            tags=["a", "b"],
+            stage_name="stage",
+            start_time=created_at,
+            expires=None,
+            one_off=False,
+            enabled=True,
+            schedule_type=list(ScheduleType)[instance_id % len(ScheduleType)],
+            schedule_cron="0 * * * *",
+            created_at=created_at,
+            updated_at=created_at,
+        )
+        for instance_id in range(rows)
+    ]
+    pagination = {"page": 1, "page_size": rows, "count_mode": "none"}
+    return {"pagination": pagination, "results": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    schema = paginated_schema_factory(data_asset_instances_schema)()
+    page = build_page(args.rows)
+
+    def marshmallow_dump():
+        return ma.Schema.dump(schema, page)
+
+    def compiled_dump():
+        return schema.dump(page)
+
+    expected = json.dumps(marshmallow_dump()).encode("utf-8")
+    actual = json.dumps(compiled_dump()).encode("utf-8")
+    if actual != expected:
+        sys.exit("compiled dump differs from the marshmallow dump")
+    print(f"identical JSON, {len(actual)} bytes for {args.rows} rows")
+
+    timings = {}
+    for name, dump in (("marshmallow", marshmallow_dump), ("compiled", compiled_dump)):
+        timings[name] = min(timeit.repeat(dump, number=1, repeat=args.repeat))
+        print(f"{name:>12}: {timings[name] * 1000:.1f}ms")
+    print(f"{'speedup':>12}: {timings['marshmallow'] / timings['compiled']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
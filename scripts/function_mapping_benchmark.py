@@ -0,0 +1,147 @@
+"""
+Benchmark of the function mapping lookup of an instance
+
+Fills an in-memory SQLite database with instances of ``--per-instance``
+function mappings each, up to ``--sizes`` mappings in total, and times the
+count and first page of the mappings of random instances, as listed by
+``/v1/data-assets/instances/<id>/functions``. The lookup cost must stay flat
+as the table grows, ``--cross-join`` also times the former cartesian product
+filter for comparison.
+
+    python scripts/function_mapping_benchmark.py --sizes 1000 10000 100000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+import warnings
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db  # noqa
+from app.models import DataAssetInstance, FunctionMapping  # noqa
+
+CONFIG = {
+    "APP_NAME": "function-mapping-benchmark",
+    "API_TITLE": "Galactic Core API",
+    "API_VERSION": 1,
+    "OPENAPI_VERSION": "3.0.2",
+    "COGNITO_REGION": "us-east-1",
+    "COGNITO_USERPOOL_ID": "function-mapping-benchmark",
+    "COGNITO_ISSUER": "function-mapping-benchmark",
+    "COGNITO_JWKS_BACKGROUND_REFRESH": False,
+    "SQLALCHEMY_DATABASE_URI": "sqlite://",
+}
+
+PAGE_SIZE = 10
+
+
+def create_database():
+    db.session.execute("ATTACH ':memory:' AS configuration")
+    db.session.execute("ATTACH ':memory:' AS metadata")
+    db.session.commit()
+    db.create_all()
+
+
+def fill(instances, per_instance, first_instance_id):
+    """Insert instances with their mappings, without the orm"""
+    instance_ids = range(first_instance_id, first_instance_id + instances)
+    db.session.execute(
+        DataAssetInstance.__table__.insert(),
+        [
+            {
+                "id": instance_id,
+                "data_asset_id": 1,
+                "file_format_id": 1,
+                "schema_id": 1,
+                "client_id": 1,
+                "data_provider_id": 1,
+                "source_type": "SFTPSource",
+                "name": f"instance-{instance_id}",
+                "materialization_type": "table",
+                "schedule_type": "EVENT",
+            }
+            for instance_id in instance_ids
+        ],
+    )
+    db.session.execute(
+        FunctionMapping.__table__.insert(),
+        [
+            {"data_asset_instance_id": instance_id, "function_id": 1, "seq_num": seq}
+            for instance_id in instance_ids
+            for seq in range(per_instance)
+        ],
+    )
+    db.session.commit()
+
+
+def mappings_query(instance_id, cross_join=False):
+    if cross_join:
+        # filter of the list view before the fix, no join condition
+        criterion = DataAssetInstance.id == instance_id
+    else:
+        criterion = FunctionMapping.data_asset_instance_id == instance_id
+    return FunctionMapping.query.filter(criterion).order_by(FunctionMapping.seq_num)
+
+
+def lookup(instance_id, cross_join=False):
+    """Count and first page of the instance mappings, seconds taken"""
+    start = time.perf_counter()
+    query = mappings_query(instance_id, cross_join)
+    query.with_entities(FunctionMapping.id).order_by(None).count()
+    query.limit(PAGE_SIZE).all()
+    elapsed = time.perf_counter() - start
+    db.session.expunge_all()
+    return elapsed
+
+
+def query_plan(instance_id):
+    statement = mappings_query(instance_id).statement.compile(
+        dialect=db.engine.dialect, compile_kwargs={"literal_binds": True}
+    )
+    rows = db.session.execute(f"EXPLAIN QUERY PLAN {statement}").fetchall()
+    return "; ".join(row[-1] for row in rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000]
+    )
+    parser.add_argument("--per-instance", type=int, default=10)
+    parser.add_argument("--lookups", type=int, default=200)
+    parser.add_argument("--cross-join", action="store_true")
+    args = parser.parse_args()
+
+    app = create_app(CONFIG)
+    with app.app_context():
+        create_database()
+        instances = 0
+        for size in sorted(args.sizes):
+            missing = size // args.per_instance - instances
+            if missing > 0:
+                fill(missing, args.per_instance, instances + 1)
+                instances += missing
+
+            instance_ids = [random.randint(1, instances) for _ in range(args.lookups)]
+            timings = [lookup(instance_id) for instance_id in instance_ids]
+            line = (
+                f"{instances * args.per_instance:>8} mappings: "
+                f"median {statistics.median(timings) * 1000:.2f}ms"
+            )
+            if args.cross_join:
+                with warnings.catch_warnings():
+                    # the cartesian product is what is measured
+                    warnings.simplefilter("ignore")
+                    timings = [
+                        lookup(instance_id, True) for instance_id in instance_ids[:5]
+                    ]
+                line += f", cross join {statistics.median(timings) * 1000:.2f}ms"
+            print(line)
+        print(f"query plan: {query_plan(1)}")
+
+
+if __name__ == "__main__":
+    main()
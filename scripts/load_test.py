@@ -0,0 +1,83 @@
+"""
+Load test of a running server
+
+Sends GET requests to the given paths from ``--concurrency`` client threads for
+``--duration`` seconds and reports throughput and latency percentiles, run it
+against one container per worker profile to compare them, e.g.
+
+    GUNICORN_WORKER_CLASS=sync gunicorn -c gunicorn_cfg.py wsgi:application
+    python scripts/load_test.py --token $TOKEN /v1/data-assets/ /v1/clients/
+
+    GUNICORN_WORKER_CLASS=gthread gunicorn -c gunicorn_cfg.py wsgi:application
+    python scripts/load_test.py --token $TOKEN /v1/data-assets/ /v1/clients/
+"""
+import argparse
+import itertools
+import statistics
+import threading
+import time
+
+import requests
+
+
+def run(base_url, paths, token, concurrency, duration):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    next_path = itertools.cycle(paths)
+    deadline = time.monotonic() + duration
+
+    def client():
+        session = requests.Session()
+        session.headers["Authorization"] = f"Bearer {token}"
+        while time.monotonic() < deadline:
+            with lock:
+                path = next(next_path)
+            start = time.perf_counter()
+            try:
+                response = session.get(base_url + path, timeout=60)
+                # a rejected token or a bad path is no throughput either
+                ok = response.status_code < 400
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                (latencies if ok else errors).append(elapsed)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started_at = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.monotonic() - started_at
+
+
+def report(latencies, errors, elapsed):
+    print(f"requests: {len(latencies)}, errors: {len(errors)} in {elapsed:.1f}s")
+    print(f"throughput: {len(latencies) / elapsed:.1f} req/s")
+    if len(latencies) > 1:
+        quantiles = statistics.quantiles(latencies, n=100)
+        print(
+            "latency ms: "
+            f"p50 {quantiles[49] * 1000:.0f}, "
+            f"p95 {quantiles[94] * 1000:.0f}, "
+            f"p99 {quantiles[98] * 1000:.0f}, "
+            f"max {max(latencies) * 1000:.0f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("paths", nargs="+", help="paths requested in turn")
+    parser.add_argument("--base-url", default="http://localhost:5000")
+    parser.add_argument("--token", required=True, help="Cognito access token")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=60, help="seconds")
+    args = parser.parse_args()
+
+    report(*run(args.base_url, args.paths, args.token, args.concurrency, args.duration))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Startup profile of the app factory
+
+Runs ``create_app`` in fresh interpreters, reports the median boot time and the
+slowest imports of a ``python -X importtime`` run (cumulative, microseconds)
+
+    python scripts/startup_profile.py --runs 10 --top 25
+
+``--sqlite`` boots with an in-memory SQLite database and dummy Cognito settings
+instead of ``app/config.py``, so it runs without the Snowflake environment.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SQLITE_CONFIG = {
+    "APP_NAME": "startup-profile",
+    "API_TITLE": "Galactic Core API",
+    "API_VERSION": 1,
+    "OPENAPI_VERSION": "3.0.2",
+    "COGNITO_REGION": "us-east-1",
+    "COGNITO_USERPOOL_ID": "startup-profile",
+    "COGNITO_ISSUER": "startup-profile",
+    "COGNITO_JWKS_BACKGROUND_REFRESH": False,
+    "SQLALCHEMY_DATABASE_URI": "sqlite://",
+}
+
+BOOT = """
+import json, time, warnings
+warnings.simplefilter("ignore")
+start = time.perf_counter()
+from app import create_app
+create_app({config})
+print(json.dumps(time.perf_counter() - start))
+"""
+
+
+def boot(config, importtime=False):
+    """Boot the app in a new interpreter, returns (seconds, importtime lines)"""
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    command += ["-c", BOOT.format(config=repr(config))]
+    result = subprocess.run(
+        command, cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.splitlines()[-1]), result.stderr.splitlines()
+
+
+def parse_importtime(lines):
+    """(cumulative us, module) of the imports, nested imports are indented"""
+    imports = []
+    for line in lines:
+        if not line.startswith("import time:") or "|" not in line[13:]:
+            continue
+        _, cumulative, module = line[12:].split("|")
+        if cumulative.strip().isdigit():
+            imports.append((int(cumulative), module.rstrip()))
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--sqlite", action="store_true")
+    args = parser.parse_args()
+
+    config = SQLITE_CONFIG if args.sqlite else None
+    timings = [boot(config)[0] for _ in range(args.runs)]
+    print(
+        f"create_app: median {statistics.median(timings) * 1000:.0f}ms, "
+        f"min {min(timings) * 1000:.0f}ms over {args.runs} runs"
+    )
+
+    _, lines = boot(config, importtime=True)
+    print("\nslowest imports (cumulative us)")
+    for cumulative, module in sorted(parse_importtime(lines), reverse=True)[: args.top]:
+        print(f"{cumulative:>10} {module}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,8 @@ from collections import OrderedDict
 
 from flask_smorest.pagination import PaginationParameters
 
-from app.common.blueprint import EnhancedBlueprint
+from app.common.blueprint import ListPaginationParameters, EnhancedBlueprint
+from app.constants import CountMode
 
 
 def test_set_pagination_metadata():
@@ -53,3 +54,51 @@ def test_document_pagination_metadata():
     expected_result = resp_doc.copy()
     blueprint._document_pagination_metadata(spec, resp_doc)
     assert resp_doc == expected_result
+
+
+def test_set_cursor_pagination_metadata():
+    blueprint = EnhancedBlueprint("test", "test", url_prefix="/test")
+    page_params = ListPaginationParameters(page=1, page_size=10, cursor="")
+    page_params.next_cursor = "next"
+    result = [{"id": 1, "name": "Test 1"}]
+
+    assert blueprint._set_pagination_metadata(page_params, result, {}) == (
+        {
+            "pagination": {
+                "next_cursor": "next",
+                "page_size": 10,
+                "count_mode": "none",
+            },
+            "results": result,
+        },
+        {},
+    )
+
+    page_params.item_count = 20
+    page_params.count_mode = CountMode.EXACT
+    pagination, _ = blueprint._set_pagination_metadata(page_params, result, {})
+    assert pagination["pagination"]["total"] == 20
+    assert pagination["pagination"]["count_mode"] == "exact"
+
+
+def test_set_list_pagination_metadata_count_modes():
+    blueprint = EnhancedBlueprint("test", "test", url_prefix="/test")
+    page_params = ListPaginationParameters(page=2, page_size=10, count=CountMode.CACHED)
+    page_params.item_count = 30
+    page_params.count_mode = CountMode.CACHED
+    (result, _) = blueprint._set_pagination_metadata(page_params, [], {})
+    assert result["pagination"]["total"] == 30
+    assert result["pagination"]["next_page"] == 3
+    assert result["pagination"]["count_mode"] == "cached"
+
+    # not counted
+    page_params = ListPaginationParameters(page=2, page_size=10, count=CountMode.NONE)
+    page_params.has_next = True
+    (result, _) = blueprint._set_pagination_metadata(page_params, [], {})
+    assert result["pagination"] == {
+        "page": 2,
+        "previous_page": 1,
+        "next_page": 3,
+        "page_size": 10,
+        "count_mode": "none",
+    }
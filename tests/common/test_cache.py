@@ -0,0 +1,89 @@
+import pytest
+
+from app.common.cache import (
+    ALL_MODELS,
+    LocalCacheBackend,
+    SQLiteCacheBackend,
+    create_backend,
+)
+
+
+@pytest.fixture(params=["local", "shared"])
+def backend(request, tmp_path):
+    if request.param == "local":
+        return LocalCacheBackend(2)
+    return SQLiteCacheBackend(str(tmp_path / "cache.sqlite"))
+
+
+def test_cache_backend_get_set(backend):
+    headers = [["Content-Type", "application/json"]]
+    backend.set("etag", headers, b"{}", ttl=60)
+    backend.set("expired", headers, b"{}", ttl=0)
+
+    headers_cached, body = backend.get("etag")
+    assert list(map(list, headers_cached)) == headers
+    assert body == b"{}"
+    assert backend.get("expired") is None
+    assert backend.get("missing") is None
+
+
+def test_cache_backend_generations(backend):
+    assert backend.generations(["Domain", ALL_MODELS]) == [0, 0]
+
+    backend.invalidate(["Domain"])
+    backend.invalidate(["Domain", ALL_MODELS])
+
+    assert backend.generations(["Domain", ALL_MODELS, "Client"]) == [2, 1, 0]
+
+
+def test_local_cache_backend_lru():
+    backend = LocalCacheBackend(2)
+    for key in ("a", "b"):
+        backend.set(key, [], b"", ttl=60)
+    backend.get("a")
+    backend.set("c", [], b"", ttl=60)
+
+    assert backend.get("b") is None
+    assert backend.get("a") is not None
+    assert backend.get("c") is not None
+
+
+def test_shared_cache_backend_between_workers(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    worker, other_worker = SQLiteCacheBackend(path), SQLiteCacheBackend(path)
+
+    worker.set("etag", [], b"[]", ttl=60)
+    worker.invalidate(["Domain"])
+
+    assert other_worker.get("etag") == ([], b"[]")
+    assert other_worker.generations(["Domain"]) == [1]
+
+
+def test_create_backend(tmp_path):
+    config = {
+        "RESPONSE_CACHE": "none",
+        "RESPONSE_CACHE_SIZE": 8,
+        "RESPONSE_CACHE_PATH": str(tmp_path / "cache.sqlite"),
+    }
+    assert create_backend(config).maxsize == 0
+    assert create_backend(dict(config, RESPONSE_CACHE="local")).maxsize == 8
+    assert isinstance(
+        create_backend(dict(config, RESPONSE_CACHE="shared")), SQLiteCacheBackend
+    )
+    with pytest.raises(ValueError):
+        create_backend(dict(config, RESPONSE_CACHE="redis"))
+
+
+def test_shared_cache_backend_connects_per_process(tmp_path, monkeypatch):
+    path = tmp_path / "cache.sqlite"
+    backend = SQLiteCacheBackend(str(path))
+    # not opened by the preloaded master
+    assert not path.exists()
+
+    backend.set("etag", [], b"[]", ttl=60)
+    connection = backend._connect()
+    monkeypatch.setattr("app.common.cache.os.getpid", lambda: -1)
+
+    # forked worker
+    assert backend._connect() is not connection
+    assert backend.get("etag") == ([], b"[]")
@@ -1,6 +1,15 @@
+import io
 from unittest.mock import Mock, patch
 
-from app.common.utils import load_private_key
+import pytest
+from sqlalchemy import create_engine, event
+
+from app.common.utils import (
+    PrivateKeyProvider,
+    iter_json_records,
+    load_json_records,
+    load_private_key,
+)
 
 
 def test_load_private_key():
@@ -16,3 +25,65 @@ def test_load_private_key():
         # Assertions
         assert key == mock_key.private_bytes.return_value
 
+
+@patch("app.common.utils.load_private_key", return_value=b"der")
+def test_private_key_provider(load_mock, tmp_path):
+    key_file = tmp_path / "rsa_key.p8"
+    provider = PrivateKeyProvider(path=str(key_file), passphrase="passphrase")
+    # nothing is read until the key is needed
+    load_mock.assert_not_called()
+
+    key_file.write_bytes(b"pem")
+    assert provider() == b"der"
+    assert provider() == b"der"
+    load_mock.assert_called_once_with(b"pem", "passphrase")
+
+
+@patch("app.common.utils.load_private_key", return_value=b"der")
+def test_private_key_provider_register(load_mock):
+    provider = PrivateKeyProvider(key=b"pem", passphrase="passphrase")
+    engine = create_engine("sqlite://")
+
+    provider.register(engine)
+
+    assert event.contains(engine, "do_connect", provider._set_connect_param)
+    cparams = {}
+    provider._set_connect_param(engine.dialect, None, [], cparams)
+    assert cparams == {"private_key": b"der"}
+    load_mock.assert_called_once_with(b"pem", "passphrase")
+
+
+def test_load_json_records_array():
+    file = io.BytesIO(b' [{"name": "a"}, {"name": "b"}]')
+    assert load_json_records(file) == [{"name": "a"}, {"name": "b"}]
+
+
+def test_load_json_records_ndjson():
+    file = io.BytesIO(b'{"name": "a"}\n\n{"name": "b"}\n')
+    assert load_json_records(file) == [{"name": "a"}, {"name": "b"}]
+
+
+def test_iter_json_records_small_reads():
+    file = io.BytesIO(' [ {"name": "é"} ,\n {"values": [1, 2]} ] '.encode("utf-8"))
+    records = iter_json_records(file, read_size=3)
+    assert next(records) == {"name": "é"}
+    assert list(records) == [{"values": [1, 2]}]
+
+
+def test_iter_json_records_invalid():
+    with pytest.raises(ValueError):
+        list(iter_json_records(io.BytesIO(b'[{"name": "a"}'), read_size=4))
+
+    with pytest.raises(ValueError):
+        list(iter_json_records(io.BytesIO(b'{"name": "a"}\n{"name": '), read_size=4))
+
+
+def test_iter_json_records_invalid_fails_fast():
+    file = io.BytesIO(b'{"name": "a"}\n{"name": x}\n' + b'{"name": "b"}\n' * 1000)
+    records = iter_json_records(file, read_size=16)
+
+    assert next(records) == {"name": "a"}
+    # positioned in the file, without reading the rest of it
+    with pytest.raises(ValueError, match=r"line 2 column 10 \(char 23\)"):
+        next(records)
+    assert file.tell() < 64
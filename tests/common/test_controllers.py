@@ -1,15 +1,36 @@
+from datetime import datetime
 from unittest.mock import MagicMock
 
+import pytest
 from flask_smorest.pagination import PaginationParameters
+from werkzeug.exceptions import HTTPException
 
 from app.common.auth import auth_required
-from app.common.controllers import BaseMethodView, ListMethodView
+from app.common.blueprint import ListPaginationParameters
+from app.common.controllers import (
+    BaseMethodView,
+    ListMethodView,
+    count_cache,
+    decode_cursor,
+    encode_cursor,
+)
+from app.constants import CountMode
+from app.models import DataAssetInstance, Domain
 
 
 def test_base_method_view_auth_required_decorator():
     assert auth_required in BaseMethodView.decorators
 
 
+def test_freshness_query_object_id_by_name(db_session):
+    view = BaseMethodView()
+    view.cache_models = [DataAssetInstance]
+
+    query = view.get_freshness_query(data_asset_instance_id=3, other_id=4)
+
+    assert query.statement.compile().params == {"id_1": 3}
+
+
 def test_list_method_view_get_query_raises_not_implemented():
     lm = ListMethodView()
     try:
@@ -47,6 +68,8 @@ def test_list_method_view_list():
     lm = ListMethodView()
     query = MagicMock()
     lm.get_query = MagicMock(return_value=query)
+    # count query selects the primary key only
+    query.with_entities.return_value.order_by.return_value = query
     lm.apply_order_by = MagicMock(return_value=query)
     lm.ordering = "field1"
     pagination_parameters = PaginationParameters(page=1, page_size=10)
@@ -63,9 +86,149 @@ def test_list_method_view_list_no_ordering():
     lm = ListMethodView()
     query = MagicMock()
     lm.get_query = MagicMock(return_value=query)
+    # count query selects the primary key only
+    query.with_entities.return_value.order_by.return_value = query
     lm.ordering = None
     pagination_parameters = PaginationParameters(page=1, page_size=10)
     res = lm.list(pagination_parameters)
     lm.get_query.assert_called_once()
     assert pagination_parameters.item_count == query.count.return_value
     assert res == query.paginate.return_value.items
+
+
+def test_cursor_encode_decode():
+    created_at = datetime(2023, 1, 1, 10, 30)
+    cursor = encode_cursor(created_at, 42)
+    assert decode_cursor(cursor) == (created_at, 42)
+
+
+def test_cursor_encode_decode_null():
+    assert decode_cursor(encode_cursor(None, 42)) == (None, 42)
+
+
+def test_decode_invalid_cursor(app):
+    with app.test_request_context():
+        with pytest.raises(HTTPException) as exc:
+            decode_cursor("invalid")
+    assert exc.value.code == 400
+
+
+def test_list_method_view_list_by_cursor(db_session):
+    domains = [
+        Domain(
+            name=f"cursor_{i}",
+            database="RAW",
+            db_schema="test",
+            created_at=datetime(2020, 1, 1, 0, 0, i // 2),
+        )
+        for i in range(5)
+    ]
+    db_session.add_all(domains)
+    db_session.commit()
+
+    lm = ListMethodView()
+    lm.get_query = MagicMock(
+        return_value=Domain.query.filter(Domain.name.like("cursor_%"))
+    )
+
+    pagination_parameters = ListPaginationParameters(
+        page=1, page_size=2, cursor="", count=CountMode.EXACT
+    )
+    pages = [lm.list(pagination_parameters)]
+    assert pagination_parameters.item_count == 5
+    while pagination_parameters.next_cursor:
+        pagination_parameters = ListPaginationParameters(
+            page=1, page_size=2, cursor=pagination_parameters.next_cursor
+        )
+        pages.append(lm.list(pagination_parameters))
+        # count is skipped unless asked for
+        assert pagination_parameters.item_count is None
+
+    assert [len(page) for page in pages] == [2, 2, 1]
+    # newest first, no item skipped or repeated
+    assert [d.name for page in pages for d in page] == [
+        f"cursor_{i}" for i in reversed(range(5))
+    ]
+
+
+def test_list_method_view_list_by_cursor_null(db_session):
+    domains = [
+        Domain(
+            name=f"keyset_null_{i}",
+            database="RAW",
+            db_schema="test",
+            created_at=datetime(2020, 1, 1),
+        )
+        for i in range(5)
+    ]
+    db_session.add_all(domains)
+    db_session.commit()
+    # created_at has a server default, NULL it after the insert
+    Domain.query.filter(Domain.id.in_([d.id for d in domains[2:]])).update(
+        {Domain.created_at: None}, synchronize_session=False
+    )
+    db_session.commit()
+
+    lm = ListMethodView()
+    lm.get_query = MagicMock(
+        return_value=Domain.query.filter(Domain.name.like("keyset_null_%"))
+    )
+
+    pagination_parameters = ListPaginationParameters(page=1, page_size=2, cursor="")
+    pages = [lm.list(pagination_parameters)]
+    while pagination_parameters.next_cursor:
+        pagination_parameters = ListPaginationParameters(
+            page=1, page_size=2, cursor=pagination_parameters.next_cursor
+        )
+        pages.append(lm.list(pagination_parameters))
+
+    # items without created_at last, no item skipped or repeated
+    assert [d.name for page in pages for d in page] == [
+        "keyset_null_1",
+        "keyset_null_0",
+        "keyset_null_4",
+        "keyset_null_3",
+        "keyset_null_2",
+    ]
+
+
+def test_list_method_view_cached_count(db_session):
+    db_session.add_all(
+        [Domain(name=f"count_{i}", database="RAW", db_schema="test") for i in range(3)]
+    )
+    db_session.commit()
+    count_cache.invalidate()
+
+    lm = ListMethodView()
+    lm.get_query = lambda: Domain.query.filter(Domain.name.like("count_%"))
+
+    pagination_parameters = ListPaginationParameters(1, 10, count=CountMode.CACHED)
+    lm.list(pagination_parameters)
+    assert pagination_parameters.item_count == 3
+    assert pagination_parameters.count_mode == CountMode.EXACT
+
+    db_session.add(Domain(name="count_3", database="RAW", db_schema="test"))
+    db_session.commit()
+
+    # served from cache
+    pagination_parameters = ListPaginationParameters(1, 10, count=CountMode.CACHED)
+    lm.list(pagination_parameters)
+    assert pagination_parameters.item_count == 3
+    assert pagination_parameters.count_mode == CountMode.CACHED
+
+    # writes invalidate the cached count
+    count_cache.invalidate(Domain)
+    pagination_parameters = ListPaginationParameters(1, 10, count=CountMode.CACHED)
+    lm.list(pagination_parameters)
+    assert pagination_parameters.item_count == 4
+
+
+def test_list_method_view_no_count(db_session):
+    lm = ListMethodView()
+    lm.get_query = lambda: Domain.query.filter(Domain.name.like("count_%"))
+
+    pagination_parameters = ListPaginationParameters(1, 2, count=CountMode.NONE)
+    items = lm.list(pagination_parameters)
+    assert len(items) == 2
+    assert pagination_parameters.item_count is None
+    assert pagination_parameters.has_next
@@ -1,11 +1,31 @@
+import pytest
+from sqlalchemy import create_engine, event
+
 from app.common.db_utils import (
     _create_object_from_params,
     _extract_model_params,
+    _merge_rows,
+    _next_ids,
+    bulk_insert,
+    bulk_upsert_by_id,
     get_or_create,
+    load_generic_relationship,
+    prewarm_pool,
+    projection_options,
     update_or_create,
     upsert_by_id,
 )
-from app.models import Domain
+from app.common.instrumentation import TimedQueuePool
+from app.constants import SchemaType
+from app.models import (
+    DataAsset,
+    DataAssetInstance,
+    Domain,
+    Schema,
+    SchemaColumn,
+    SFTPSource,
+)
+from app.schema import DataAssetSchema
 
 
 def test_create_object_from_params(db_session):
@@ -103,3 +123,334 @@ def test_upsert_by_id(db_session):
     assert new_domain.id is not None
     assert new_domain.name == "claims_105"
     assert new_domain.database == "CURATED"
+
+
+def test_bulk_upsert_by_id(db_session):
+    schema = Schema(type=SchemaType.ASSET)
+    db_session.add(schema)
+    db_session.commit()
+    existing = SchemaColumn(schema=schema, column_name="col1", data_type="string")
+    db_session.add(existing)
+    db_session.commit()
+
+    rows = [
+        {"id": existing.id, "column_name": "col1_renamed"},
+        {"schema": schema, "column_name": "col2", "data_type": "integer"},
+        {"schema_id": schema.id, "column_name": "col3", "data_type": "string"},
+    ]
+    ids = bulk_upsert_by_id(SchemaColumn, rows, db_session)
+    db_session.commit()
+
+    assert len(ids) == 3
+    assert ids[0] == existing.id
+    assert all(_id is not None for _id in ids)
+
+    updated = db_session.get(SchemaColumn, existing.id)
+    assert updated.column_name == "col1_renamed"
+    assert updated.data_type == "string"
+
+    created = db_session.get(SchemaColumn, ids[1])
+    assert created.schema_id == schema.id
+    assert created.column_name == "col2"
+    # python side defaults are applied
+    assert created.is_nullable is True
+    assert created.tags == []
+
+
+def test_bulk_upsert_by_id_resolves_ids_in_one_query(db_session):
+    domains = [
+        Domain(name=f"bulk_{i}", database="RAW", db_schema="test") for i in range(5)
+    ]
+    db_session.add_all(domains)
+    db_session.commit()
+    domain_ids = [domain.id for domain in domains]
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = db_session.get_bind()
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        bulk_upsert_by_id(
+            Domain,
+            [{"id": domain_id, "database": "CURATED"} for domain_id in domain_ids],
+            db_session,
+        )
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    db_session.commit()
+
+    assert len([s for s in statements if s.startswith("SELECT")]) == 1
+    assert len([s for s in statements if s.startswith("UPDATE")]) == 1
+    assert {d.database for d in Domain.query.filter(Domain.name.like("bulk_%"))} == {
+        "CURATED"
+    }
+
+
+def test_bulk_upsert_by_id_chunks_ids(db_session, query_counter):
+    domains = [
+        Domain(name=f"bulk_chunk_{i}", database="RAW", db_schema="test")
+        for i in range(5)
+    ]
+    db_session.add_all(domains)
+    db_session.commit()
+    rows = [{"id": domain.id, "database": "CURATED"} for domain in domains]
+    query_counter.statements.clear()
+
+    bulk_upsert_by_id(Domain, rows, db_session, chunk_size=2)
+
+    selects = [s for s in query_counter.statements if s.startswith("SELECT")]
+    assert len(selects) == 3
+
+
+def test_bulk_upsert_by_id_repeated_id(db_session, monkeypatch):
+    domain = Domain(name="bulk_repeated", database="RAW", db_schema="test")
+    db_session.add(domain)
+    db_session.commit()
+    rows = [
+        {"id": domain.id, "database": "CURATED"},
+        {"name": "bulk_repeated_new", "database": "RAW", "db_schema": "test"},
+        {"id": domain.id, "database": "ANALYTICS"},
+    ]
+
+    # the last row of an id wins
+    ids = bulk_upsert_by_id(Domain, [dict(row) for row in rows], db_session)
+    db_session.commit()
+    assert ids[0] == ids[2] == domain.id
+    assert db_session.get(Domain, domain.id).database == "ANALYTICS"
+
+    # snowflake path: a single MERGE source row per id
+    merged = []
+    monkeypatch.setattr("app.common.db_utils.SNOWFLAKE_DIALECT", "sqlite")
+    monkeypatch.setattr(
+        "app.common.db_utils._next_ids", lambda session, model, count: [90101]
+    )
+    monkeypatch.setattr(
+        "app.common.db_utils._merge_rows",
+        lambda session, model, rows: merged.extend(rows),
+    )
+    ids = bulk_upsert_by_id(Domain, [dict(row) for row in rows], db_session)
+    assert ids == [domain.id, 90101, domain.id]
+    assert [row["id"] for row in merged] == [90101, domain.id]
+    assert merged[1]["database"] == "ANALYTICS"
+
+
+def test_bulk_upsert_by_id_invalid_field(db_session):
+    with pytest.raises(TypeError):
+        bulk_upsert_by_id(Domain, [{"unknown": 1}], db_session)
+
+    assert bulk_upsert_by_id(Domain, [], db_session) == []
+
+
+def test_bulk_insert(db_session):
+    schema = Schema(type=SchemaType.ASSET)
+    db_session.add(schema)
+    db_session.commit()
+
+    rows = [
+        {"schema": schema, "column_name": "col1", "data_type": "string"},
+        {"schema_id": schema.id, "column_name": "col2", "data_type": "integer"},
+    ]
+    ids = bulk_insert(SchemaColumn, rows, db_session)
+    db_session.commit()
+
+    assert [db_session.get(SchemaColumn, _id).column_name for _id in ids] == [
+        "col1",
+        "col2",
+    ]
+    assert db_session.get(SchemaColumn, ids[0]).is_nullable is True
+    assert bulk_insert(SchemaColumn, [], db_session) == []
+
+
+def test_bulk_insert_multi_row(db_session, monkeypatch, query_counter):
+    # snowflake path: allocated ids, one INSERT per column set and chunk
+    schema = Schema(type=SchemaType.ASSET)
+    db_session.add(schema)
+    db_session.commit()
+    monkeypatch.setattr("app.common.db_utils.SNOWFLAKE_DIALECT", "sqlite")
+    monkeypatch.setattr(
+        "app.common.db_utils._next_ids",
+        lambda session, model, count: list(range(90001, 90001 + count)),
+    )
+    query_counter.statements.clear()
+
+    rows = [
+        {"schema_id": schema.id, "column_name": f"col{i}", "data_type": "string"}
+        for i in range(3)
+    ] + [
+        {
+            "schema_id": schema.id,
+            "column_name": "col3",
+            "data_type": "string",
+            "column_number": 3,
+        }
+    ]
+    ids = bulk_insert(SchemaColumn, rows, db_session, chunk_size=2)
+    db_session.commit()
+
+    assert ids == [90001, 90002, 90003, 90004]
+    inserts = [s for s in query_counter.statements if s.startswith("INSERT")]
+    assert len(inserts) == 3
+    assert db_session.get(SchemaColumn, 90004).column_number == 3
+
+
+class _SnowflakeSession:
+    """Session recording the statements executed on a Snowflake bind"""
+
+    def __init__(self, dialect, result=()):
+        self.dialect = dialect
+        self.result = result
+        self.executed = []
+
+    def get_bind(self, mapper=None):
+        return self
+
+    def execute(self, statement, params=None):
+        self.executed.append((statement, params))
+        return self.result
+
+    def compiled(self):
+        return [
+            str(statement.compile(dialect=self.dialect))
+            for statement, _ in self.executed
+        ]
+
+
+def test_next_ids_snowflake():
+    snowflake = pytest.importorskip("snowflake.sqlalchemy")
+    session = _SnowflakeSession(snowflake.dialect(), result=[(7,), (8,), (9,)])
+
+    assert _next_ids(session, Domain, 3) == [7, 8, 9]
+
+    (sql,) = session.compiled()
+    assert sql == (
+        "SELECT configuration.domain_id_seq.nextval "
+        "FROM TABLE(GENERATOR(ROWCOUNT => %(count)s))"
+    )
+    assert session.executed[0][1] == {"count": 3}
+
+
+def test_merge_rows_snowflake():
+    snowflake = pytest.importorskip("snowflake.sqlalchemy")
+    session = _SnowflakeSession(snowflake.dialect())
+    rows = [
+        {"id": 1, "name": "a", "database": "DB"},
+        {"id": 2, "name": "b"},
+        {"id": 3, "name": "c", "database": "DB"},
+    ]
+
+    _merge_rows(session, Domain, rows)
+
+    # one MERGE per column set, sourced from a VALUES clause of its rows
+    merges = session.compiled()
+    assert len(merges) == 2
+    for merge in merges:
+        assert merge.startswith("MERGE INTO configuration.domain USING (VALUES ")
+        assert "ON configuration.domain.id = source.id" in merge
+        assert "WHEN MATCHED THEN UPDATE SET" in merge
+        assert "updated_at = CURRENT_TIMESTAMP" in merge
+        assert "WHEN NOT MATCHED THEN INSERT" in merge
+    database_merge, name_merge = merges
+    assert "database = source.database" in database_merge
+    assert "database" not in name_merge
+    source = session.executed[0][0].source
+    assert [c.name for c in source.columns] == ["database", "id", "name"]
+
+
+def test_prewarm_pool():
+    # connections are opened in other threads
+    engine = create_engine(
+        "sqlite://",
+        poolclass=TimedQueuePool,
+        pool_size=3,
+        connect_args={"check_same_thread": False},
+    )
+    connects = []
+    event.listen(engine, "connect", lambda *args: connects.append(1))
+
+    prewarm_pool(engine, 3)
+
+    assert len(connects) == 3
+    assert engine.pool.checkedin() == 3
+    # requests reuse the pre-opened connections
+    with engine.connect():
+        pass
+    assert len(connects) == 3
+
+    prewarm_pool(engine, 0)
+    assert len(connects) == 3
+
+
+def test_projection_options(db_session):
+    # Given
+    domain = Domain(name="projection", database="RAW", db_schema="test")
+    db_session.add(
+        DataAsset(
+            name="projection_asset",
+            description="long text",
+            s3_bucket="bucket",
+            s3_partition_path="year={year}/",
+            instance_default_database="RAW",
+            instance_default_db_schema="test",
+            domain=domain,
+            schema=Schema(type=SchemaType.ASSET),
+        )
+    )
+    db_session.commit()
+    domain_id = domain.id
+    db_session.expunge_all()
+    schema = DataAssetSchema(only=["id", "name", "domain"])
+
+    # When
+    options = projection_options(DataAsset, schema, include=["created_at"])
+    query = DataAsset.query.filter_by(name="projection_asset").options(*options)
+    sql = str(query.statement.compile())
+    data_asset = query.one()
+
+    # Then
+    assert "description" not in sql
+    assert "created_at" in sql
+    assert "domain_id" in sql
+    assert "description" not in data_asset.__dict__
+    assert schema.dump(data_asset) == {
+        "id": data_asset.id,
+        "name": "projection_asset",
+        "domain": {"id": domain_id, "name": "projection"},
+    }
+
+
+def test_load_generic_relationship(db_session, query_counter):
+    # Given
+    sources = [
+        SFTPSource(host="host", user=f"user{i}", passphrase="secret", source_path="/")
+        for i in range(2)
+    ]
+    db_session.add_all(sources)
+    db_session.commit()
+    source_ids = [source.id for source in sources]
+    db_session.expunge_all()
+    query_counter.statements.clear()
+    instances = [
+        DataAssetInstance(source_type="SFTPSource", source_id=source_ids[0]),
+        DataAssetInstance(source_type="SFTPSource", source_id=source_ids[1]),
+        DataAssetInstance(source_type="SFTPSource", source_id=source_ids[0]),
+        DataAssetInstance(source_type="SFTPSource", source_id=0),
+        DataAssetInstance(source_type="UnknownSource", source_id=source_ids[0]),
+    ]
+
+    # When
+    load_generic_relationship(instances, "source", chunk_size=1)
+
+    # Then one query per chunk of ids, none on access
+    assert query_counter.count == 3
+    assert [instance.source.user for instance in instances[:3]] == [
+        "user0",
+        "user1",
+        "user0",
+    ]
+    assert instances[3].source is None
+    assert instances[4].source is None
+    assert query_counter.count == 3
+    assert load_generic_relationship([], "source") == []
@@ -0,0 +1,84 @@
+import logging
+from unittest.mock import MagicMock
+
+import pytest
+from flask import g
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from app import sql_instrumentation
+from app.common import instrumentation
+from app.common.instrumentation import (
+    TimedQueuePool,
+    add_server_timing,
+    fingerprint,
+)
+from app.common.logging import custom_formatter
+
+
+def test_fingerprint():
+    statement = "SELECT id\n  FROM domain\n WHERE id = ?"
+    assert fingerprint(statement) == "SELECT id FROM domain WHERE id = ?"
+
+
+def test_server_timing_header(client, no_auth, db_session):
+    response = client.get("/v1/domains/")
+
+    assert response.status_code == 200
+    timing = response.headers["Server-Timing"]
+    # count + select
+    assert 'db;desc="2 queries"' in timing
+    assert "total;dur=" in timing
+
+
+def test_failed_statement_timed(app):
+    engine = create_engine("sqlite://")
+    with app.test_request_context(), engine.connect() as connection:
+        count = g.get("sql_count", 0)
+        with pytest.raises(OperationalError):
+            connection.execute(text("SELECT * FROM missing_table"))
+
+        assert connection.info["query_start_time"] == []
+        assert g.sql_count == count + 1
+
+
+def test_add_server_timing(app):
+    with app.test_request_context():
+        add_server_timing("auth", 0.001)
+        add_server_timing("auth", 0.002)
+        assert round(g.server_timings["auth"][0], 3) == 0.003
+
+
+def test_slow_request_logged(client, no_auth, db_session, monkeypatch):
+    monkeypatch.setattr(sql_instrumentation, "slow_request_threshold_ms", 0)
+    logger = MagicMock()
+    monkeypatch.setattr(instrumentation, "LOGGER", logger)
+
+    client.get("/v1/domains/")
+
+    logger.warning.assert_called_once()
+    message_args = logger.warning.call_args[0]
+    assert message_args[2] == 2
+    assert "FROM" in message_args[4]
+
+
+def test_request_formatter_sql_fields(app):
+    record = logging.LogRecord("test", logging.INFO, __file__, 1, "message", (), None)
+    with app.test_request_context("/v1/domains/"):
+        g.sql_count = 3
+        g.sql_time = 0.0125
+        line = custom_formatter.format(record)
+    assert "(3 queries in 12.5ms)" in line
+
+
+def test_pool_checkout_wait(app):
+    engine = create_engine("sqlite://", poolclass=TimedQueuePool)
+    with app.test_request_context():
+        g.server_timings = {}
+        with engine.connect():
+            pass
+        assert g.server_timings["pool"][0] > 0
+
+    # outside of requests, e.g. CLI commands
+    with engine.connect():
+        pass
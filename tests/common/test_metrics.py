@@ -0,0 +1,72 @@
+from flask import Flask
+from prometheus_client import REGISTRY
+
+from app.common.metrics import Metrics, collect
+
+DOMAINS = {"method": "GET", "route": "/v1/domains/"}
+
+
+def sample(name, labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_request_metrics(client, no_auth, db_session):
+    requests_before = sample("http_requests_total", dict(DOMAINS, status="200"))
+    observations = {
+        name: sample(f"{name}_count", DOMAINS)
+        for name in (
+            "http_request_duration_seconds",
+            "auth_decode_duration_seconds",
+            "db_duration_seconds",
+            "serialization_duration_seconds",
+        )
+    }
+
+    response = client.get("/v1/domains/")
+
+    assert response.status_code == 200
+    assert sample("http_requests_total", dict(DOMAINS, status="200")) == (
+        requests_before + 1
+    )
+    for name, count in observations.items():
+        assert sample(f"{name}_count", DOMAINS) == count + 1, name
+
+
+def test_unmatched_route(client):
+    labels = {"method": "GET", "route": "unmatched", "status": "404"}
+    before = sample("http_requests_total", labels)
+
+    client.get("/v1/does-not-exist/")
+
+    assert sample("http_requests_total", labels) == before + 1
+
+
+def test_metrics_endpoint(client, no_auth, db_session):
+    client.get("/v1/domains/")
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    body = response.get_data(as_text=True)
+    assert 'http_request_duration_seconds_bucket{le="0.005",' in body
+    assert 'route="/v1/domains/"' in body
+    # scrapes are not measured
+    assert 'route="/metrics"' not in body
+
+
+def test_metrics_endpoint_auth(client):
+    # no token
+    assert client.get("/metrics").status_code == 401
+
+    app = Flask(__name__)
+    app.config["METRICS_PUBLIC"] = True
+    Metrics(app)
+    assert app.test_client().get("/metrics").status_code == 200
+
+
+def test_collect_multiprocess(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+
+    # no worker wrote samples yet
+    assert collect() == b""
@@ -1,4 +1,5 @@
 import pytest
+from sqlalchemy import event
 
 from app import create_app, db
 
@@ -22,8 +23,11 @@ def app():
         "COGNITO_JWT_HEADER_NAME": "Authorization",
         "COGNITO_ISSUER": "test-issuer",
         "COGNITO_TOKEN_URL": "https://example.com/oauth/token",
+        "COGNITO_JWKS_BACKGROUND_REFRESH": False,
         # orm
         "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:",
+        # endpoint tests run the views, tests of the cache enable it
+        "RESPONSE_CACHE": "none",
     }
     _app = create_app(config)
     with _app.app_context():
@@ -44,3 +48,37 @@ def db_session(app):
     db.create_all()
     yield db.session
     db.drop_all()
+
+
+class QueryCounter:
+    """Collects SQL statements executed on the engine"""
+
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+@pytest.fixture
+def query_counter(db_session):
+    """
+    Count SQL statements, identity map is cleared first so that
+    every statement an endpoint needs is issued.
+    """
+    db_session.expunge_all()
+    counter = QueryCounter()
+    engine = db.engine
+    event.listen(engine, "before_cursor_execute", counter)
+    yield counter
+    event.remove(engine, "before_cursor_execute", counter)
+
+
+@pytest.fixture
+def no_auth(monkeypatch):
+    """Skip Cognito authentication of the views"""
+    monkeypatch.setattr("app.common.auth._auth_required", lambda: None)
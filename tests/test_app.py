@@ -0,0 +1,7 @@
+import sys
+
+
+def test_migrate_only_loaded_by_cli(app):
+    # alembic is not imported outside of the flask CLI
+    assert "migrate" not in app.extensions
+    assert "flask_migrate" not in sys.modules
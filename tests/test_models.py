@@ -1,9 +1,12 @@
 from datetime import datetime
 
 import pytest
-from sqlalchemy import Integer
+from sqlalchemy import Integer, inspect
 
+from app import db
 from app.constants import (
+    CONFIGURATION_SCHEMA,
+    METADATA_SCHEMA,
     SchemaType,
     FileFormatType,
     CompressionAlgorithm,
@@ -481,6 +484,34 @@ def test_function_mapping_creation(
     assert function_mapping.seq_num == function_mapping_data["seq_num"]
 
 
+def test_function_mapping_instance_index(db_session):
+    indexes = inspect(db.engine).get_indexes(
+        "functionmapping", schema=CONFIGURATION_SCHEMA
+    )
+
+    assert {
+        "name": "ix_functionmapping_instance_seq",
+        "column_names": ["data_asset_instance_id", "seq_num"],
+        "unique": 0,
+    } in [
+        {key: index[key] for key in ("name", "column_names", "unique")}
+        for index in indexes
+    ]
+
+
+def test_pipeline_task_instance_index(db_session):
+    indexes = inspect(db.engine).get_indexes("pipelinetask", schema=METADATA_SCHEMA)
+
+    assert {
+        "name": "ix_pipelinetask_instance_started",
+        "column_names": ["data_asset_instance_id", "started_at"],
+        "unique": 0,
+    } in [
+        {key: index[key] for key in ("name", "column_names", "unique")}
+        for index in indexes
+    ]
+
+
 def test_pipeline_creation(pipeline_task, pipeline_task_data, data_asset_instance):
     assert pipeline_task.id is not None
     assert pipeline_task.data_asset_instance == data_asset_instance
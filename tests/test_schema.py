@@ -1,6 +1,12 @@
+import json
+from datetime import datetime, timezone
+
 import marshmallow as ma
 
-from app.common.schema import paginated_schema_factory
+from app.common.schema import compile_dump, paginated_schema_factory
+from app.constants import ScheduleType
+from app.models import Client, DataAsset, DataAssetInstance, DataProvider, Domain
+from app.schema import data_asset_instances_schema
 
 
 def test_paginated_schema_factory():
@@ -17,3 +23,81 @@ def test_paginated_schema_factory():
     assert "results" in schema.fields
     assert isinstance(schema.fields["pagination"], ma.fields.Nested)
     assert isinstance(schema.fields["results"], ma.fields.Nested)
+
+
+def _data_asset_instances():
+    created_at = datetime(2023, 1, 2, 3, 4, 5, 678901, tzinfo=timezone.utc)
+    domain = Domain(id=1, name="domain", database="DB", db_schema="SCHEMA")
+    data_asset = DataAsset(id=1, domain=domain, name="asset", s3_bucket="bucket")
+    client = Client(id=1, name="client", is_active=True)
+    return [
+        DataAssetInstance(
+            id=1,
+            data_asset=data_asset,
+            client=client,
+            data_provider=DataProvider(id=1, name="provider"),
+            source_type="SFTPSource",
+            name="instance",
+            tags=["a", "b"],
+            start_time=created_at,
+            one_off=False,
+            schedule_type=ScheduleType.EVENT,
+            created_at=created_at,
+        ),
+        # unset relationships and columns
+        DataAssetInstance(id=2, name="instance", client=client),
+    ]
+
+
+def test_compile_dump():
+    instances = _data_asset_instances()
+    dump = compile_dump(data_asset_instances_schema)
+
+    assert [dump(instance) for instance in instances] == (
+        data_asset_instances_schema.dump(instances)
+    )
+    # dicts are dumped through the schema accessors
+    assert dump({"id": 3, "name": "instance"}) == {"id": 3, "name": "instance"}
+
+
+def test_compile_dump_dict_keys():
+    class KeysSchema(ma.Schema):
+        items = ma.fields.List(ma.fields.Int())
+        keys = ma.fields.String()
+        values = ma.fields.Int()
+
+    schema = KeysSchema()
+    dump = compile_dump(schema)
+
+    # dict keys, not the dict methods of the same name
+    data = {"items": [1, 2], "keys": "a", "values": 3}
+    assert dump(data) == schema.dump(data) == data
+
+
+def test_compile_dump_hooks():
+    class HookSchema(ma.Schema):
+        id = ma.fields.Int()
+
+        @ma.post_dump
+        def wrap(self, data, **kwargs):
+            return {"data": data}
+
+    assert compile_dump(HookSchema()) is None
+
+    # falls back to the marshmallow dump
+    schema = paginated_schema_factory(HookSchema(many=True))()
+    page = {"pagination": {"page": 1}, "results": [{"id": 1}]}
+    assert schema.dump(page)["results"] == [{"data": {"id": 1}}]
+
+
+def test_paginated_schema_dump():
+    schema = paginated_schema_factory(data_asset_instances_schema)()
+    page = {
+        "pagination": {"page": 1, "page_size": 10, "count_mode": "none"},
+        "results": _data_asset_instances(),
+    }
+
+    data = schema.dump(page)
+
+    assert list(data) == ["pagination", "results"]
+    assert json.dumps(data) == json.dumps(ma.Schema.dump(schema, page))
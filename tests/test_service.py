@@ -1,8 +1,14 @@
 from app.constants import FileFormatType, SchemaType
 from app.models import (
     DataAssetInstance,
+    Domain,
+)
+from app.service import (
+    bulk_upsert_data_asset_instances,
+    stream_upsert_data_asset_instances,
+    upsert_data_asset_instance,
+    SharedParents,
 )
-from app.service import upsert_data_asset_instance
 
 
 def test_upsert_data_asset_instance(db_session):
@@ -66,3 +72,129 @@ def test_upsert_data_asset_instance(db_session):
         db_session.query(DataAssetInstance).filter_by(id=data_asset_instance.id).one()
         is not None
     )
+
+
+def _instance_data(name, domain_name):
+    return {
+        "data_asset": {
+            "name": "bulk_asset",
+            "domain": {"name": domain_name, "database": "RAW", "db_schema": "test"},
+            "schema": {
+                "type": SchemaType.ASSET,
+                "columns": [{"column_name": "col1", "data_type": "string"}],
+            },
+            "s3_bucket": "test",
+            "s3_partition_path": "test",
+            "instance_default_database": "test",
+            "instance_default_db_schema": "test",
+        },
+        "client": {"name": "bulk_client"},
+        "data_provider": {"name": "bulk_provider"},
+        "file_format": {"name": "bulk_format", "format_type": FileFormatType.CSV},
+        "schema": {"type": SchemaType.INSTANCE},
+        "source_type": "SFTPSource",
+        "name": name,
+        "materialization_type": "table",
+        "schedule_type": "EVENT",
+    }
+
+
+def test_bulk_upsert_data_asset_instances(db_session):
+    items = [_instance_data(f"bulk_instance_{i}", "claims_120") for i in range(3)]
+
+    results, committed = bulk_upsert_data_asset_instances(items)
+
+    assert committed
+    assert [result["status"] for result in results] == ["upserted"] * 3
+    instances = [db_session.get(DataAssetInstance, r["id"]) for r in results]
+    # shared parents are upserted once
+    assert len({instance.data_asset_id for instance in instances}) == 1
+    assert len({instance.client_id for instance in instances}) == 1
+    assert len({instance.file_format_id for instance in instances}) == 1
+    assert db_session.query(Domain).filter_by(name="claims_120").count() == 1
+
+
+def test_bulk_upsert_data_asset_instances_rolls_back_on_failure(db_session):
+    items = [
+        _instance_data("bulk_instance_ok", "claims_121"),
+        {"name": "missing parents"},
+        _instance_data("bulk_instance_skipped", "claims_121"),
+    ]
+
+    results, committed = bulk_upsert_data_asset_instances(items)
+
+    assert not committed
+    assert [result["status"] for result in results] == [
+        "rolled_back",
+        "failed",
+        "skipped",
+    ]
+    assert "error" in results[1]
+    assert db_session.query(Domain).filter_by(name="claims_121").count() == 0
+
+
+def test_stream_upsert_data_asset_instances(db_session):
+    items = (_instance_data(f"stream_instance_{i}", "claims_122") for i in range(5))
+
+    progress = list(stream_upsert_data_asset_instances(items, chunk_size=2))
+
+    assert [p["processed"] for p in progress] == [2, 4, 5]
+    assert progress[-1]["upserted"] == 5
+    assert all(p["committed"] for p in progress)
+    # parents are shared across chunks
+    assert db_session.query(Domain).filter_by(name="claims_122").count() == 1
+
+
+def test_shared_parents(db_session):
+    seen = SharedParents()
+    items = [_instance_data(f"shared_instance_{i}", "claims_124") for i in range(2)]
+
+    bulk_upsert_data_asset_instances(items[:1], seen=seen)
+    # only the ids of committed parents are kept
+    assert not seen._pending
+    assert seen._ids
+    bulk_upsert_data_asset_instances(items[1:], seen=seen)
+    assert db_session.query(Domain).filter_by(name="claims_124").count() == 1
+
+    # at most maxsize of them
+    seen.maxsize = 2
+    bulk_upsert_data_asset_instances(
+        [_instance_data("shared_instance_other", "claims_125")], seen=seen
+    )
+    assert len(seen._ids) == 2
+
+
+def test_stream_upsert_data_asset_instances_chunk_failure(db_session):
+    def items():
+        yield _instance_data("stream_instance_ok", "claims_123")
+        yield {"name": "missing parents"}
+        yield _instance_data("stream_instance_next_chunk", "claims_123")
+        raise ValueError("Expecting value")
+
+    progress = list(stream_upsert_data_asset_instances(items(), chunk_size=2))
+
+    assert not progress[0]["committed"]
+    assert progress[0]["errors"][0]["index"] == 1
+    assert progress[1]["committed"]
+    assert progress[1]["upserted"] == 1
+    assert progress[2] == {"processed": 3, "upserted": 1, "error": "Expecting value"}
+
+
+def test_bulk_upsert_data_asset_instances_round_trips(db_session, query_counter):
+    seen = SharedParents()
+
+    def statements(count):
+        items = [
+            _instance_data(f"trip_instance_{i}", "claims_126") for i in range(count)
+        ]
+        results, _ = bulk_upsert_data_asset_instances(items, seen=seen)
+        # update the instances by id
+        for item, result in zip(items, results):
+            item["id"] = result["id"]
+        query_counter.statements.clear()
+        _, committed = bulk_upsert_data_asset_instances(items, seen=seen)
+        assert committed
+        return query_counter.count
+
+    # one IN query and one bulk UPDATE, whatever the number of instances
+    assert statements(2) == statements(6)
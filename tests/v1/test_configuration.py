@@ -0,0 +1,345 @@
+import io
+import json
+
+import pytest
+
+from app.common.cache import LocalCacheBackend
+from app.constants import SchemaType, FileFormatType
+from app.models import DataAssetInstance, Function, FunctionArgument, FunctionMapping
+from app.service import upsert_data_asset_instance
+
+
+def _instance_data(name):
+    return {
+        "data_asset": {
+            "name": "stmt_asset",
+            "domain": {"name": name, "database": "RAW", "db_schema": "test"},
+            "schema": {
+                "type": SchemaType.ASSET,
+                "columns": [
+                    {"column_name": "col1", "data_type": "string"},
+                    {"column_name": "col2", "data_type": "integer"},
+                ],
+            },
+            "s3_bucket": "test",
+            "s3_partition_path": "test",
+            "instance_default_database": "test",
+            "instance_default_db_schema": "test",
+        },
+        "client": {"name": "stmt_client"},
+        "data_provider": {"name": "stmt_provider"},
+        "file_format": {"name": "stmt_format", "format_type": FileFormatType.CSV},
+        "data_ingest": {"name": "stmt_ingest", "source_name": "test"},
+        "schema": {
+            "type": SchemaType.INSTANCE,
+            "columns": [{"column_name": "col1", "data_type": "string"}],
+        },
+        "source": {
+            "host": "localhost",
+            "user": "root",
+            "passphrase": "secret",
+            "source_path": "/in",
+        },
+        "source_type": "SFTPSource",
+        "name": name,
+        "materialization_type": "table",
+        "schedule_type": "EVENT",
+    }
+
+
+@pytest.fixture(scope="module")
+def ids(db_session):
+    instances = [
+        upsert_data_asset_instance(_instance_data(f"stmt_instance_{i}"))
+        for i in range(3)
+    ]
+    function = Function(name="stmt_function", code="select 1")
+    function.arguments = [
+        FunctionArgument(name=f"arg{i}", data_type="string") for i in range(2)
+    ]
+    db_session.add_all(
+        [
+            FunctionMapping(
+                data_asset_instance=instances[0], function=function, seq_num=i
+            )
+            for i in range(3)
+        ]
+    )
+    db_session.commit()
+    instance = instances[0]
+    return {
+        "domain_id": instance.data_asset.domain_id,
+        "client_id": instance.client_id,
+        "data_provider_id": instance.data_provider_id,
+        "data_asset_id": instance.data_asset_id,
+        "instance_id": instance.id,
+    }
+
+
+# number of statements must not grow with the number of rows
+@pytest.mark.parametrize(
+    "url, expected_statements",
+    [
+        ("/v1/domains/", 2),
+        ("/v1/domains/{domain_id}", 1),
+        ("/v1/clients/", 2),
+        ("/v1/clients/{client_id}", 1),
+        ("/v1/data-providers/", 2),
+        ("/v1/data-providers/{data_provider_id}", 1),
+        ("/v1/data-assets/", 3),
+        ("/v1/data-assets/{data_asset_id}", 2),
+        ("/v1/data-assets/instances/", 7),
+        ("/v1/data-assets/instances/{instance_id}", 3),
+        ("/v1/data-assets/instances/{instance_id}/source", 2),
+        ("/v1/data-assets/instances/{instance_id}/bundle", 5),
+        ("/v1/data-assets/instances/{instance_id}/functions", 5),
+    ],
+)
+def test_endpoint_statement_count(
+    client, no_auth, ids, query_counter, url, expected_statements
+):
+    response = client.get(url.format(**ids))
+
+    assert response.status_code == 200
+    assert query_counter.count == expected_statements, query_counter.statements
+
+
+def test_instance_bundle(client, no_auth, ids):
+    response = client.get(f"/v1/data-assets/instances/{ids['instance_id']}/bundle")
+
+    assert response.status_code == 200
+    bundle = response.json
+    assert bundle["id"] == ids["instance_id"]
+    assert bundle["data_asset"]["id"] == ids["data_asset_id"]
+    assert [c["column_name"] for c in bundle["schema"]["columns"]] == ["col1"]
+    assert bundle["file_format"]["name"] == "stmt_format"
+    assert bundle["source"]["source_path"] == "/in"
+    # without credentials, like the instance
+    assert "passphrase" not in bundle["source"]
+    mappings = bundle["function_mappings"]
+    assert [m["seq_num"] for m in mappings] == [0, 1, 2]
+    assert [a["name"] for a in mappings[0]["function"]["arguments"]] == [
+        "arg0",
+        "arg1",
+    ]
+
+
+def test_instance_source_credentials(client, no_auth, ids):
+    instance_url = f"/v1/data-assets/instances/{ids['instance_id']}"
+
+    instance = client.get(instance_url).json
+    listed = client.get("/v1/data-assets/instances/").json["results"]
+
+    # instances dump their source without credentials
+    assert instance["source"]["source_path"] == "/in"
+    assert "passphrase" not in instance["source"]
+    assert any(item["source"] for item in listed)
+    assert all("passphrase" not in (item["source"] or {}) for item in listed)
+    assert "passphrase" not in client.get(f"{instance_url}/bundle").json["source"]
+
+
+def test_instance_bundle_not_found(client, no_auth, db_session):
+    response = client.get("/v1/data-assets/instances/0/bundle")
+
+    assert response.status_code == 404
+
+
+def test_function_mappings_of_instance(client, no_auth, ids):
+    other_instance = DataAssetInstance.query.filter_by(name="stmt_instance_1").one()
+
+    response = client.get(f"/v1/data-assets/instances/{ids['instance_id']}/functions")
+    other_response = client.get(
+        f"/v1/data-assets/instances/{other_instance.id}/functions"
+    )
+
+    assert response.json["pagination"]["total"] == 3
+    assert [m["seq_num"] for m in response.json["results"]] == [0, 1, 2]
+    # mappings of other instances are not listed
+    assert other_response.json["pagination"]["total"] == 0
+    assert other_response.json["results"] == []
+
+
+# list endpoints only select the columns their schema dumps
+@pytest.mark.parametrize(
+    "url, unselected_columns",
+    [
+        ("/v1/data-assets/", ["dataasset.schema_id", "domain.database"]),
+        (
+            "/v1/data-assets/instances/",
+            ["dataassetinstance.file_format_id", "dataasset.description"],
+        ),
+        (
+            "/v1/data-assets/instances/{instance_id}/functions",
+            ["functionmapping.deleted_at", "function.deleted_at"],
+        ),
+    ],
+)
+def test_list_endpoint_projection(
+    client, no_auth, ids, query_counter, url, unselected_columns
+):
+    response = client.get(url.format(**ids))
+
+    assert response.status_code == 200
+    for column in unselected_columns:
+        assert all(column not in s for s in query_counter.statements), column
+
+
+@pytest.fixture
+def response_cache(app, monkeypatch):
+    monkeypatch.setitem(app.extensions, "response_cache", LocalCacheBackend(16))
+
+
+def test_conditional_get(client, no_auth, ids, query_counter, response_cache):
+    url = f"/v1/data-assets/instances/{ids['instance_id']}"
+    response = client.get(url)
+    etag = response.headers["ETag"]
+    query_counter.statements.clear()
+
+    response = client.get(url, headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert not response.data
+    # freshness check only
+    assert query_counter.count == 1
+
+
+def test_conditional_get_list(client, no_auth, ids, query_counter, response_cache):
+    response = client.get("/v1/domains/")
+    query_counter.statements.clear()
+
+    response = client.get(
+        "/v1/domains/", headers={"If-None-Match": response.headers["ETag"]}
+    )
+
+    assert response.status_code == 304
+    assert query_counter.count == 1
+    # other pages have other ETags
+    response = client.get(
+        "/v1/domains/?page_size=1", headers={"If-None-Match": response.headers["ETag"]}
+    )
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize(
+    "query_string", [{"cursor": ""}, {"count": "none"}, {"count": "cached"}]
+)
+def test_conditional_get_list_uncounted(
+    client, no_auth, ids, query_counter, response_cache, query_string
+):
+    # count cached by the first request
+    client.get("/v1/domains/", query_string=query_string)
+    response = client.get("/v1/domains/", query_string=query_string)
+    etag = response.headers["ETag"]
+    query_counter.statements.clear()
+
+    response = client.get(
+        "/v1/domains/", query_string=query_string, headers={"If-None-Match": etag}
+    )
+
+    assert response.status_code == 304
+    # no aggregate over all the domains, only the page (and the count asked for)
+    assert not any("max(" in s for s in query_counter.statements)
+    assert query_counter.count == 1
+
+
+def test_conditional_get_without_cache(client, no_auth, ids, query_counter):
+    url = f"/v1/domains/{ids['domain_id']}"
+    etag = client.get(url).headers["ETag"]
+    query_counter.statements.clear()
+
+    response = client.get(url, headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+    # the view only, no freshness query
+    assert not any("max(" in s for s in query_counter.statements)
+
+
+def test_list_cached_count_mode(client, no_auth, ids, response_cache):
+    client.get("/v1/domains/", query_string={"count": "cached"})
+    response = client.get(
+        "/v1/domains/", query_string={"count": "cached", "page_size": 1}
+    )
+
+    assert response.json["pagination"]["count_mode"] == "cached"
+
+
+def test_response_cache(client, no_auth, ids, query_counter, response_cache):
+    url = f"/v1/data-assets/instances/{ids['instance_id']}"
+    response = client.get(url)
+    query_counter.statements.clear()
+
+    cached_response = client.get(url)
+
+    assert cached_response.status_code == 200
+    assert cached_response.headers["ETag"] == response.headers["ETag"]
+    assert cached_response.json == response.json
+    assert cached_response.content_type == response.content_type
+    assert query_counter.count == 1
+
+
+def test_response_cache_invalidated_by_service(
+    client, no_auth, ids, db_session, response_cache
+):
+    url = f"/v1/data-assets/{ids['data_asset_id']}"
+    response = client.get(url)
+    etag = response.headers["ETag"]
+
+    # nested domain written through the service, data asset row is unchanged
+    data = _instance_data("stmt_instance_0")
+    data["data_asset"]["domain"].update(id=ids["domain_id"], database="CHANGED")
+    upsert_data_asset_instance(data)
+
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def _upload(items):
+    ndjson = "".join(json.dumps(item, default=str) + "\n" for item in items)
+    return {"file": (io.BytesIO(ndjson.encode("utf-8")), "instances.ndjson")}
+
+
+def test_instance_stream_upsert(client, no_auth, db_session):
+    items = [_instance_data(f"stream_upload_{i}") for i in range(3)]
+
+    response = client.post(
+        "/v1/data-assets/instances/stream-upsert?chunk_size=2",
+        data=_upload(items),
+        content_type="multipart/form-data",
+    )
+
+    assert response.status_code == 200
+    progress = [json.loads(line) for line in response.data.splitlines()]
+    assert [p["processed"] for p in progress] == [2, 3]
+    assert all(p["committed"] for p in progress)
+    names = [item["name"] for item in items]
+    assert (
+        DataAssetInstance.query.filter(DataAssetInstance.name.in_(names)).count() == 3
+    )
+
+
+def test_instance_stream_upsert_chunk_failure(client, no_auth, db_session):
+    items = [_instance_data(f"stream_failure_{i}") for i in range(4)]
+    # the second chunk fails, after the first one is committed
+    del items[2]["client"]
+
+    response = client.post(
+        "/v1/data-assets/instances/stream-upsert?chunk_size=2",
+        data=_upload(items),
+        content_type="multipart/form-data",
+    )
+
+    assert response.status_code == 400
+    first, second = [json.loads(line) for line in response.data.splitlines()]
+    assert first["committed"]
+    assert not second["committed"]
+    assert second["errors"][0]["index"] == 2
+    # the rows of the first chunk are written before the response
+    names = [item["name"] for item in items]
+    assert [
+        instance.name
+        for instance in DataAssetInstance.query.filter(
+            DataAssetInstance.name.in_(names)
+        ).order_by(DataAssetInstance.name)
+    ] == names[:2]
@@ -0,0 +1,745 @@
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.common import write_behind
+from app.common.db_utils import IN_CLAUSE_CHUNK_SIZE
+from app.common.write_behind import WriteBehindBuffer
+from app.constants import PipelineTaskState, PipelineTaskStatus, PipelineTaskType
+from app.models import PipelineTask
+from app.service import (
+    LeaseSweeper,
+    claim_pipeline_tasks,
+    requeue_expired_leases,
+    transition_pipeline_task,
+    upsert_data_asset_instance,
+)
+from app.v1 import metadata
+from tests.v1.test_configuration import _instance_data
+
+
+@pytest.fixture(scope="module")
+def instance_ids(db_session):
+    return [
+        upsert_data_asset_instance(_instance_data(f"task_instance_{i}")).id
+        for i in range(2)
+    ]
+
+
+def _task(instance_id, **kwargs):
+    task = {
+        "data_asset_instance_id": instance_id,
+        "service_name": "bifrost",
+        "task_type": "TRANSFER",
+        "state": "QUEUED",
+    }
+    task.update(kwargs)
+    return task
+
+
+def test_bulk_create(client, no_auth, instance_ids):
+    tasks = [_task(instance_ids[0], external_id=str(i)) for i in range(3)]
+
+    response = client.post("/v1/pipeline-tasks/bulk", json=tasks)
+
+    assert response.status_code == 200
+    results = response.json
+    assert [result["index"] for result in results] == [0, 1, 2]
+    assert all(result["status"] == "created" for result in results)
+    created = [PipelineTask.query.get(result["id"]) for result in results]
+    assert [task.external_id for task in created] == ["0", "1", "2"]
+    assert all(task.state == PipelineTaskState.QUEUED for task in created)
+    # server side default
+    assert all(task.started_at is not None for task in created)
+
+
+def test_bulk_create_invalid_items(client, no_auth, instance_ids):
+    count = PipelineTask.query.count()
+    tasks = [
+        _task(instance_ids[0]),
+        {"service_name": "bifrost", "task_type": "TRANSFER"},
+        _task(instance_ids[0], state="UNKNOWN"),
+    ]
+
+    response = client.post("/v1/pipeline-tasks/bulk", json=tasks)
+
+    assert response.status_code == 422
+    errors = response.json["errors"]["json"]
+    assert set(errors) == {"1", "2"}
+    assert "data_asset_instance_id" in errors["1"]
+    assert "state" in errors["2"]
+    assert PipelineTask.query.count() == count
+
+
+def test_bulk_update(client, no_auth, instance_ids, query_counter):
+    ids = [
+        result["id"]
+        for result in client.post(
+            "/v1/pipeline-tasks/bulk",
+            json=[_task(instance_id) for instance_id in instance_ids * 2],
+        ).json
+    ]
+    query_counter.statements.clear()
+
+    # mark queued tasks running by id
+    response = client.patch(
+        "/v1/pipeline-tasks/bulk",
+        json={
+            "filter": {"ids": ids[:2], "state": "QUEUED"},
+            "values": {"state": "RUNNING"},
+        },
+    )
+
+    assert response.status_code == 200
+    assert response.json == {"updated": 2}
+    updates = [s for s in query_counter.statements if s.startswith("UPDATE")]
+    assert len(updates) == 1
+
+    # cancel every queued task of an instance
+    response = client.patch(
+        "/v1/pipeline-tasks/bulk",
+        json={
+            "filter": {"data_asset_instance_id": instance_ids[0], "state": "QUEUED"},
+            "values": {"state": "CANCELLED", "status": "FAILED"},
+        },
+    )
+
+    assert response.status_code == 200
+    states = {
+        task.id: task.state
+        for task in PipelineTask.query.filter(PipelineTask.id.in_(ids))
+    }
+    assert states == {
+        ids[0]: PipelineTaskState.RUNNING,
+        ids[1]: PipelineTaskState.RUNNING,
+        ids[2]: PipelineTaskState.CANCELLED,
+        ids[3]: PipelineTaskState.QUEUED,
+    }
+    # tasks queued earlier for the instance are cancelled too
+    assert response.json["updated"] >= 1
+    cancelled = PipelineTask.query.get(ids[2])
+    assert cancelled.ended_at is not None
+
+    # other values leave the state as is
+    response = client.patch(
+        "/v1/pipeline-tasks/bulk",
+        json={"filter": {"ids": ids[:2]}, "values": {"status": "SUCCESS"}},
+    )
+    assert response.json == {"updated": 2}
+
+
+def test_bulk_create_too_many(client, no_auth, instance_ids):
+    count = PipelineTask.query.count()
+    tasks = [_task(instance_ids[0])] * (IN_CLAUSE_CHUNK_SIZE + 1)
+
+    response = client.post("/v1/pipeline-tasks/bulk", json=tasks)
+
+    assert response.status_code == 422
+    assert PipelineTask.query.count() == count
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        {
+            "filter": {"ids": list(range(IN_CLAUSE_CHUNK_SIZE + 1))},
+            "values": {"status": "SUCCESS"},
+        },
+        {"filter": {}, "values": {"state": "RUNNING"}},
+        {"filter": {"ids": [1]}, "values": {}},
+        {"filter": {"ids": [1]}, "values": {"task_type": "TRANSFER"}},
+        {"values": {"state": "RUNNING"}},
+        # state changes are transitions from the filter state
+        {"filter": {"ids": [1]}, "values": {"state": "RUNNING"}},
+        {"filter": {"ids": [1], "state": "COMPLETED"}, "values": {"state": "QUEUED"}},
+    ],
+)
+def test_bulk_update_invalid(client, no_auth, db_session, payload):
+    response = client.patch("/v1/pipeline-tasks/bulk", json=payload)
+
+    assert response.status_code == 422
+
+
+def test_list(client, no_auth, instance_ids, query_counter):
+    tasks = [
+        _task(
+            instance_ids[i % 2],
+            service_name="list",
+            state="RUNNING" if i % 3 == 0 else "QUEUED",
+            started_at=f"2023-04-0{i + 1}T00:00:00+00:00",
+        )
+        for i in range(6)
+    ]
+    ids = [
+        result["id"]
+        for result in client.post("/v1/pipeline-tasks/bulk", json=tasks).json
+    ]
+    query_counter.statements.clear()
+
+    response = client.get(
+        "/v1/pipeline-tasks",
+        query_string={
+            "service_name": "list",
+            "data_asset_instance_id": instance_ids[0],
+            "state": "RUNNING",
+        },
+    )
+
+    assert response.status_code == 200
+    assert [task["id"] for task in response.json["results"]] == [ids[0]]
+    assert response.json["pagination"]["next_cursor"] is None
+    # filters are pushed down, a single range query per page
+    (statement,) = query_counter.statements
+    assert "data_asset_instance_id = ?" in statement
+    assert "state = ?" in statement
+    assert "LIMIT" in statement
+
+    response = client.get(
+        "/v1/pipeline-tasks",
+        query_string={
+            "service_name": "list",
+            "started_after": "2023-04-02T00:00:00+00:00",
+            "started_before": "2023-04-05T00:00:00+00:00",
+        },
+    )
+
+    assert [task["id"] for task in response.json["results"]] == ids[3:0:-1]
+
+
+def test_list_keyset_pages(client, no_auth, instance_ids):
+    tasks = [
+        _task(
+            instance_ids[0],
+            service_name="pages",
+            # same started_at for some, ordered by id then
+            started_at=f"2023-05-0{i // 2 + 1}T00:00:00+00:00",
+        )
+        for i in range(5)
+    ]
+    ids = [
+        result["id"]
+        for result in client.post("/v1/pipeline-tasks/bulk", json=tasks).json
+    ]
+
+    listed = []
+    query_string = {"service_name": "pages", "page_size": 2}
+    while True:
+        response = client.get("/v1/pipeline-tasks", query_string=query_string)
+        assert response.status_code == 200
+        assert "page" not in response.json["pagination"]
+        listed += [task["id"] for task in response.json["results"]]
+        cursor = response.json["pagination"]["next_cursor"]
+        if cursor is None:
+            break
+        query_string["cursor"] = cursor
+
+    assert listed == [ids[4], ids[3], ids[2], ids[1], ids[0]]
+
+
+def test_list_invalid_filter(client, no_auth, db_session):
+    response = client.get("/v1/pipeline-tasks", query_string={"state": "UNKNOWN"})
+
+    assert response.status_code == 422
+
+
+def test_transition(client, no_auth, db_session, instance_ids, query_counter):
+    (result,) = client.post(
+        "/v1/pipeline-tasks/bulk", json=[_task(instance_ids[0])]
+    ).json
+    task_id = result["id"]
+    url = f"/v1/pipeline-tasks/{task_id}/transition"
+    query_counter.statements.clear()
+
+    response = client.post(url, json={"expected": "QUEUED", "state": "RUNNING"})
+
+    assert response.status_code == 200
+    assert response.json == {"id": task_id, "applied": True, "state": "RUNNING"}
+    # compare-and-set in a single statement
+    (statement,) = query_counter.statements
+    assert statement.startswith("UPDATE")
+    assert "state = ?" in statement.split("WHERE")[1]
+
+    # another updater expecting QUEUED lost the race
+    response = client.post(url, json={"expected": "QUEUED", "state": "CANCELLED"})
+
+    assert response.json == {"id": task_id, "applied": False, "state": "RUNNING"}
+
+    response = client.post(
+        url, json={"expected": "RUNNING", "state": "COMPLETED", "status": "SUCCESS"}
+    )
+
+    assert response.json["applied"] is True
+    db_session.expire_all()
+    task = PipelineTask.query.get(task_id)
+    assert task.state == PipelineTaskState.COMPLETED
+    assert task.status == PipelineTaskStatus.SUCCESS
+    assert task.ended_at is not None
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        {"expected": "QUEUED", "state": "COMPLETED"},
+        {"expected": "COMPLETED", "state": "RUNNING"},
+        {"expected": "RUNNING", "state": "RUNNING"},
+        {"state": "RUNNING"},
+    ],
+)
+def test_transition_invalid(client, no_auth, db_session, payload):
+    response = client.post("/v1/pipeline-tasks/1/transition", json=payload)
+
+    assert response.status_code == 422
+
+
+def test_transition_not_found(client, no_auth, db_session):
+    response = client.post(
+        "/v1/pipeline-tasks/999999/transition",
+        json={"expected": "QUEUED", "state": "RUNNING"},
+    )
+
+    assert response.status_code == 404
+
+
+def _queue(client, instance_id, service_name, count, **kwargs):
+    tasks = [
+        _task(
+            instance_id,
+            service_name=service_name,
+            started_at=f"2023-06-0{i + 1}T00:00:00+00:00",
+            **kwargs,
+        )
+        for i in range(count)
+    ]
+    return [
+        result["id"]
+        for result in client.post("/v1/pipeline-tasks/bulk", json=tasks).json
+    ]
+
+
+def test_claim(client, no_auth, instance_ids, query_counter):
+    ids = _queue(client, instance_ids[0], "claim", 3)
+    _queue(client, instance_ids[0], "claim", 1, task_type="TRANSFORM")
+    claim = {"worker_id": "w1", "service_name": "claim", "task_type": "TRANSFER"}
+    query_counter.statements.clear()
+
+    response = client.post("/v1/pipeline-tasks/claim", json=dict(claim, limit=2))
+
+    assert response.status_code == 200
+    # oldest first
+    assert [task["id"] for task in response.json] == ids[:2]
+    assert all(task["state"] == "RUNNING" for task in response.json)
+    assert all(task["lease_owner"] == "w1" for task in response.json)
+    assert all(task["lease_expires_at"] for task in response.json)
+    # conditional update picking the tasks, select of the claimed ones
+    assert [s.split()[0] for s in query_counter.statements if "pipelinetask" in s][
+        -2:
+    ] == ["UPDATE", "SELECT"]
+
+    response = client.post(
+        "/v1/pipeline-tasks/claim", json=dict(claim, worker_id="w2", limit=5)
+    )
+
+    assert [task["id"] for task in response.json] == ids[2:]
+    assert client.post("/v1/pipeline-tasks/claim", json=claim).json == []
+
+
+def test_claim_same_worker(client, no_auth, instance_ids):
+    ids = _queue(client, instance_ids[1], "claim-again", 2)
+    claim = {"service_name": "claim-again"}
+
+    # claims of a worker return the tasks of that claim only
+    (first,) = claim_pipeline_tasks("w1", lease_seconds=60, **claim)
+    (second,) = claim_pipeline_tasks("w1", lease_seconds=60, **claim)
+
+    assert [first.id, second.id] == ids
+
+
+def test_claim_many_workers(no_auth, instance_ids, client):
+    ids = _queue(client, instance_ids[1], "claim-workers", 6)
+
+    claimed = [
+        task.id
+        for worker in range(4)
+        for task in claim_pipeline_tasks(
+            f"w{worker}", limit=2, service_name="claim-workers"
+        )
+    ]
+
+    # never twice the same task
+    assert sorted(claimed) == ids
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        {"service_name": "claim"},
+        {"worker_id": "w1", "limit": 0},
+        {"worker_id": "w1", "lease_seconds": 0},
+        {"worker_id": "w1", "task_type": "UNKNOWN"},
+    ],
+)
+def test_claim_invalid(client, no_auth, db_session, payload):
+    response = client.post("/v1/pipeline-tasks/claim", json=payload)
+
+    assert response.status_code == 422
+
+
+def test_lease_renewal(client, no_auth, db_session, instance_ids):
+    (task_id,) = _queue(client, instance_ids[0], "lease", 1)
+    (task,) = client.post(
+        "/v1/pipeline-tasks/claim",
+        json={"worker_id": "w1", "service_name": "lease", "lease_seconds": 10},
+    ).json
+    url = f"/v1/pipeline-tasks/{task_id}/lease"
+
+    response = client.post(url, json={"worker_id": "w1", "lease_seconds": 600})
+
+    assert response.status_code == 200
+    assert response.json["applied"] is True
+    assert response.json["lease_expires_at"] > task["lease_expires_at"]
+
+    response = client.post(url, json={"worker_id": "w2"})
+
+    assert response.json == {"id": task_id, "applied": False, "lease_expires_at": None}
+    response = client.post("/v1/pipeline-tasks/999999/lease", json={"worker_id": "w1"})
+    assert response.status_code == 404
+
+
+def test_requeue_expired_leases(client, no_auth, db_session, instance_ids):
+    (task_id,) = _queue(client, instance_ids[0], "expired", 1)
+    claim = {"service_name": "expired"}
+    (task,) = claim_pipeline_tasks("w1", **claim)
+    # worker w1 stopped renewing its lease
+    PipelineTask.query.filter_by(id=task_id).update(
+        {"lease_expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)}
+    )
+    db_session.commit()
+
+    assert requeue_expired_leases() >= 1
+
+    db_session.expire_all()
+    task = PipelineTask.query.get(task_id)
+    assert task.state == PipelineTaskState.QUEUED
+    assert task.lease_owner is None
+    (task,) = claim_pipeline_tasks("w2", **claim)
+    assert task.id == task_id
+
+    # w1 can not complete the task w2 claimed since
+    transition = {"expected": "RUNNING", "state": "COMPLETED"}
+    response = client.post(
+        f"/v1/pipeline-tasks/{task_id}/transition",
+        json=dict(transition, worker_id="w1"),
+    )
+    assert response.json["applied"] is False
+    # nor by omitting its worker id
+    response = client.post(f"/v1/pipeline-tasks/{task_id}/transition", json=transition)
+    assert response.json["applied"] is False
+    response = client.post(
+        f"/v1/pipeline-tasks/{task_id}/transition",
+        json=dict(transition, worker_id="w2"),
+    )
+    assert response.json["applied"] is True
+
+    # finished tasks are not leased anymore
+    db_session.expire_all()
+    task = PipelineTask.query.get(task_id)
+    assert task.lease_owner is None
+    assert task.lease_expires_at is None
+
+
+def test_lease_sweeper(db_session, monkeypatch):
+    sweeps = []
+    monkeypatch.setattr(
+        "app.service.requeue_expired_leases", lambda: sweeps.append(1) or 1
+    )
+    sweeper = LeaseSweeper()
+
+    assert sweeper.maybe_sweep(0) == 1
+    assert sweeper.maybe_sweep(60) == 1
+    # within the interval
+    assert sweeper.maybe_sweep(60) == 0
+    assert len(sweeps) == 2
+
+
+@pytest.fixture
+def task_buffer(app, tmp_path, monkeypatch):
+    config = {
+        "PIPELINE_TASK_WRITE_BEHIND": True,
+        "PIPELINE_TASK_BUFFER_PATH": str(tmp_path / "tasks.sqlite"),
+        "PIPELINE_TASK_FLUSH_SIZE": 100,
+        # flushed by the tests
+        "PIPELINE_TASK_FLUSH_INTERVAL": 0,
+    }
+    for key, value in config.items():
+        monkeypatch.setitem(app.config, key, value)
+    buffer = WriteBehindBuffer(PipelineTask, "PIPELINE_TASK", app)
+    monkeypatch.setattr(metadata, "task_buffer", buffer)
+    return buffer
+
+
+def test_write_behind(
+    client, no_auth, db_session, instance_ids, task_buffer, query_counter
+):
+    response = client.post("/v1/pipeline-tasks", json=_task(instance_ids[0]))
+    assert response.status_code == 200
+    task_id = response.json["id"]
+    assert response.json["state"] == "QUEUED"
+    assert response.json["started_at"] is not None
+
+    response = client.patch(f"/v1/pipeline-tasks/{task_id}", json={"external_id": "x"})
+    assert response.status_code == 200
+    assert response.json["external_id"] == "x"
+
+    # acknowledged without writing to the database
+    assert not any(
+        statement.startswith(("INSERT", "UPDATE"))
+        for statement in query_counter.statements
+    )
+    assert PipelineTask.query.get(task_id) is None
+
+    # reads see the buffered state
+    response = client.get(f"/v1/pipeline-tasks/{task_id}")
+    assert response.status_code == 200
+    assert response.json["state"] == "QUEUED"
+    assert response.json["external_id"] == "x"
+    assert response.json["data_asset_instance_id"] == instance_ids[0]
+
+    assert task_buffer.flush() == 2
+    assert task_buffer.pending() == 0
+    task = PipelineTask.query.get(task_id)
+    assert task.state == PipelineTaskState.QUEUED
+    assert task.external_id == "x"
+
+    # updates of flushed tasks are buffered too
+    response = client.patch(f"/v1/pipeline-tasks/{task_id}", json={"status": "SUCCESS"})
+    assert response.json["status"] == "SUCCESS"
+    assert response.json["external_id"] == "x"
+    assert client.get(f"/v1/pipeline-tasks/{task_id}").json["status"] == "SUCCESS"
+    task_buffer.flush()
+    db_session.expire_all()
+    assert PipelineTask.query.get(task_id).status == PipelineTaskStatus.SUCCESS
+
+
+def test_write_behind_bulk(client, no_auth, instance_ids, task_buffer, query_counter):
+    tasks = [_task(instance_ids[1], external_id=f"wb-{i}") for i in range(3)]
+
+    response = client.post("/v1/pipeline-tasks/bulk", json=tasks)
+
+    assert response.status_code == 200
+    ids = [result["id"] for result in response.json]
+    assert len(set(ids)) == 3
+    assert task_buffer.pending() == 3
+    assert client.get(f"/v1/pipeline-tasks/{ids[2]}").json["external_id"] == "wb-2"
+
+    # set based updates are applied after the buffered writes
+    response = client.patch(
+        "/v1/pipeline-tasks/bulk",
+        json={
+            "filter": {"ids": ids, "state": "QUEUED"},
+            "values": {"state": "CANCELLED"},
+        },
+    )
+    assert response.json == {"updated": 3}
+    assert task_buffer.pending() == 0
+    # the buffered tasks are inserted with a single statement
+    inserts = [s for s in query_counter.statements if s.startswith("INSERT")]
+    assert len(inserts) == 1
+
+
+def test_write_behind_flush_size(client, no_auth, instance_ids, task_buffer):
+    task_buffer.flush_size = 2
+
+    client.post("/v1/pipeline-tasks", json=_task(instance_ids[0]))
+    assert task_buffer.pending() == 1
+    client.post("/v1/pipeline-tasks", json=_task(instance_ids[0]))
+    assert task_buffer.pending() == 0
+
+
+def test_write_behind_sequence_ids(app, task_buffer, instance_ids, monkeypatch):
+    # snowflake path: ids reserved in blocks of the sequence
+    blocks = []
+
+    def next_ids(session, model, count):
+        # the journal is not locked during the round trip
+        other = sqlite3.connect(task_buffer.path, timeout=0, isolation_level=None)
+        other.execute("BEGIN IMMEDIATE")
+        other.execute("ROLLBACK")
+        other.close()
+        start = 90001 + sum(blocks)
+        blocks.append(count)
+        return list(range(start, start + count))
+
+    monkeypatch.setattr(task_buffer, "_has_sequence", lambda: True)
+    monkeypatch.setattr(write_behind, "_next_ids", next_ids)
+    monkeypatch.setattr(write_behind, "ID_BLOCK_SIZE", 3)
+    task = {
+        "data_asset_instance_id": instance_ids[0],
+        "service_name": "bifrost",
+        "task_type": PipelineTaskType.TRANSFER,
+    }
+
+    first = task_buffer.insert_many([dict(task), dict(task)])
+    second = task_buffer.insert_many([dict(task), dict(task)])
+
+    assert [t.id for t in first + second] == [90001, 90002, 90003, 90004]
+    assert blocks == [3, 3]
+    assert task_buffer.get(90004).service_name == "bifrost"
+
+
+def test_write_behind_single_flusher(app, task_buffer, instance_ids):
+    other = WriteBehindBuffer(PipelineTask, "PIPELINE_TASK", app)
+    task_buffer.insert(
+        {
+            "data_asset_instance_id": instance_ids[0],
+            "service_name": "bifrost",
+            "task_type": PipelineTaskType.TRANSFER,
+        }
+    )
+
+    assert task_buffer._acquire_flush_lease("other-worker")
+    assert other.flush() == 0
+    assert task_buffer.pending() == 1
+    task_buffer._release_flush_lease("other-worker")
+    assert other.flush() == 1
+
+
+@pytest.mark.parametrize("buffered", [False, True])
+def test_update_state(client, no_auth, instance_ids, request, buffered):
+    if buffered:
+        request.getfixturevalue("task_buffer")
+    task_id = client.post("/v1/pipeline-tasks", json=_task(instance_ids[0])).json["id"]
+    url = f"/v1/pipeline-tasks/{task_id}"
+
+    response = client.patch(url, json={"state": "RUNNING", "external_id": "x"})
+
+    assert response.status_code == 200
+    assert response.json["state"] == "RUNNING"
+    assert response.json["external_id"] == "x"
+
+    # compare-and-set from the current state, along the graph only
+    response = client.patch(url, json={"state": "QUEUED"})
+    assert response.status_code == 409
+
+    response = client.patch(url, json={"state": "COMPLETED", "status": "SUCCESS"})
+    assert response.status_code == 200
+    assert response.json["state"] == "COMPLETED"
+    assert response.json["status"] == "SUCCESS"
+    assert response.json["ended_at"] is not None
+
+
+def test_update_state_concurrent(client, no_auth, instance_ids, monkeypatch):
+    task_id = client.post("/v1/pipeline-tasks", json=_task(instance_ids[0])).json["id"]
+
+    def transition_after_other_updater(task_id, expected, state, **values):
+        # another updater cancels the task after it was read
+        transition_pipeline_task(
+            task_id, PipelineTaskState.QUEUED, PipelineTaskState.CANCELLED
+        )
+        return transition_pipeline_task(task_id, expected, state, **values)
+
+    monkeypatch.setattr(
+        metadata, "transition_pipeline_task", transition_after_other_updater
+    )
+
+    response = client.patch(
+        f"/v1/pipeline-tasks/{task_id}", json={"state": "RUNNING", "external_id": "x"}
+    )
+
+    assert response.status_code == 409
+    task = client.get(f"/v1/pipeline-tasks/{task_id}").json
+    assert task["state"] == "CANCELLED"
+    assert task["external_id"] is None
+
+
+def test_write_behind_transition_claim(client, no_auth, instance_ids, task_buffer):
+    ids = [
+        result["id"]
+        for result in client.post(
+            "/v1/pipeline-tasks/bulk",
+            json=[_task(instance_ids[0], service_name="wb-claim") for _ in range(2)],
+        ).json
+    ]
+
+    # claims do not flush the buffer, buffered tasks are claimable once flushed
+    claim = {"worker_id": "w1", "service_name": "wb-claim"}
+    assert client.post("/v1/pipeline-tasks/claim", json=claim).json == []
+    assert task_buffer.pending() == 2
+
+    # transitions flush the writes of their task only
+    response = client.post(
+        f"/v1/pipeline-tasks/{ids[0]}/transition",
+        json={"expected": "QUEUED", "state": "CANCELLED"},
+    )
+    assert response.json["applied"] is True
+    assert task_buffer.pending([ids[0]]) == 0
+    assert task_buffer.pending() == 1
+
+
+def test_write_behind_drain_timeout(
+    client, no_auth, instance_ids, task_buffer, monkeypatch
+):
+    task_id = client.post("/v1/pipeline-tasks", json=_task(instance_ids[0])).json["id"]
+    drain = task_buffer.drain
+    monkeypatch.setattr(task_buffer, "drain", lambda ids=None: drain(ids, timeout=0))
+    # another worker is flushing
+    assert task_buffer._acquire_flush_lease("other-worker")
+
+    response = client.post(
+        f"/v1/pipeline-tasks/{task_id}/transition",
+        json={"expected": "QUEUED", "state": "CANCELLED"},
+    )
+
+    assert response.status_code == 503
+    task_buffer._release_flush_lease("other-worker")
+
+
+def test_write_behind_requires_buffer_path(app, monkeypatch):
+    monkeypatch.setitem(app.config, "PIPELINE_TASK_WRITE_BEHIND", True)
+    monkeypatch.delitem(app.config, "PIPELINE_TASK_BUFFER_PATH", raising=False)
+    with pytest.raises(ValueError, match="PIPELINE_TASK_BUFFER_PATH"):
+        WriteBehindBuffer(PipelineTask, "PIPELINE_TASK", app)
+
+
+def test_write_behind_connects_per_process(app, task_buffer, monkeypatch):
+    # nothing is opened before the first write (in the preloaded master)
+    assert getattr(task_buffer._local, "connection", None) is None
+    connection = task_buffer._connect()
+    assert task_buffer._connect() is connection
+
+    monkeypatch.setattr(os, "getpid", lambda: -1)
+    assert task_buffer._connect() is not connection
+
+
+def test_write_behind_flush_lease_lost(app, task_buffer, instance_ids, monkeypatch):
+    task_buffer.insert(
+        {
+            "data_asset_instance_id": instance_ids[0],
+            "service_name": "bifrost",
+            "task_type": PipelineTaskType.TRANSFER,
+        }
+    )
+
+    def upsert(model, rows):
+        # the lease expired and another worker took it over meanwhile
+        task_buffer._connect().execute(
+            "UPDATE locks SET owner = 'other-worker', expires = ?",
+            (time.time() + 60,),
+        )
+
+    monkeypatch.setattr(write_behind, "bulk_upsert_by_id", upsert)
+    assert task_buffer.flush() == 0
+    # not deleted from the journal, flushed by the new owner
+    assert task_buffer.pending() == 1
+    assert task_buffer._connect().execute("SELECT owner FROM locks").fetchone() == (
+        "other-worker",
+    )
+
+
+def test_write_behind_not_found(client, no_auth, task_buffer):
+    assert client.get("/v1/pipeline-tasks/999999").status_code == 404
+    response = client.patch("/v1/pipeline-tasks/999999", json={"external_id": "x"})
+    assert response.status_code == 404
+    assert task_buffer.pending() == 0